@@ -2,49 +2,20 @@
 import os
 import pandas as pd
 import numpy as np
-from astropy.io import fits
-from astropy.wcs import WCS
 import argparse
 import re
 import glob
 import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hetu import skygeom
+from hetu.bbox import bbox_array, validate_bboxes
+from hetu.executor import add_executor_arguments, executor_from_args
+
 def log(message, level="INFO"):
     """Logging function with level indicator"""
     print(f"[{level}] {message}", file=sys.stderr, flush=True)
 
-def parse_bbox(bbox_str):
-    """Parse bounding box string into a list of floats"""
-    bbox_str = bbox_str.strip('[]')
-    return [float(s) for s in bbox_str.split(',')]
-
-def validate_bbox(xmin, ymin, xmax, ymax):
-    """Validate bounding box coordinates"""
-    if xmin < 0 or ymin < 0 or xmax <= xmin or ymax <= ymin:
-        return False
-    return True
-
-def normalize_ra(ra_deg):
-    """Normalize Right Ascension to 0-360 degrees"""
-    return ra_deg % 360
-
-def is_ra_within(ra, ra_min, ra_max):
-    """Check if RA is within specified range (handles 0-360 boundary)"""
-    ra_min_norm = normalize_ra(ra_min)
-    ra_max_norm = normalize_ra(ra_max)
-    ra_norm = normalize_ra(ra)
-    
-    if ra_min_norm <= ra_max_norm:
-        return ra_min_norm <= ra_norm <= ra_max_norm
-    else:
-        return (ra_min_norm <= ra_norm <= 360) or (0 <= ra_norm <= ra_max_norm)
-
-def calculate_ra_distance(ra1, ra2):
-    """Calculate minimum angular distance between two RAs (0-180 degrees)"""
-    ra1_norm = normalize_ra(ra1)
-    ra2_norm = normalize_ra(ra2)
-    delta = abs(ra1_norm - ra2_norm)
-    return min(delta, 360 - delta)
-
 def find_matching_fits(csv_path, fits_parent_dir):
     """Find matching FITS folder and files for a CSV file"""
     csv_basename = os.path.basename(csv_path)
@@ -64,6 +35,57 @@ def find_matching_fits(csv_path, fits_parent_dir):
         fits_map[core_id] = (fits_folder, fits_path)
     return fits_map
 
+def pixel_to_world(wcs, header, x, y):
+    """Convert arrays of pixel coordinates (x, y) to RA/DEC with one WCS call"""
+    pix_coords = np.zeros((len(x), wcs.naxis))
+    pix_coords[:, 0] = x
+    pix_coords[:, 1] = y
+    # 对于4D FITS，固定频率和Stokes参数为参考值
+    for axis in range(2, wcs.naxis):
+        pix_coords[:, axis] = header.get(f'CRPIX{axis + 1}', 0)
+    world_coords = wcs.all_pix2world(pix_coords, 0)
+    return world_coords[:, 0], world_coords[:, 1]  # 返回RA/DEC
+
+def convert_fits_group(fits_path, bboxes):
+    """Sky coordinates for all bboxes of one FITS cutout; None if the header has no WCS"""
+    from astropy.io import fits
+    from astropy.wcs import WCS
+
+    header = fits.getheader(fits_path, 0)
+    if 'CRVAL1' not in header or 'CRVAL2' not in header:
+        return None
+    wcs = WCS(header)
+    xmin, ymin, xmax, ymax = bboxes.T
+    # 转换边界框的四个角点和中心
+    ra_a, dec_a = pixel_to_world(wcs, header, xmin, ymin)
+    ra_b, dec_b = pixel_to_world(wcs, header, xmax, ymax)
+    ra_center_bbox, dec_center_bbox = pixel_to_world(wcs, header, (xmin + xmax) / 2, (ymin + ymax) / 2)
+
+    # 获取FITS图像的参考中心坐标
+    ra_center = header['CRVAL1']
+    dec_center = header['CRVAL2']
+
+    # RA环绕: 区间从ra_min向东跨越width度, 跨越0度时ra_min > ra_max
+    ra_start, ra_width = skygeom.ra_interval(ra_a, ra_b)
+    ra_min, ra_max = skygeom.ra_interval_bounds(ra_start, ra_width)
+    dec_min, dec_max = np.minimum(dec_a, dec_b), np.maximum(dec_a, dec_b)
+
+    # 计算与参考中心的位置关系
+    is_inside = (skygeom.ra_in_interval(ra_center, ra_start, ra_width)
+                 & (dec_min <= dec_center) & (dec_center <= dec_max))
+    return {
+        'fits_center_ra': ra_center,
+        'fits_center_dec': dec_center,
+        'bbox_center_ra': skygeom.normalize_ra(ra_center_bbox),
+        'bbox_center_dec': dec_center_bbox,
+        'bbox_ra_min': ra_min,
+        'bbox_ra_max': ra_max,
+        'bbox_dec_min': dec_min,
+        'bbox_dec_max': dec_max,
+        'is_inside_bbox': is_inside,
+        'angular_distance': skygeom.angular_distance(ra_center, dec_center, ra_center_bbox, dec_center_bbox),
+    }
+
 def process_csv_file(csv_file, fits_parent_dir, output_dir):
     """Process a single CSV file and convert pixel coordinates to celestial coordinates"""
     csv_data = pd.read_csv(csv_file)
@@ -72,87 +94,34 @@ def process_csv_file(csv_file, fits_parent_dir, output_dir):
         print(f"No matching FITS folder found for: {os.path.basename(csv_file)}")
         return False
 
+    # Parse (typed columns or legacy bbox strings) and validate all bboxes in one pass
+    bboxes = bbox_array(csv_data).astype(np.float64)
+    valid_bbox = validate_bboxes(bboxes)
+    core_ids = csv_data['component_id'].astype(str).str.replace(r'\.[^.]*$', '', regex=True)
+    has_fits = core_ids.isin(fits_map).to_numpy()
+    missing_fits = int((~has_fits).sum())
+
+    # Every FITS header is read and its WCS built once, for all bboxes of that cutout
     results = []
-    matched_records = 0
-    missing_fits = 0
-    
-    for _, row in csv_data.iterrows():
+    selected = pd.Series(np.flatnonzero(has_fits & valid_bbox))
+    for core_id, rows in selected.groupby(core_ids.to_numpy()[selected.to_numpy()]):
+        rows = rows.to_numpy()
         try:
-            component_id = row['component_id']
-            core_id = os.path.splitext(component_id)[0]
-            if core_id not in fits_map:
-                missing_fits += 1
-                continue
-
-            fits_folder, fits_path = fits_map[core_id]
-            bbox = parse_bbox(str(row['bbox']))
-            if len(bbox) < 4:
-                continue
-            xmin, ymin, xmax, ymax = bbox
-            
-            if not validate_bbox(xmin, ymin, xmax, ymax):
-                continue
-
-            with fits.open(fits_path) as hdul:
-                header = hdul[0].header
-                if 'CRVAL1' not in header or 'CRVAL2' not in header:
-                    continue
-                    
-                wcs = WCS(header)
-                 # 定义内部函数进行坐标转换
-                def convert_pixel_to_world(x, y):
-                    """Convert pixel coordinates (x, y) to RA/DEC using WCS"""
-                    # 对于4D FITS，固定频率和Stokes参数为参考值
-                    pix_coords = np.array([[x, y, header['CRPIX3'], header['CRPIX4']]])
-                    world_coords = wcs.all_pix2world(pix_coords, 0)
-                    return world_coords[0][0], world_coords[0][1]  # 返回RA/DEC
-
-                                # 转换边界框的四个角点
-                ra_min, dec_min = convert_pixel_to_world(xmin, ymin)
-                ra_max, dec_max = convert_pixel_to_world(xmax, ymax)
-                ra_center_bbox, dec_center_bbox = convert_pixel_to_world((xmin+xmax)/2, (ymin+ymax)/2)
-                
-                # 获取FITS图像的参考中心坐标
-                ra_center = header['CRVAL1']
-                dec_center = header['CRVAL2']
-                
-                # 处理RA环绕问题
-                if ra_min > ra_max:
-                    ra_min, ra_max = ra_max, ra_min
-                    
-                # 计算与参考中心的位置关系
-                is_inside = (ra_min <= ra_center <= ra_max) and (dec_min <= dec_center <= dec_max)
-                delta_ra = (ra_center - ra_center_bbox) * np.cos(np.radians(dec_center))
-                angular_distance = np.hypot(delta_ra, dec_center - dec_center_bbox)
-                
-                # 获取频率和Stokes参数
-                #freq_val = header['CRVAL3']
-                #stokes_val = header['CRVAL4']
-                result_row = {
-                    **row.to_dict(),
-                    'fits_id': core_id,
-                    'fits_center_ra': ra_center,
-                    'fits_center_dec': dec_center,
-                    'bbox_center_ra': ra_center_bbox,
-                    'bbox_center_dec': dec_center_bbox,
-                    'bbox_ra_min': ra_min,
-                    'bbox_ra_max': ra_max,
-                    'bbox_dec_min': dec_min,
-                    'bbox_dec_max': dec_max,
-                    'is_inside_bbox': is_inside,
-                    'angular_distance': angular_distance
-                }
-                results.append(result_row)
-                matched_records += 1
-                
+            columns = convert_fits_group(fits_map[core_id][1], bboxes[rows])
         except Exception as e:
-            print(f"Error processing {component_id}: {str(e)}")
+            print(f"Error processing {core_id}: {str(e)}")
+            continue
+        if columns is None:
             continue
+        group = csv_data.iloc[rows].assign(fits_id=core_id, **columns)
+        group.index = rows
+        results.append(group)
 
     if results:
         output_file = os.path.join(output_dir, f"wcs_{os.path.basename(csv_file)}")
-        pd.DataFrame(results).to_csv(output_file, index=False)
-        print(f"Successfully processed {matched_records} records, {missing_fits} missing FITS files")
+        output = pd.concat(results).sort_index()
+        output.to_csv(output_file, index=False)
+        print(f"{os.path.basename(csv_file)}: successfully processed {len(output)} records, {missing_fits} missing FITS files")
         return True
     return False
 
@@ -162,6 +131,7 @@ def main():
     parser.add_argument('-c', '--csv_dir', required=True, help='Directory containing CSV files')
     parser.add_argument('-f', '--fits_parent_dir', required=True, help='Base directory containing FITS folders')
     parser.add_argument('-o', '--output_dir', default='wcs_results', help='Output directory for results')
+    add_executor_arguments(parser)
     args = parser.parse_args()
 
     # Ensure output directory exists
@@ -173,9 +143,12 @@ def main():
     print(f"Found {len(csv_files)} CSV files in directory {args.csv_dir}")
     
     success_count = 0
-    for csv_file in csv_files:
-        print(f"\nProcessing CSV file: {os.path.basename(csv_file)}")
-        if process_csv_file(csv_file, args.fits_parent_dir, args.output_dir):
+    n = len(csv_files)
+    for csv_file, ok, error in executor_from_args(args).run(process_csv_file, csv_files, [args.fits_parent_dir] * n,
+                                                            [args.output_dir] * n):
+        if error is not None:
+            print(f"Error processing {os.path.basename(csv_file)}: {error}")
+        elif ok:
             success_count += 1
     
     print(f"\nBatch processing completed: Successfully processed {success_count}/{len(csv_files)} CSV files")
@@ -1,10 +1,15 @@
 import pandas as pd
+import numpy as np
 import argparse
 import os
+import sys
 import time
-from rtree import index
 import glob
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hetu import skygeom
+from hetu.executor import add_executor_arguments, executor_from_args
+
 def is_overlapping_or_containing(box1, box2):
     """Determine if two bounding boxes overlap"""
     x1_1, y1_1, x2_1, y2_1 = box1
@@ -19,7 +24,16 @@ def process_data(input_df):
     # Sort by score in descending order to prioritize higher scores
     sorted_df = input_df.sort_values('score', ascending=False).reset_index(drop=True)
     
+    # RA intervals unwrapped around the field's circular mean RA, so boxes on both
+    # sides of RA=0/360 get continuous coordinates in the planar R-tree
+    ra_start, ra_width = skygeom.interval_from_bounds(sorted_df['bbox_ra_min'].to_numpy(),
+                                                      sorted_df['bbox_ra_max'].to_numpy())
+    ra_left = skygeom.unwrap_ra(ra_start, skygeom.circular_mean_ra(ra_start))
+    boxes = np.column_stack([ra_left, sorted_df['bbox_dec_min'].to_numpy(),
+                             ra_left + ra_width, sorted_df['bbox_dec_max'].to_numpy()])
+    
     # Create R-tree spatial index
+    from rtree import index
     p = index.Property()
     idx = index.Index(properties=p)
     
@@ -27,10 +41,7 @@ def process_data(input_df):
     final_indices = []
     
     # Iterate through each bounding box
-    for i, row in sorted_df.iterrows():
-        bbox = (row['bbox_ra_min'], row['bbox_dec_min'], 
-                row['bbox_ra_max'], row['bbox_dec_max'])
-        
+    for i, bbox in enumerate(boxes.tolist()):
         # Query all boxes overlapping with current box
         overlapping_indices = list(idx.intersection(bbox))
         
@@ -95,7 +106,8 @@ def main():
     parser = argparse.ArgumentParser(description='Batch process CSV files to remove overlapping bounding boxes')
     parser.add_argument('--input_dir', required=True, help='Input directory containing CSV files')
     parser.add_argument('--output_dir', required=True, help='Output directory for processed CSV files')
-    parser.add_argument('--parallel', action='store_true', help='Enable parallel processing (requires joblib)')
+    parser.add_argument('--parallel', action='store_true', help='Same as --backend processes (kept for old job scripts)')
+    add_executor_arguments(parser)
     args = parser.parse_args()
     
     # Check input directory
@@ -115,28 +127,17 @@ def main():
     
     print(f"Found {len(csv_files)} CSV files to process in '{args.input_dir}'")
     
-    # Process files (sequential or parallel)
+    # Process files with the selected executor backend (--parallel is kept as --backend processes)
     if args.parallel:
-        try:
-            from joblib import Parallel, delayed
-            print("Using parallel processing...")
-            results = Parallel(n_jobs=-1, verbose=10)(
-                delayed(process_single_csv)(f, args.output_dir) for f in csv_files
-            )
-            success_count = sum(results)
-        except ImportError:
-            print("Parallel processing enabled but joblib not installed, falling back to sequential processing")
-            success_count = 0
-            for f in csv_files:
-                if process_single_csv(f, args.output_dir):
-                    success_count += 1
-    else:
-        print("Using sequential processing...")
-        success_count = 0
-        for i, f in enumerate(csv_files):
-            print(f"\nProcessing file {i+1}/{len(csv_files)}:")
-            if process_single_csv(f, args.output_dir):
-                success_count += 1
+        args.backend = 'processes'
+    executor = executor_from_args(args)
+    print(f"Using {executor}...")
+    success_count = 0
+    for f, ok, error in executor.run(process_single_csv, csv_files, [args.output_dir] * len(csv_files)):
+        if error is not None:
+            print(f"Error processing {f}: {error}")
+        elif ok:
+            success_count += 1
     
     print(f"\nBatch processing completed: Successfully processed {success_count}/{len(csv_files)} CSV files")
 
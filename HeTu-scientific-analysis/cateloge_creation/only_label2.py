@@ -1,6 +1,13 @@
 import json
 import os
+import sys
 import csv
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hetu.bbox import BBOX_COLUMNS
+from hetu.masks import suppress
+from hetu.shards import ShardReader, list_shards
 
 
 def is_overlapping(box1, box2):
@@ -17,6 +24,8 @@ def is_overlapping(box1, box2):
 
 
 def process_json_data(json_data):
+    if suppression == 'mask':
+        return process_json_data_mask(json_data)
     labels = json_data["labels"]
     scores = json_data["scores"]
     bboxes = json_data["bboxes"]
@@ -64,68 +73,115 @@ def process_json_data(json_data):
     return result
 
 
+def process_json_data_mask(json_data):
+    """按掩膜 IoU 去重（hetu.masks.suppress，直接在 RLE 上计算），只有掩膜重叠足够多才视为重复"""
+    keep = suppress(json_data["scores"], json_data["bboxes"], json_data["masks"], mask_iou_threshold)
+    return {key: [json_data[key][k] for k in keep] for key in ("labels", "scores", "bboxes", "masks")}
+
+
+def write_result(writer, filename, result):
+    """写入处理后的结果到 CSV 文件，bbox 写成四个 float32 列，包含counts信息"""
+    for label, score, bbox, mask in zip(result["labels"], result["scores"], result["bboxes"], result["masks"]):
+        counts = mask.get("counts", "")  # 获取counts，如果不存在则为空字符串
+        row = {
+            'component_id': filename,
+            'label': label,
+            'score': score,
+            'counts': counts
+        }
+        row.update(zip(BBOX_COLUMNS, np.asarray(bbox[:4], dtype=np.float32)))
+        writer.writerow(row)
+
+
+def open_writer(parent_folder_name):
+    """创建或打开对应 SBID 的 CSV 文件"""
+    csv_file = os.path.join(output_path, f"{parent_folder_name}.csv")
+    csvfile = open(csv_file, 'w', newline='')
+    fieldnames = ['component_id', 'label', 'score'] + BBOX_COLUMNS + ['counts']
+    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    writer.writeheader()
+    return csvfile, writer
+
+
+def process_shards(shard_dir):
+    """直接读取 python -m hetu.shards pack 生成的 <SBID>.hshard，避免逐个打开 JSON"""
+    for shard_path in list_shards(shard_dir):
+        with ShardReader(shard_path) as reader:
+            csvfile, writer = open_writer(reader.meta['sbid'])
+            for filename, cutout in reader.iter_cutouts():
+                data = {
+                    "labels": cutout["labels"].tolist(),
+                    "scores": cutout["scores"].tolist(),
+                    "bboxes": cutout["bboxes"].tolist(),
+                    "masks": cutout["masks"]
+                }
+                write_result(writer, filename, process_json_data(data))
+            csvfile.close()
+            print(f"Processed shard {shard_path}: {reader.n_cutouts} cutouts")
+
+
+def process_json_tree(root_directory):
+    # 遍历根目录下的所有文件夹
+    for root, dirs, files in os.walk(root_directory):
+        if not any(file.endswith('.json') for file in files):
+            continue
+
+        # 获取上一级文件夹名
+        parent_folder_name = os.path.basename(os.path.dirname(root))
+
+        # 创建或打开CSV文件
+        csvfile, writer = open_writer(parent_folder_name)
+
+        # 遍历当前文件夹下的所有文件
+        for filename in files:
+            if filename.endswith('.json'):
+                file_path = os.path.join(root, filename)
+                try:
+                    # 打开文件并读取 JSON 数据
+                    with open(file_path, 'r') as file:
+                        json_str = file.read()
+
+                    # 解析 JSON 数据
+                    data = json.loads(json_str)
+                    print(f"Successfully parsed {file_path}, data length: {len(data.get('labels', []))}")
+
+                    # 处理数据
+                    result = process_json_data(data)
+                    print(f"Processed result for {file_path}: {result}")  # 打印处理后的结果
+
+                    # 写入处理后的结果到 CSV 文件，包含counts信息
+                    write_result(writer, filename, result)
+                    csvfile.flush()  # 立即刷新缓冲区
+
+                except FileNotFoundError:
+                    print(f"{file_path} not found")
+                except json.JSONDecodeError:
+                    print(f"{file_path} not effective json")
+                except KeyError as e:
+                    print(f"KeyError in {file_path}: {e}")
+                    print(f"Available keys: {list(data.keys())}")
+                except Exception as e:
+                    print(f"Unexpected error in {file_path}: {e}")
+
+        # 关闭当前文件夹对应的CSV文件
+        csvfile.close()
+
+
 # 指定根目录，这里需要你修改为实际存放 JSON 文件的根目录
 root_directory = '/groups/hetu_ai/home/share/HeTu/pjlab/AI4Astronomy_zhuanyi/output_resnet/'
+# 若已用 python -m hetu.shards pack 打包为 <SBID>.hshard，填写 shard 目录后直接读取 shard（不再逐个打开 JSON）
+shard_directory = None
 # 指定输出路径，这里需要你修改为想要生成 CSV 文件的目标路径
 output_path = '/home/ydai240628/analysis_hetu/file/only_label/output_resnet'
+# 去重方式：'bbox' 为边界框接触即合并（原方法）；'mask' 为掩膜 IoU >= mask_iou_threshold 才合并
+suppression = 'bbox'
+mask_iou_threshold = 0.5
 
 # 确保输出路径存在，如果不存在则创建
 if not os.path.exists(output_path):
     os.makedirs(output_path)
 
-# 遍历根目录下的所有文件夹
-for root, dirs, files in os.walk(root_directory):
-    if not any(file.endswith('.json') for file in files):
-        continue
-
-    # 获取上一级文件夹名
-    parent_folder_name = os.path.basename(os.path.dirname(root))
-    
-    # 创建或打开CSV文件
-    csv_file = os.path.join(output_path, f"{parent_folder_name}.csv")
-    csvfile = open(csv_file, 'w', newline='')
-    fieldnames = ['component_id', 'label', 'score', 'bbox', 'counts']
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-    writer.writeheader()
-
-    # 遍历当前文件夹下的所有文件
-    for filename in files:
-        if filename.endswith('.json'):
-            file_path = os.path.join(root, filename)
-            try:
-                # 打开文件并读取 JSON 数据
-                with open(file_path, 'r') as file:
-                    json_str = file.read()
-
-                # 解析 JSON 数据
-                data = json.loads(json_str)
-                print(f"Successfully parsed {file_path}, data length: {len(data.get('labels', []))}")
-
-                # 处理数据
-                result = process_json_data(data)
-                print(f"Processed result for {file_path}: {result}")  # 打印处理后的结果
-
-                # 写入处理后的结果到 CSV 文件，包含counts信息
-                for label, score, bbox, mask in zip(result["labels"], result["scores"], result["bboxes"], result["masks"]):
-                    counts = mask.get("counts", "")  # 获取counts，如果不存在则为空字符串
-                    writer.writerow({
-                        'component_id': filename,
-                        'label': label,
-                        'score': score,
-                        'bbox': str(bbox),
-                        'counts': counts
-                    })
-                csvfile.flush()  # 立即刷新缓冲区
-
-            except FileNotFoundError:
-                print(f"{file_path} not found")
-            except json.JSONDecodeError:
-                print(f"{file_path} not effective json")
-            except KeyError as e:
-                print(f"KeyError in {file_path}: {e}")
-                print(f"Available keys: {list(data.keys())}")
-            except Exception as e:
-                print(f"Unexpected error in {file_path}: {e}")
-    
-    # 关闭当前文件夹对应的CSV文件
-    csvfile.close()
+if shard_directory:
+    process_shards(shard_directory)
+else:
+    process_json_tree(root_directory)
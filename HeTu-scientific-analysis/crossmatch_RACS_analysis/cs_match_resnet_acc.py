@@ -1,24 +1,19 @@
 import os
-import pandas as pd
+import sys
 
-# 设置包含 txt 文件的目录，请根据需要修改路径
-txt_dir = "/home/ydai240628/analysis_hetu/code/output_internimage_0722/txt/"  
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hetu.results import read_results
+
+# 设置 match_cs*.py 写出的结果表路径，请根据需要修改
+results_table = "/home/ydai240628/analysis_hetu/code/crossmatch_results.csv"
+model = "internimage_0722"
 # 输出 CSV 文件路径
 output_csv = "cs_match_internimage_0722.csv"
 
-data = []
-
-# 遍历目录中的所有文件
-for filename in os.listdir(txt_dir):
-    if filename.lower().endswith(".txt"):
-        file_path = os.path.join(txt_dir, filename)
-        with open(file_path, "r", encoding="utf-8") as f:
-            # 读取每个 txt 文件中的第一行内容，并去除首尾空白字符
-            content = f.readline().strip()
-            data.append((filename, content))
+# 一次读取整张结果表，只保留当前模型的记录
+df = read_results(results_table, model=model)
+df = df[['SBID', 'matched', 'total', 'fraction', 'median_sep_arcsec']]
 
-# 将数据转换为 DataFrame，设置列名
-df = pd.DataFrame(data, columns=["component_id", "Content"])
 # 保存为 CSV 文件，不保存行索引
 df.to_csv(output_csv, index=False, encoding="utf-8")
 
@@ -1,29 +1,34 @@
 #!/usr/bin/env python
 import os
 import re
+import sys
 import pandas as pd
 from astropy.coordinates import SkyCoord
 import astropy.units as u
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hetu.executor import Executor
+from hetu.results import ResultsWriter, make_record
+
 # 设置目录（请根据实际情况修改）
 dirA = '/groups/hetu_ai/home/share/racs-mid-csv/'   # 存放 A 星表的目录
 dirB = '/groups/hetu_ai/home/share/HeTu/xzj_code/rst/output_resnet/csv/'   # 存放 B 星表的目录
 output_dir1 = 'output_resnet/csv'
-output_dir2 = 'output_resnet/txt'
-
-os.makedirs(output_dir1, exist_ok=True)
-os.makedirs(output_dir1, exist_ok=True)
+model = 'resnet'   # 写入结果表的模型名
+results_table = 'crossmatch_results.csv'   # 所有模型、所有 SB 共用的结果表
 
 # 用于提取文件名中的 SB_数字部分，支持 "SB33098" 或 "SB_33098" 格式
 pattern = re.compile(r"(SB[_]?(\d+))", re.IGNORECASE)
 
-# 遍历 A 目录中的 CSV 文件
-for fileA in os.listdir(dirA):
+
+# 处理 A 目录中的一个 CSV 文件
+def match_sb(fileA):
+    """Crossmatch one A catalog with its B counterpart; returns its results record or None"""
     if not fileA.lower().endswith('.csv'):
-        continue
+        return None
     matchA = pattern.search(fileA)
     if not matchA:
-        continue
+        return None
     sb_part = matchA.group(1)  # 如 "SB_33098" 或 "SB33098"
     
     # 在 B 目录中查找包含相同 sb_part 的文件（不区分大小写）
@@ -31,7 +36,7 @@ for fileA in os.listdir(dirA):
                   if f.lower().endswith('.csv') and sb_part.lower() in f.lower()]
     if not candidates:
         print(f"No matching B file found for {fileA}.")
-        continue
+        return None
     # 这里取第一个匹配的文件（可根据需要调整策略）
     fileB = candidates[0]
     
@@ -75,8 +80,21 @@ for fileA in os.listdir(dirA):
     matched_count = len(matched)
     match_fraction = matched_count / total_A if total_A > 0 else 0
     
-    out_ratio = os.path.join(output_dir2, f"match_ratio_{sb_part}.txt")
-    with open(out_ratio, 'w') as f:
-        f.write("Matched A sources / Total A sources: {} / {} = {:.2%}\n"
-                .format(matched_count, total_A, match_fraction))
+    sb_num = matchA.group(2)
     print(matched_count, total_A, match_fraction)
+    # 返回一条结构化记录，由主进程写入结果表（替代 match_ratio_*.txt）
+    return make_record(sb_num, model, matched_count, total_A, matched['Separation_arcsec'],
+                       label=1, radius_arcsec=match_threshold.to_value(u.arcsec))
+
+
+if __name__ == "__main__":
+    os.makedirs(output_dir1, exist_ok=True)
+    writer = ResultsWriter(results_table)
+    # 每个 SB 作为一个任务并行处理，结果按顺序写入结果表
+    for fileA, record, error in Executor().run(match_sb, os.listdir(dirA)):
+        if error is not None:
+            print(f"Error processing {fileA}: {error}")
+        elif record is not None:
+            writer.append(record)
+    writer.close()
+    print(f"Match records saved to '{results_table}'.")
@@ -1,29 +1,34 @@
 #!/usr/bin/env python
 import os
 import re
+import sys
 import pandas as pd
 from astropy.coordinates import SkyCoord
 import astropy.units as u
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hetu.executor import Executor
+from hetu.results import ResultsWriter, make_record
+
 # Set directories (modify as needed)
 dirA = '/groups/hetu_ai/home/share/racs-mid-csv/'   # Directory for A catalog CSV files
 dirB = '/groups/hetu_ai/home/share/HeTu/xzj_code/rst/output_internimage_0722/csv/'   # Directory for B catalog CSV files
 output_dir1 = 'output_internimage_0722/csv'
-output_dir2 = 'output_internimage_0722/txt'
-
-os.makedirs(output_dir1, exist_ok=True)
-os.makedirs(output_dir2, exist_ok=True)
+model = 'internimage_0722'   # Model name written to the results table
+results_table = 'crossmatch_results.csv'   # One typed record per SB, shared by all models
 
 # Regular expression to extract the SB number (supports "SB33098" or "SB_33098")
 pattern = re.compile(r"(SB[_]?(\d+))", re.IGNORECASE)
 
-# Loop over CSV files in directory A
-for fileA in os.listdir(dirA):
+
+# Process one CSV file of directory A
+def match_sb(fileA):
+    """Crossmatch one A catalog with its B counterpart; returns its results record or None"""
     if not fileA.lower().endswith('.csv'):
-        continue
+        return None
     matchA = pattern.search(fileA)
     if not matchA:
-        continue
+        return None
     sb_num = matchA.group(2)  # Extract numeric part, e.g., "33098"
     
     # In directory B, find a file whose name contains the same sb_num
@@ -31,7 +36,7 @@ for fileA in os.listdir(dirA):
                   if f.lower().endswith('.csv') and sb_num in f]
     if not candidates:
         print(f"No matching B file found for {fileA}.")
-        continue
+        return None
     # Use the first matching candidate (adjust strategy if needed)
     fileB = candidates[0]
     
@@ -75,8 +80,20 @@ for fileA in os.listdir(dirA):
     matched_count = len(matched)
     match_fraction = matched_count / total_A if total_A > 0 else 0
     
-    out_ratio = os.path.join(output_dir2, f"match_ratio_SB_{sb_num}.txt")
-    with open(out_ratio, 'w') as f:
-        f.write("Matched A sources / Total A sources: {} / {} = {:.2%}\n"
-                .format(matched_count, total_A, match_fraction))
-    print(f"Match ratio saved to '{out_ratio}'.\n")
+    print(f"Matched A sources / Total A sources: {matched_count} / {total_A} = {match_fraction:.2%}\n")
+    # Typed record, appended to the results table by the main process (replaces match_ratio_SB_*.txt)
+    return make_record(sb_num, model, matched_count, total_A, matched['Separation_arcsec'],
+                       label=1, radius_arcsec=match_threshold.to_value(u.arcsec))
+
+
+if __name__ == "__main__":
+    os.makedirs(output_dir1, exist_ok=True)
+    writer = ResultsWriter(results_table)
+    # Every SB is one task; records are appended to the results table in task order
+    for fileA, record, error in Executor().run(match_sb, os.listdir(dirA)):
+        if error is not None:
+            print(f"Error processing {fileA}: {error}")
+        elif record is not None:
+            writer.append(record)
+    writer.close()
+    print(f"Match records saved to '{results_table}'.")
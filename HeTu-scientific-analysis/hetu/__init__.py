@@ -0,0 +1,6 @@
+"""
+Shared helpers for the HeTu catalog pipeline and scientific analysis scripts.
+
+Submodules are imported on demand (``from hetu import catalog``) so that
+importing the package itself stays cheap.
+"""
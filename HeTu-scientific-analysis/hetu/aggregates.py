@@ -0,0 +1,335 @@
+"""
+Incrementally maintained survey aggregates: label counts, score histograms and HEALPix maps.
+
+count.py, plot_count_final_0.5.csv and the HEALPix count maps used to be rebuilt from every
+catalog whenever one field or one model output changed. Here every SBID is reduced once to
+a mergeable partial state (FieldAggregate):
+  * a per-label score histogram (N_SCORE_BINS bins on [0, 1]); per-label counts above any
+    score cut on a bin edge (0.5 for count.py) are sums over its upper bins,
+  * a sparse per-label NESTED HEALPix count map of the detections with score >= map cut,
+  * the sum of the unit vectors of the detections (field centre).
+The store keeps the partial states and the survey totals (histograms, dense maps). All
+states are integer counts, so the totals are maintained by exact addition/subtraction:
+  * a new or modified catalog file is read once and its old state (if any) subtracted,
+  * a catalog that disappeared is retracted,
+  * a field entering the exclusion list is subtracted, and added back when it leaves it.
+Each update costs O(size of the SBID), never a survey-wide recomputation. As in
+hetu.anomaly, files are recognized by their (name, size, mtime) signature.
+
+Command line:
+    python -m hetu.aggregates /home/ydai240628/analysis_hetu/file/bbox_overlap_removal/output_internimage_0722 \
+        --state aggregates_internimage.npz --exclude-file excluded_sbids.txt \
+        --counts-out count_internimage_0.5.csv --map-out counts_nside32.fits --hist-out score_hist.csv
+"""
+import argparse
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from hetu.catalog import Catalog, files_by_sbid, resolve_column, sbid_from_path
+from hetu.executor import Executor, add_executor_arguments, executor_from_args
+from hetu.skygeom import radec_to_xyz
+
+N_SCORE_BINS = 100
+N_LABELS = 4
+MAP_ORDER = 5
+MIN_SCORE = 0.5
+CHUNK_ROWS = 500_000
+
+
+class FieldAggregate:
+    """Mergeable partial state of the detections of one field"""
+
+    def __init__(self, n_bins=N_SCORE_BINS, n_labels=N_LABELS):
+        self.score_hist = np.zeros((n_labels, n_bins), dtype=np.int64)
+        self.pixels = np.zeros(0, dtype=np.int64)
+        self.pixel_counts = np.zeros((0, n_labels), dtype=np.int64)
+        self.xyz = np.zeros(3, dtype=np.float64)
+
+    @property
+    def n_detections(self):
+        return int(self.score_hist.sum())
+
+    def update(self, scores, labels, pixels=None, xyz=None, map_min_score=MIN_SCORE):
+        """Add a batch of detections; pixels (map order) may be None when positions are unknown"""
+        n_labels, n_bins = self.score_hist.shape
+        scores = np.clip(np.asarray(scores, dtype=np.float64), 0.0, 1.0)
+        labels = np.asarray(labels, dtype=np.float64)
+        ok = np.isfinite(labels) & (labels >= 0) & (labels < n_labels) & np.isfinite(scores)
+        labels = np.where(ok, labels, 0).astype(np.int64)
+        bins = np.minimum((scores[ok] * n_bins).astype(np.int64), n_bins - 1)
+        self.score_hist += np.bincount(labels[ok] * n_bins + bins, minlength=n_labels * n_bins).reshape(n_labels, n_bins)
+        if pixels is None:
+            return
+        keep = ok & (scores >= map_min_score) & (np.asarray(pixels) >= 0)
+        self._add_pixels(np.asarray(pixels)[keep], labels[keep])
+        if xyz is not None:
+            self.xyz += np.nansum(xyz[ok], axis=0)
+
+    def _add_pixels(self, pixels, labels):
+        n_labels = self.score_hist.shape[0]
+        all_pixels = np.concatenate([self.pixels, pixels])
+        uniq, inverse = np.unique(all_pixels, return_inverse=True)
+        counts = np.zeros((len(uniq), n_labels), dtype=np.int64)
+        np.add.at(counts, inverse[:len(self.pixels)], self.pixel_counts)
+        np.add.at(counts, (inverse[len(self.pixels):], labels), 1)
+        self.pixels, self.pixel_counts = uniq, counts
+
+    def label_counts(self, min_score=0.0):
+        """Detections per label with score >= min_score (at bin resolution)"""
+        first = int(round(min_score * self.score_hist.shape[1]))
+        return self.score_hist[:, first:].sum(axis=1)
+
+    def centre(self):
+        """(RA, Dec) in degrees of the mean detection direction"""
+        x, y, z = self.xyz
+        if not np.any(self.xyz):
+            return np.nan, np.nan
+        return np.degrees(np.arctan2(y, x)) % 360.0, np.degrees(np.arctan2(z, np.hypot(x, y)))
+
+
+def aggregate_file(path, n_bins=N_SCORE_BINS, n_labels=N_LABELS, order=MAP_ORDER, map_min_score=MIN_SCORE,
+                   chunk_rows=CHUNK_ROWS):
+    """Stream one catalog file into a FieldAggregate"""
+    header = pd.read_csv(path, nrows=0).columns.tolist()
+    label_col = resolve_column('label', header)
+    ra_col, dec_col = resolve_column('ra', header), resolve_column('dec', header)
+    if 'score' not in header or label_col is None:
+        raise ValueError("missing 'score' or 'label' column")
+    with_positions = ra_col is not None and dec_col is not None
+    usecols = ['score', label_col] + ([ra_col, dec_col] if with_positions else [])
+    field = FieldAggregate(n_bins, n_labels)
+    for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunk_rows):
+        pixels = xyz = None
+        if with_positions:
+            import healpy as hp
+
+            ra, dec = chunk[ra_col].to_numpy(np.float64), chunk[dec_col].to_numpy(np.float64)
+            ok = np.isfinite(ra) & np.isfinite(dec)
+            pixels = np.full(len(chunk), -1, dtype=np.int64)
+            pixels[ok] = hp.ang2pix(2 ** order, ra[ok], dec[ok], nest=True, lonlat=True)
+            xyz = radec_to_xyz(ra, dec)
+        field.update(chunk['score'].to_numpy(), chunk[label_col].to_numpy(), pixels, xyz, map_min_score)
+    return field
+
+
+def read_sbid_list(text):
+    """SBIDs from a comma and/or whitespace separated list (the exclusion list format)"""
+    return {s for s in re.split(r'[\s,]+', text) if s}
+
+
+class AggregateStore:
+    """Per-SBID partial states, the exclusion list and the survey totals over included SBIDs"""
+
+    def __init__(self, n_bins=N_SCORE_BINS, n_labels=N_LABELS, order=MAP_ORDER, map_min_score=MIN_SCORE):
+        self.n_bins, self.n_labels, self.order, self.map_min_score = n_bins, n_labels, order, map_min_score
+        self.fields = {}
+        self.signatures = {}
+        self.excluded = set()
+        self.score_hist = np.zeros((n_labels, n_bins), dtype=np.int64)
+        self.map = np.zeros((12 * 4 ** order, n_labels), dtype=np.int64)
+
+    def _apply(self, field, sign):
+        self.score_hist += sign * field.score_hist
+        self.map[field.pixels] += sign * field.pixel_counts
+
+    def included(self, sbid):
+        return sbid in self.fields and sbid not in self.excluded
+
+    def ingest(self, sbid, field, signature=None):
+        """Add (or replace) the state of one SBID"""
+        if self.included(sbid):
+            self._apply(self.fields[sbid], -1)
+        self.fields[sbid] = field
+        self.signatures[sbid] = signature
+        if sbid not in self.excluded:
+            self._apply(field, +1)
+
+    def retract(self, sbid):
+        """Remove one SBID from the store and the totals"""
+        if self.included(sbid):
+            self._apply(self.fields[sbid], -1)
+        self.fields.pop(sbid, None)
+        self.signatures.pop(sbid, None)
+
+    def set_excluded(self, sbids):
+        """Replace the exclusion list; only the SBIDs that changed side touch the totals"""
+        sbids = {str(s) for s in sbids}
+        for sbid in sbids - self.excluded:
+            if sbid in self.fields:
+                self._apply(self.fields[sbid], -1)
+        for sbid in self.excluded - sbids:
+            if sbid in self.fields:
+                self._apply(self.fields[sbid], +1)
+        changed = len(sbids ^ self.excluded)
+        self.excluded = sbids
+        return changed
+
+    def update(self, paths, executor=None, chunk_rows=CHUNK_ROWS):
+        """Ingest new or modified files in parallel and retract SBIDs whose file disappeared"""
+        current, stale = {}, []
+        for sbid, path in files_by_sbid(paths).items():
+            st = os.stat(path)
+            signature = (os.path.basename(path), st.st_size, st.st_mtime_ns)
+            current[sbid] = signature
+            if self.signatures.get(sbid) != signature:
+                stale.append(path)
+        gone = set(self.fields) - set(current)
+        for sbid in gone:
+            self.retract(sbid)
+        if stale:
+            print(f"Aggregating {len(stale)} new or modified catalogs ({len(current) - len(stale)} unchanged)")
+            executor = executor or Executor('processes')
+            n = len(stale)
+            results = executor.run(aggregate_file, stale, [self.n_bins] * n, [self.n_labels] * n, [self.order] * n,
+                                   [self.map_min_score] * n, [chunk_rows] * n)
+            for path, field, error in results:
+                if error is not None:
+                    print(f"Skipping {os.path.basename(path)}: {error}")
+                    continue
+                sbid = sbid_from_path(path)
+                self.ingest(sbid, field, current[sbid])
+        return len(stale), len(gone)
+
+    def check(self):
+        """True when the totals equal the sum of the included states (O(number of SBIDs))"""
+        hist = np.zeros_like(self.score_hist)
+        sky = np.zeros_like(self.map)
+        for sbid, field in self.fields.items():
+            if sbid not in self.excluded:
+                hist += field.score_hist
+                sky[field.pixels] += field.pixel_counts
+        return np.array_equal(hist, self.score_hist) and np.array_equal(sky, self.map)
+
+    def per_sbid_counts(self, min_score=MIN_SCORE):
+        """count.py table: per-label counts, all and with score >= min_score, plus the field centre"""
+        rows = []
+        for sbid in sorted(self.fields):
+            field = self.fields[sbid]
+            row = {'SBID': sbid, 'file': (self.signatures.get(sbid) or ('',))[0]}
+            for label, n in enumerate(field.label_counts()):
+                row[f'label_{label}_count'] = int(n)
+            for label, n in enumerate(field.label_counts(min_score)):
+                row[f'label_{label}_count_filtered'] = int(n)
+            row['ra_centre'], row['dec_centre'] = field.centre()
+            row['excluded'] = sbid in self.excluded
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def survey_counts(self, min_score=MIN_SCORE):
+        """Survey-wide detections per label over the included SBIDs"""
+        first = int(round(min_score * self.n_bins))
+        return pd.DataFrame({'label': np.arange(self.n_labels),
+                             'count': self.score_hist.sum(axis=1),
+                             'count_filtered': self.score_hist[:, first:].sum(axis=1)})
+
+    def score_histogram(self):
+        """Survey score histogram per label over the included SBIDs"""
+        edges = np.linspace(0.0, 1.0, self.n_bins + 1)
+        table = pd.DataFrame({'score_min': edges[:-1], 'score_max': edges[1:]})
+        for label in range(self.n_labels):
+            table[f'label_{label}'] = self.score_hist[label]
+        return table
+
+    def save(self, path):
+        sbids = sorted(self.fields)
+        fields = [self.fields[s] for s in sbids]
+        signatures = [self.signatures.get(s) or ('', 0, 0) for s in sbids]
+        np.savez_compressed(
+            path,
+            config=np.array([self.n_bins, self.n_labels, self.order], dtype=np.int64),
+            map_min_score=np.float64(self.map_min_score),
+            sbids=np.array(sbids, dtype=str),
+            files=np.array([s[0] for s in signatures], dtype=str),
+            sizes=np.array([s[1] for s in signatures], dtype=np.int64),
+            mtimes=np.array([s[2] for s in signatures], dtype=np.int64),
+            excluded=np.array(sorted(self.excluded), dtype=str),
+            score_hist=np.array([f.score_hist for f in fields], dtype=np.int64).reshape(len(sbids), self.n_labels, self.n_bins),
+            xyz=np.array([f.xyz for f in fields], dtype=np.float64).reshape(len(sbids), 3),
+            pixel_offsets=np.concatenate([[0], np.cumsum([len(f.pixels) for f in fields], dtype=np.int64)]),
+            pixels=np.concatenate([f.pixels for f in fields] + [np.zeros(0, dtype=np.int64)]),
+            pixel_counts=np.concatenate([f.pixel_counts for f in fields] + [np.zeros((0, self.n_labels), dtype=np.int64)]),
+            total_score_hist=self.score_hist,
+            total_map=self.map,
+        )
+
+    @classmethod
+    def load(cls, path, **config):
+        """Stored state, or an empty store with the given configuration"""
+        if not path or not os.path.exists(path):
+            return cls(**config)
+        data = np.load(path, allow_pickle=False)
+        n_bins, n_labels, order = (int(v) for v in data['config'])
+        store = cls(n_bins, n_labels, order, float(data['map_min_score']))
+        offsets = data['pixel_offsets']
+        for i, sbid in enumerate(data['sbids']):
+            field = FieldAggregate(n_bins, n_labels)
+            field.score_hist = data['score_hist'][i].copy()
+            field.xyz = data['xyz'][i].copy()
+            field.pixels = data['pixels'][offsets[i]:offsets[i + 1]].copy()
+            field.pixel_counts = data['pixel_counts'][offsets[i]:offsets[i + 1]].copy()
+            store.fields[str(sbid)] = field
+            store.signatures[str(sbid)] = (str(data['files'][i]), int(data['sizes'][i]), int(data['mtimes'][i]))
+        store.excluded = {str(s) for s in data['excluded']}
+        store.score_hist = data['total_score_hist'].copy()
+        store.map = data['total_map'].copy()
+        return store
+
+
+def save_map(path, store):
+    """Per-label NESTED HEALPix count maps (score >= the map cut) as a FITS table"""
+    import healpy as hp
+
+    columns = [f'label_{label}' for label in range(store.n_labels)]
+    hp.write_map(path, [store.map[:, k].astype(np.float64) for k in range(store.n_labels)], nest=True, dtype=np.float64,
+                 column_names=columns, coord='C', overwrite=True,
+                 extra_header=[('MINSCORE', store.map_min_score, 'score cut of the counted detections')])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Incrementally maintained per-SBID and survey aggregates')
+    parser.add_argument('input_dir', help='Directory containing per-SBID catalog CSV files')
+    parser.add_argument('--state', default='aggregates_state.npz', help='Partial-state file for incremental updates')
+    parser.add_argument('--pattern', default='*.csv', help='Glob pattern of the catalog files')
+    parser.add_argument('--exclude', default=None, help='Comma separated SBIDs to exclude from the totals')
+    parser.add_argument('--exclude-file', default=None, help='Exclusion list file (comma/whitespace separated SBIDs)')
+    parser.add_argument('--min-score', type=float, default=MIN_SCORE, help='Score cut of the filtered counts (default 0.5)')
+    parser.add_argument('--map-order', type=int, default=MAP_ORDER, help='HEALPix order of new states (default 5, nside 32)')
+    parser.add_argument('--map-min-score', type=float, default=MIN_SCORE, help='Score cut of the maps of new states')
+    parser.add_argument('--counts-out', default=None, help='Per-SBID label counts CSV (count.py format)')
+    parser.add_argument('--map-out', default=None, help='Per-label HEALPix count maps (FITS)')
+    parser.add_argument('--hist-out', default=None, help='Survey score histogram per label (CSV)')
+    parser.add_argument('--check', action='store_true', help='Verify the totals against the stored states')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+
+    store = AggregateStore.load(args.state, order=args.map_order, map_min_score=args.map_min_score)
+    if args.exclude is not None or args.exclude_file:
+        excluded = read_sbid_list(args.exclude or '')
+        if args.exclude_file:
+            with open(args.exclude_file) as f:
+                excluded |= read_sbid_list(f.read())
+        changed = store.set_excluded(excluded)
+        print(f"Exclusion list: {len(store.excluded)} SBIDs ({changed} changed)")
+    n_new, n_gone = store.update(Catalog(args.input_dir, args.pattern).files(), executor_from_args(args))
+    print(f"{len(store.fields)} SBIDs in the store: {n_new} (re)aggregated, {n_gone} retracted")
+    store.save(args.state)
+    if args.check:
+        print(f"Totals consistent with the per-SBID states: {store.check()}")
+
+    print(store.survey_counts(args.min_score).to_string(index=False))
+    if args.counts_out:
+        store.per_sbid_counts(args.min_score).to_csv(args.counts_out, index=False)
+        print(f"Per-SBID counts saved to {args.counts_out}")
+    if args.hist_out:
+        store.score_histogram().to_csv(args.hist_out, index=False)
+        print(f"Score histograms saved to {args.hist_out}")
+    if args.map_out:
+        save_map(args.map_out, store)
+        print(f"HEALPix count maps (nside {2 ** store.order}) saved to {args.map_out}")
+
+
+if __name__ == "__main__":
+    main()
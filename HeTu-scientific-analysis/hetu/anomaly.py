@@ -0,0 +1,246 @@
+"""
+Streaming per-field anomaly detection on score and label distributions.
+
+Every SBID catalog is reduced, in one parallel pass, to a small mergeable sketch:
+  * a fixed-bin histogram of `score` on [0, 1] (approximate quantiles, low-score fraction),
+  * per-label detection counts,
+  * detections per cutout (`component_id`) as the detection density.
+Sketches are kept in a state file and only new or modified catalogs are re-read, so
+adding SBIDs is an incremental update. Each field is then compared with the survey-wide
+distribution using median/MAD robust z-scores (Iglewicz & Hoaglin modified z-score) and
+fields beyond the threshold are flagged, which replaces hand-built exclusion lists.
+
+Command line:
+    python -m hetu.anomaly /home/ydai240628/analysis_hetu/code/only_label/output_internimage_0722/ \
+        --state anomaly_state.npz -o field_anomalies.csv --exclusion-list excluded_sbids.txt
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from hetu.catalog import Catalog, files_by_sbid, resolve_column, sbid_from_path
+from hetu.executor import Executor, add_executor_arguments, executor_from_args
+
+N_SCORE_BINS = 1000
+N_LABELS = 4
+LABEL_NAMES = {0: 'CJ', 1: 'CS', 2: 'FRI', 3: 'FRII'}
+LOW_SCORE = 0.1
+QUANTILES = (0.1, 0.5, 0.9)
+Z_THRESHOLD = 3.5
+
+
+class FieldSketch:
+    """Mergeable summary of the detections of one field (or of the whole survey)"""
+
+    def __init__(self, n_bins=N_SCORE_BINS, n_labels=N_LABELS):
+        self.score_hist = np.zeros(n_bins, dtype=np.int64)
+        self.label_counts = np.zeros(n_labels, dtype=np.int64)
+        self.n_cutouts = 0
+
+    @property
+    def n_detections(self):
+        return int(self.score_hist.sum())
+
+    def update(self, scores, labels):
+        """Add a batch of detections; missing scores and labels are left out of their counts"""
+        scores = np.asarray(scores, dtype=np.float64)
+        scores = np.clip(scores[np.isfinite(scores)], 0.0, 1.0)
+        n_bins = len(self.score_hist)
+        bins = np.minimum((scores * n_bins).astype(np.int64), n_bins - 1)
+        self.score_hist += np.bincount(bins, minlength=n_bins)
+        labels = np.asarray(labels, dtype=np.float64)
+        labels = labels[np.isfinite(labels) & (labels >= 0) & (labels < len(self.label_counts))].astype(np.int64)
+        self.label_counts += np.bincount(labels, minlength=len(self.label_counts))
+
+    def merge(self, other):
+        self.score_hist += other.score_hist
+        self.label_counts += other.label_counts
+        self.n_cutouts += other.n_cutouts
+        return self
+
+    def cdf(self):
+        total = self.score_hist.sum()
+        if total == 0:
+            return np.zeros(len(self.score_hist))
+        return np.cumsum(self.score_hist) / total
+
+    def quantile(self, q):
+        """Approximate score quantile (resolution 1 / n_bins)"""
+        if self.n_detections == 0:
+            return np.nan
+        idx = np.searchsorted(self.cdf(), q, side='left')
+        return (min(idx, len(self.score_hist) - 1) + 0.5) / len(self.score_hist)
+
+    def fraction_below(self, score):
+        if self.n_detections == 0:
+            return np.nan
+        edge = int(round(score * len(self.score_hist)))
+        return self.score_hist[:edge].sum() / self.n_detections
+
+
+def sketch_file(path, chunksize=200000):
+    """Stream one catalog file into a FieldSketch"""
+    header = pd.read_csv(path, nrows=0).columns.tolist()
+    label_col = resolve_column('label', header)
+    if 'score' not in header or label_col is None:
+        raise ValueError(f"{path} missing 'score' or 'label' column")
+    usecols = ['score', label_col] + (['component_id'] if 'component_id' in header else [])
+    sketch = FieldSketch()
+    cutouts = set()
+    for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunksize):
+        sketch.update(chunk['score'].to_numpy(), chunk[label_col].to_numpy())
+        if 'component_id' in chunk:
+            cutouts.update(chunk['component_id'].unique())
+    sketch.n_cutouts = len(cutouts)
+    return sketch
+
+
+class SketchStore:
+    """Per-SBID sketches plus the (size, mtime) signature of the file they came from"""
+
+    def __init__(self):
+        self.sketches = {}
+        self.signatures = {}
+
+    @classmethod
+    def load(cls, path):
+        store = cls()
+        if not path or not os.path.exists(path):
+            return store
+        data = np.load(path, allow_pickle=False)
+        for i, sbid in enumerate(data['sbids']):
+            sketch = FieldSketch(data['score_hist'].shape[1], data['label_counts'].shape[1])
+            sketch.score_hist = data['score_hist'][i].copy()
+            sketch.label_counts = data['label_counts'][i].copy()
+            sketch.n_cutouts = int(data['n_cutouts'][i])
+            store.sketches[str(sbid)] = sketch
+            store.signatures[str(sbid)] = (str(data['files'][i]), int(data['sizes'][i]), int(data['mtimes'][i]))
+        return store
+
+    def save(self, path):
+        sbids = sorted(self.sketches)
+        np.savez_compressed(
+            path,
+            sbids=np.array(sbids, dtype=str),
+            files=np.array([self.signatures[s][0] for s in sbids], dtype=str),
+            sizes=np.array([self.signatures[s][1] for s in sbids], dtype=np.int64),
+            mtimes=np.array([self.signatures[s][2] for s in sbids], dtype=np.int64),
+            score_hist=np.array([self.sketches[s].score_hist for s in sbids]).reshape(len(sbids), -1),
+            label_counts=np.array([self.sketches[s].label_counts for s in sbids]).reshape(len(sbids), -1),
+            n_cutouts=np.array([self.sketches[s].n_cutouts for s in sbids], dtype=np.int64),
+        )
+
+    def update(self, paths, executor=None):
+        """Sketch new or modified files in parallel and drop SBIDs whose file disappeared"""
+        current, stale = {}, []
+        for sbid, path in files_by_sbid(paths).items():
+            st = os.stat(path)
+            signature = (os.path.basename(path), st.st_size, st.st_mtime_ns)
+            current[sbid] = signature
+            if self.signatures.get(sbid) != signature:
+                stale.append(path)
+        for sbid in set(self.sketches) - set(current):
+            del self.sketches[sbid]
+            del self.signatures[sbid]
+        if stale:
+            print(f"Sketching {len(stale)} new or modified catalogs ({len(current) - len(stale)} cached)")
+            executor = executor or Executor('processes')
+            for path, sketch, error in executor.run(sketch_file, stale):
+                if error is not None:
+                    print(f"Skipping {os.path.basename(path)}: {error}")
+                    continue
+                sbid = sbid_from_path(path)
+                self.sketches[sbid] = sketch
+                self.signatures[sbid] = current[sbid]
+        return len(stale)
+
+    def survey(self):
+        total = FieldSketch()
+        for sketch in self.sketches.values():
+            total.merge(sketch)
+        return total
+
+
+def robust_z(values):
+    """Modified z-score 0.6745 * (x - median) / MAD; zero when the MAD vanishes"""
+    values = np.asarray(values, dtype=np.float64)
+    median = np.nanmedian(values)
+    mad = np.nanmedian(np.abs(values - median))
+    if not np.isfinite(mad) or mad == 0:
+        return np.zeros_like(values)
+    return 0.6745 * (values - median) / mad
+
+
+def field_metrics(store):
+    """One row of distribution metrics per SBID"""
+    survey_cdf = store.survey().cdf()
+    rows = []
+    for sbid in sorted(store.sketches):
+        sketch = store.sketches[sbid]
+        n = sketch.n_detections
+        row = {'SBID': sbid, 'n_detections': n, 'n_cutouts': sketch.n_cutouts}
+        for q in QUANTILES:
+            row[f'score_q{int(q * 100)}'] = sketch.quantile(q)
+        row['low_score_ratio'] = sketch.fraction_below(LOW_SCORE)
+        # Kolmogorov-Smirnov distance between the field and the survey score distribution
+        row['score_ks'] = np.abs(sketch.cdf() - survey_cdf).max() if n else np.nan
+        for label, name in LABEL_NAMES.items():
+            row[f'frac_{name}'] = sketch.label_counts[label] / n if n else np.nan
+        row['detections_per_cutout'] = n / sketch.n_cutouts if sketch.n_cutouts else np.nan
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+METRIC_COLUMNS = (['score_q10', 'score_q50', 'score_q90', 'low_score_ratio', 'score_ks']
+                  + [f'frac_{name}' for name in LABEL_NAMES.values()] + ['detections_per_cutout'])
+
+
+def flag_outliers(metrics, threshold=Z_THRESHOLD):
+    """Add robust z-score columns and flag fields with any |z| above threshold"""
+    metrics = metrics.copy()
+    reasons = [[] for _ in range(len(metrics))]
+    for column in METRIC_COLUMNS:
+        if column not in metrics:
+            continue
+        z = robust_z(metrics[column])
+        metrics[f'z_{column}'] = z
+        for i in np.flatnonzero(np.abs(z) > threshold):
+            reasons[i].append(f"{column}({z[i]:+.1f})")
+    metrics['flagged'] = [bool(r) for r in reasons]
+    metrics['flag_reasons'] = [';'.join(r) for r in reasons]
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flag anomalous fields from per-SBID score and label distributions')
+    parser.add_argument('input_dir', help='Directory containing per-SBID catalog CSV files')
+    parser.add_argument('--state', default='anomaly_state.npz', help='Sketch state file for incremental updates')
+    parser.add_argument('--threshold', type=float, default=Z_THRESHOLD, help='Robust |z| threshold (default 3.5)')
+    parser.add_argument('-o', '--output', default='field_anomalies.csv', help='Output CSV of per-field metrics')
+    parser.add_argument('--exclusion-list', default=None, help='Write flagged SBIDs to this text file')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+
+    store = SketchStore.load(args.state)
+    store.update(Catalog(args.input_dir).files(), executor_from_args(args))
+    store.save(args.state)
+    if not store.sketches:
+        print(f"Warning: No catalogs could be sketched in '{args.input_dir}'")
+        return
+
+    result = flag_outliers(field_metrics(store), args.threshold)
+    result.to_csv(args.output, index=False)
+    flagged = result[result['flagged']]
+    print(f"{len(flagged)}/{len(result)} fields flagged, results saved to {args.output}")
+    for row in flagged.itertuples():
+        print(f"  SBID {row.SBID}: {row.flag_reasons}")
+    if args.exclusion_list:
+        with open(args.exclusion_list, 'w') as f:
+            f.write(', '.join(flagged['SBID']) + '\n')
+        print(f"Exclusion list saved to {args.exclusion_list}")
+
+
+if __name__ == "__main__":
+    main()
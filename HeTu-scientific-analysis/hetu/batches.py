@@ -0,0 +1,277 @@
+"""
+Bounded-memory batch readers over the catalog collection, and the consumers reducing them.
+
+score.py, score_count.py and the crossmatch scripts concatenated every catalog (or every
+score) before reducing it, so their memory grew with the survey. Here the collection is
+read as a stream of fixed-size record batches:
+  * files are planned with hetu.catalog.plan_tasks (column projection, aliases, pruning,
+    excluded SBIDs) and read in SBID order with ``pd.read_csv(chunksize=...)``; the
+    source is a catalog directory, one CSV or a list of CSVs,
+  * every chunk is filtered and downcast (floats to float32 except positions and the
+    columns a consumer bins on, integers to the smallest integer type), and chunks are
+    re-cut into batches of exactly ``batch_rows`` rows (the last one shorter), whatever
+    the file sizes,
+  * ``batch_rows`` follows from a memory budget ('256MB'): the bytes per row of the raw
+    parsed columns are measured on the first rows, and the parser chunk, the pending
+    chunks and the batch being assembled must fit in the budget together.
+A consumer declares its columns and its budget, and reduces one batch at a time
+(``update``). ``reduce_batches`` feeds several consumers from one pass over the files,
+with the smallest of their budgets, so the peak memory is the budget plus the consumers'
+own state (histograms, counts, a KD-tree of the reference catalog) and does not grow with
+the number of catalogs.
+
+    from hetu.batches import Histogram, ValueCounts, reduce_batches
+
+    hist = Histogram('score', np.linspace(0.5, 1.0, 31), by='label', budget='128MB')
+    counts = ValueCounts('label')
+    reduce_batches('bbox_overlap_removal/output_internimage_0722', [hist, counts], predicates=['score>=0.5'])
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from hetu.catalog import POSITION_COLUMNS, parse_predicate, plan_tasks, sbid_from_path
+from hetu.skygeom import arcsec_from_chord, chord_from_arcsec, radec_to_xyz
+
+DEFAULT_BUDGET = '256MB'
+PROBE_ROWS = 1000
+MIN_BATCH_ROWS = 1000
+# Copies of a batch alive at once: parser chunk, pending chunks, assembled batch
+BATCH_COPIES = 3
+PRECISE_COLUMNS = POSITION_COLUMNS | {'bbox_ra_min', 'bbox_ra_max', 'bbox_dec_min', 'bbox_dec_max'}
+_SIZE_RE = re.compile(r'^\s*([\d.]+)\s*([kmgt]?)i?b?\s*$', re.IGNORECASE)
+
+
+def parse_size(size):
+    """Bytes of a memory size such as 268435456, '256MB', '2G' or '512k'"""
+    if isinstance(size, (int, float, np.integer)):
+        return int(size)
+    match = _SIZE_RE.match(size)
+    if not match:
+        raise ValueError(f"cannot parse memory size '{size}'")
+    return int(float(match.group(1)) * 1024 ** 'bkmgt'.index((match.group(2) or 'b').lower()))
+
+
+def downcast(df, precise=PRECISE_COLUMNS):
+    """Floats to float32 (except the precise columns), integers to the smallest integer type"""
+    for column in df.columns:
+        dtype = df[column].dtype
+        if pd.api.types.is_bool_dtype(dtype):
+            continue
+        if pd.api.types.is_float_dtype(dtype) and column not in precise:
+            df[column] = df[column].astype(np.float32)
+        elif pd.api.types.is_integer_dtype(dtype):
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+    return df
+
+
+def rows_for_budget(budget, bytes_per_row):
+    """Batch size whose parser chunk, pending chunks and batch fit in the budget together"""
+    return max(MIN_BATCH_ROWS, parse_size(budget) // (BATCH_COPIES * max(1, int(bytes_per_row))))
+
+
+class BatchReader:
+    """Fixed-size, downcast record batches of some columns of a catalog directory or CSV"""
+
+    def __init__(self, source, columns, predicates=(), budget=DEFAULT_BUDGET, batch_rows=None, pattern='*.csv',
+                 exclude_sbids=(), with_sbid=False, precise=PRECISE_COLUMNS):
+        self.source = source
+        self.columns = list(dict.fromkeys(columns))
+        self.predicates = [parse_predicate(p) if isinstance(p, str) else p for p in predicates]
+        self.budget = budget
+        self.batch_rows = batch_rows
+        self.with_sbid = with_sbid
+        self.precise = set(precise)
+        self.tasks, _ = plan_tasks(source, self.columns, self.predicates, pattern, exclude_sbids)
+        self.skipped = []
+
+    def _probe(self):
+        """Bytes per row of the raw parsed columns, from the first rows of the first readable file"""
+        for t in self.tasks:
+            try:
+                head = pd.read_csv(t['path'], usecols=t['usecols'], nrows=PROBE_ROWS)
+            except Exception:
+                continue
+            if len(head):
+                return head.memory_usage(deep=True, index=False).sum() / len(head)
+        return 8 * len(self.columns)
+
+    def _file_chunks(self, t):
+        sbid = t.get('sbid') or sbid_from_path(t['path'])
+        for df in pd.read_csv(t['path'], usecols=t['usecols'], chunksize=self.batch_rows):
+            df = df.rename(columns=t['rename'])
+            if self.predicates:
+                keep = np.ones(len(df), dtype=bool)
+                for pred in self.predicates:
+                    keep &= pred.mask(df[pred.column])
+                df = df[keep]
+            if len(df) == 0:
+                continue
+            df = downcast(df[self.columns].reset_index(drop=True), self.precise)
+            if self.with_sbid:
+                df['SBID'] = sbid
+            yield df
+
+    def _chunks(self):
+        """Chunks of every planned file; a file that fails to read is reported and skipped"""
+        for t in self.tasks:
+            n_rows = 0
+            try:
+                for df in self._file_chunks(t):
+                    n_rows += len(df)
+                    yield df
+            except Exception as e:
+                kept = f" after {n_rows} rows" if n_rows else ''
+                print(f"Skipping {os.path.basename(t['path'])}{kept}: {e}")
+                self.skipped.append(t['path'])
+
+    def __iter__(self):
+        if self.batch_rows is None:
+            self.batch_rows = rows_for_budget(self.budget, self._probe())
+        pending, n_pending = [], 0
+        for chunk in self._chunks():
+            pending.append(chunk)
+            n_pending += len(chunk)
+            while n_pending >= self.batch_rows:
+                rows = pd.concat(pending, ignore_index=True) if len(pending) > 1 else pending[0]
+                yield rows.iloc[:self.batch_rows].reset_index(drop=True)
+                rest = rows.iloc[self.batch_rows:]
+                pending, n_pending = ([rest] if len(rest) else []), len(rest)
+        if n_pending:
+            yield pd.concat(pending, ignore_index=True)
+
+
+class MinMax:
+    """Smallest and largest finite value of a column"""
+
+    def __init__(self, column, budget=DEFAULT_BUDGET):
+        self.column = column
+        self.budget = budget
+        self.columns = [column]
+        self.precise = {column}
+        self.min, self.max = np.inf, -np.inf
+
+    def update(self, batch):
+        x = batch[self.column].to_numpy(np.float64)
+        x = x[np.isfinite(x)]
+        if len(x):
+            self.min, self.max = min(self.min, x.min()), max(self.max, x.max())
+
+
+class Histogram:
+    """Histogram of a column (optionally per value of a grouping column), plus its sum and count
+
+    The column is read at full precision, so a value on a bin edge stays in its bin.
+    """
+
+    def __init__(self, column, edges, by=None, budget=DEFAULT_BUDGET):
+        self.column = column
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.by = by
+        self.budget = budget
+        self.columns = [column] + ([by] if by else [])
+        self.precise = {column}
+        self.counts = {}
+        self.n = {}
+        self.sum = {}
+
+    def update(self, batch):
+        values = batch[self.column].to_numpy(np.float64)
+        groups = batch[self.by].to_numpy() if self.by else np.zeros(len(batch), dtype=np.int8)
+        for group in pd.unique(groups):
+            x = values[groups == group]
+            x = x[np.isfinite(x)]
+            key = group.item() if hasattr(group, 'item') else group
+            key = key if self.by else None
+            counts = np.histogram(x, self.edges)[0]
+            self.counts[key] = self.counts.get(key, 0) + counts
+            self.n[key] = self.n.get(key, 0) + len(x)
+            self.sum[key] = self.sum.get(key, 0.0) + float(x.sum())
+
+    def total(self, group=None):
+        """Histogram of one group, or summed over the groups"""
+        if group is not None or not self.by:
+            return self.counts.get(group, np.zeros(len(self.edges) - 1, dtype=np.int64))
+        return sum(self.counts.values(), np.zeros(len(self.edges) - 1, dtype=np.int64))
+
+    def mean(self, group=None):
+        """Mean of the column over every finite value read (in or out of the bins)"""
+        keys = [group] if group is not None or not self.by else list(self.n)
+        n = sum(self.n.get(k, 0) for k in keys)
+        return sum(self.sum.get(k, 0.0) for k in keys) / n if n else np.nan
+
+
+class ValueCounts:
+    """Row counts per value of a column"""
+
+    def __init__(self, column, budget=DEFAULT_BUDGET):
+        self.column = column
+        self.budget = budget
+        self.columns = [column]
+        self.counts = pd.Series(dtype='int64', name='count')
+
+    def update(self, batch):
+        counts = batch[self.column].value_counts()
+        self.counts = self.counts.add(counts, fill_value=0).astype(np.int64)
+
+    def result(self):
+        counts = self.counts.sort_index()
+        counts.index.name = self.column
+        return counts.rename('count')
+
+
+class NearestMatch:
+    """Nearest reference source within a radius of every streamed row
+
+    The reference catalog (RACS, PyBDSF) is held as a KD-tree of unit vectors; every batch
+    is matched in one query and handed to ``accumulate``, which subclasses extend. The
+    default keeps, per reference source, the number of rows matched to it and the
+    smallest separation.
+    """
+
+    def __init__(self, ref_ra, ref_dec, radius_arcsec, ra='ra', dec='dec', columns=(), budget=DEFAULT_BUDGET):
+        from scipy.spatial import cKDTree
+
+        self.tree = cKDTree(radec_to_xyz(np.asarray(ref_ra, np.float64), np.asarray(ref_dec, np.float64)))
+        self.radius_arcsec = radius_arcsec
+        self.ra, self.dec = ra, dec
+        self.budget = budget
+        self.columns = list(dict.fromkeys([ra, dec] + list(columns)))
+        n_ref = self.tree.n
+        self.n_rows = 0
+        self.n_matched = np.zeros(n_ref, dtype=np.int64)
+        self.best_sep = np.full(n_ref, np.inf)
+
+    def update(self, batch):
+        xyz = radec_to_xyz(batch[self.ra].to_numpy(np.float64), batch[self.dec].to_numpy(np.float64))
+        chord, idx = self.tree.query(xyz, k=1, distance_upper_bound=chord_from_arcsec(self.radius_arcsec))
+        matched = np.isfinite(chord)
+        sep = np.full(len(batch), np.nan)
+        sep[matched] = arcsec_from_chord(chord[matched])
+        self.accumulate(batch, idx, sep, matched)
+
+    def accumulate(self, batch, idx, sep, matched):
+        self.n_rows += len(batch)
+        self.n_matched += np.bincount(idx[matched], minlength=len(self.n_matched))
+        np.minimum.at(self.best_sep, idx[matched], sep[matched])
+
+
+def reduce_batches(source, consumers, predicates=(), pattern='*.csv', exclude_sbids=(), batch_rows=None,
+                   with_sbid=False):
+    """Feed every batch of one pass over the catalogs to every consumer; returns the batch count
+
+    source is a catalog directory, a CSV file or a list of CSV files. Columns a consumer
+    lists in its ``precise`` attribute are not downcast.
+    """
+    columns = [c for consumer in consumers for c in consumer.columns]
+    budget = min((consumer.budget for consumer in consumers), key=parse_size)
+    precise = PRECISE_COLUMNS.union(*(getattr(consumer, 'precise', ()) for consumer in consumers))
+    reader = BatchReader(source, columns, predicates, budget, batch_rows, pattern, exclude_sbids, with_sbid, precise)
+    n_batches = 0
+    for batch in reader:
+        for consumer in consumers:
+            consumer.update(batch)
+        n_batches += 1
+    return n_batches
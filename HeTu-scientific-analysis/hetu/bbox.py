@@ -0,0 +1,94 @@
+"""
+Typed bounding-box columns and a vectorized parser for legacy bbox strings.
+
+Catalogs written by only_label2.py store the pixel bbox as four float32 columns
+(BBOX_COLUMNS). Older CSVs have a single ``bbox`` column holding ``str([x1, y1, x2, y2])``;
+``bbox_array`` turns either layout into an (N, 4) float32 array in one pass and
+``validate_bboxes`` checks the whole array at once, so no stage needs per-row string
+handling.
+
+Command line (rewrite legacy CSVs with typed columns):
+    python -m hetu.bbox /home/ydai240628/analysis_hetu/file/only_label/output_resnet converted/output_resnet
+"""
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+BBOX_COLUMNS = ['bbox_xmin', 'bbox_ymin', 'bbox_xmax', 'bbox_ymax']
+LEGACY_COLUMN = 'bbox'
+
+
+def parse_bbox_strings(values):
+    """Parse '[x1, y1, x2, y2]' strings into an (N, 4) float32 array; malformed rows become NaN"""
+    text = pd.Series(values, dtype=object).astype(str).str.strip().str.strip('[]()')
+    parts = text.str.split(',', expand=True)
+    out = np.full((len(text), 4), np.nan, dtype=np.float32)
+    if parts.shape[1] < 4:
+        return out
+    well_formed = parts.notna().sum(axis=1).to_numpy() == 4
+    for k in range(4):
+        out[:, k] = pd.to_numeric(parts[k], errors='coerce').to_numpy(np.float32)
+    out[~well_formed] = np.nan
+    return out
+
+
+def has_bbox(columns):
+    return all(c in columns for c in BBOX_COLUMNS) or LEGACY_COLUMN in columns
+
+
+def bbox_usecols(columns):
+    """Columns to read for the bbox, whichever layout the file uses"""
+    if all(c in columns for c in BBOX_COLUMNS):
+        return list(BBOX_COLUMNS)
+    return [LEGACY_COLUMN]
+
+
+def bbox_array(df):
+    """(N, 4) float32 bbox array from typed columns, or from the legacy string column"""
+    if all(c in df.columns for c in BBOX_COLUMNS):
+        return df[BBOX_COLUMNS].to_numpy(np.float32)
+    if LEGACY_COLUMN in df.columns:
+        return parse_bbox_strings(df[LEGACY_COLUMN])
+    raise KeyError(f"no bbox columns ({', '.join(BBOX_COLUMNS)} or '{LEGACY_COLUMN}')")
+
+
+def validate_bboxes(bboxes):
+    """Boolean mask of finite boxes with non-negative origin and positive width and height"""
+    xmin, ymin, xmax, ymax = bboxes.T
+    return np.isfinite(bboxes).all(axis=1) & (xmin >= 0) & (ymin >= 0) & (xmax > xmin) & (ymax > ymin)
+
+
+def with_bbox_columns(df):
+    """Replace a legacy 'bbox' string column with the four typed columns (in place of the old one)"""
+    if LEGACY_COLUMN not in df.columns:
+        return df
+    bboxes = parse_bbox_strings(df[LEGACY_COLUMN])
+    position = df.columns.get_loc(LEGACY_COLUMN)
+    df = df.drop(columns=[LEGACY_COLUMN])
+    for k, column in enumerate(BBOX_COLUMNS):
+        df.insert(position + k, column, bboxes[:, k])
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rewrite catalog CSVs with typed float32 bbox columns')
+    parser.add_argument('input_dir', help='Directory of CSV files with a legacy bbox string column')
+    parser.add_argument('output_dir', help='Output directory for the converted CSV files')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    csv_files = sorted(glob.glob(os.path.join(args.input_dir, '*.csv')))
+    print(f"Found {len(csv_files)} CSV files in {args.input_dir}")
+    for csv_file in csv_files:
+        df = with_bbox_columns(pd.read_csv(csv_file))
+        invalid = (~validate_bboxes(df[BBOX_COLUMNS].to_numpy(np.float32))).sum() if has_bbox(df.columns) else 0
+        out_path = os.path.join(args.output_dir, os.path.basename(csv_file))
+        df.to_csv(out_path, index=False)
+        print(f"  {os.path.basename(csv_file)}: {len(df)} rows, {invalid} invalid bboxes")
+
+
+if __name__ == "__main__":
+    main()
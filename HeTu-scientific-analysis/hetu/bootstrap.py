@@ -0,0 +1,206 @@
+"""
+Bootstrap confidence intervals for label totals, label fractions, score histograms and
+crossmatch ratios.
+
+score.py, the CJ/CS/FRI/FRII totals of the notebook and the crossmatch accuracies are
+point values. Their uncertainty has two sources: which fields were observed, and which
+detections each field produced. Both are resampled here, without rereading a catalog:
+  * from the per-SBID score histograms of hetu.aggregates (labels x score bins per SBID):
+    every replicate draws the SBIDs with replacement (one multinomial over the fields),
+    sums their histograms, and draws the detections from the summed cells (one
+    multinomial over labels x bins), so a replicate is a matrix product and one draw,
+  * from the per-SBID (matched, total) records of hetu.results: the SBIDs are drawn the
+    same way and the matches binomially from the resampled totals.
+Replicates are drawn in blocks (one block is an array of shape replicates x cells), and
+the blocks run in parallel on the executor, each with its own seed spawned from --seed,
+so the intervals do not depend on the backend or the number of workers. Intervals are
+percentile intervals of the replicates.
+
+Command line:
+    python -m hetu.bootstrap --state aggregates_internimage.npz --min-score 0.5 --n-boot 2000 \
+        --results crossmatch_results.csv -o bootstrap_internimage
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from hetu.aggregates import MIN_SCORE, AggregateStore
+from hetu.crossmatch import LABEL_NAMES
+from hetu.executor import add_executor_arguments, executor_from_args
+
+N_BOOT = 1000
+BLOCK = 250
+CONFIDENCE = 0.95
+
+
+def resample_cells(cells, n_boot, seed, resample_fields=True, resample_detections=True):
+    """(n_boot, n_cells) bootstrap replicates of per-field cell counts (n_fields, n_cells)"""
+    rng = np.random.default_rng(seed)
+    cells = np.asarray(cells, dtype=np.float64)
+    n_fields = len(cells)
+    if resample_fields:
+        weights = rng.multinomial(n_fields, np.full(n_fields, 1.0 / n_fields), size=n_boot)
+        totals = weights @ cells
+    else:
+        totals = np.repeat(cells.sum(axis=0, keepdims=True), n_boot, axis=0)
+    if not resample_detections:
+        return totals.astype(np.int64)
+    n = totals.sum(axis=1)
+    pvals = totals / np.where(n > 0, n, 1)[:, None]
+    pvals[n == 0, 0] = 1.0
+    return rng.multinomial(n.astype(np.int64), pvals)
+
+
+def label_statistics(hist, first):
+    """Per-label totals and fractions above bin first, and per-bin fractions of each label
+
+    hist is (..., n_labels, n_bins); the bin fractions are the score.py step heights
+    (detections in the bin over the detections of the label above the cut).
+    """
+    above = hist[..., first:]
+    counts = above.sum(axis=-1)
+    total = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fractions = counts / total
+        bin_fractions = above / counts[..., None]
+    return counts, fractions, bin_fractions
+
+
+def _hist_block(cells, shape, first, n_boot, seed, resample_fields, resample_detections):
+    hist = resample_cells(cells, n_boot, seed, resample_fields, resample_detections).reshape((n_boot,) + shape)
+    return label_statistics(hist, first)
+
+
+def _ratio_block(matched, totals, n_boot, seed, resample_fields, resample_detections):
+    rng = np.random.default_rng(seed)
+    n_fields = len(totals)
+    if resample_fields:
+        weights = rng.multinomial(n_fields, np.full(n_fields, 1.0 / n_fields), size=n_boot)
+    else:
+        weights = np.ones((n_boot, n_fields), dtype=np.int64)
+    hit, total = weights @ matched, weights @ totals
+    if resample_detections:
+        hit = rng.binomial(total, np.where(total > 0, hit / np.where(total > 0, total, 1), 0.0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return hit / total
+
+
+def _blocks(n_boot, seed, block=BLOCK):
+    """(replicates, seed) of every block; the seeds only depend on seed and n_boot"""
+    sizes = [min(block, n_boot - start) for start in range(0, n_boot, block)]
+    return sizes, np.random.SeedSequence(seed).spawn(len(sizes))
+
+
+def _interval(replicates, confidence):
+    alpha = (1.0 - confidence) / 2
+    with np.errstate(invalid='ignore'):
+        lo, hi = np.nanquantile(replicates, [alpha, 1.0 - alpha], axis=0)
+        return lo, hi, np.nanstd(replicates, axis=0)
+
+
+def bootstrap_labels(score_hist, min_score=MIN_SCORE, n_boot=N_BOOT, seed=0, confidence=CONFIDENCE,
+                     resample_fields=True, resample_detections=True, executor=None):
+    """Label and histogram-bin tables with bootstrap intervals from per-SBID histograms
+
+    score_hist is (n_fields, n_labels, n_bins) on [0, 1]; min_score is rounded to a bin edge.
+    """
+    score_hist = np.asarray(score_hist, dtype=np.int64)
+    n_fields, n_labels, n_bins = score_hist.shape
+    first = int(round(min_score * n_bins))
+    cells = score_hist.reshape(n_fields, -1)
+    sizes, seeds = _blocks(n_boot, seed)
+    k = len(sizes)
+    args = ([cells] * k, [(n_labels, n_bins)] * k, [first] * k, sizes, seeds,
+            [resample_fields] * k, [resample_detections] * k)
+    blocks = list(executor.map(_hist_block, *args)) if executor else list(map(_hist_block, *args))
+    counts, fractions, bin_fractions = (np.concatenate(parts) for parts in zip(*blocks))
+    point = label_statistics(score_hist.sum(axis=0), first)
+
+    labels = pd.DataFrame({'label': np.arange(n_labels),
+                           'name': [LABEL_NAMES.get(label, str(label)) for label in range(n_labels)]})
+    for name, value, replicates in (('count', point[0], counts), ('fraction', point[1], fractions)):
+        lo, hi, std = _interval(replicates, confidence)
+        labels[name] = value
+        labels[f'{name}_lo'], labels[f'{name}_hi'], labels[f'{name}_std'] = lo, hi, std
+
+    edges = np.linspace(0.0, 1.0, n_bins + 1)[first:]
+    lo, hi, std = _interval(bin_fractions, confidence)
+    bins = pd.DataFrame({'label': np.repeat(np.arange(n_labels), len(edges) - 1),
+                         'score_min': np.tile(edges[:-1], n_labels), 'score_max': np.tile(edges[1:], n_labels),
+                         'count': score_hist.sum(axis=0)[:, first:].ravel(),
+                         'fraction': point[2].ravel(), 'fraction_lo': lo.ravel(), 'fraction_hi': hi.ravel(),
+                         'fraction_std': std.ravel()})
+    return labels, bins
+
+
+def bootstrap_ratios(results, n_boot=N_BOOT, seed=0, confidence=CONFIDENCE, resample_fields=True,
+                     resample_detections=True, executor=None):
+    """Crossmatch ratio (matched / total summed over SBIDs) with bootstrap intervals per model and label"""
+    rows, tasks = [], []
+    sizes, seeds = _blocks(n_boot, seed)
+    known = results['matched'].notna() & results['total'].notna()
+    if not known.all():
+        print(f"Skipping {int((~known).sum())} records without matched/total counts (fraction only)")
+        results = results[known]
+    for (model, label), group in results.groupby(['model', results['label'].fillna(-1)], sort=True):
+        matched, totals = group['matched'].to_numpy(np.int64), group['total'].to_numpy(np.int64)
+        rows.append({'model': model, 'label': pd.NA if label < 0 else int(label), 'n_sbids': len(group),
+                     'matched': int(matched.sum()), 'total': int(totals.sum()),
+                     'ratio': matched.sum() / totals.sum() if totals.sum() else np.nan})
+        tasks += [(matched, totals, size, s, resample_fields, resample_detections) for size, s in zip(sizes, seeds)]
+    if not rows:
+        return pd.DataFrame(rows)
+    blocks = list(executor.map(_ratio_block, *zip(*tasks))) if executor else [_ratio_block(*t) for t in tasks]
+    table = pd.DataFrame(rows)
+    per_group = len(sizes)
+    intervals = [_interval(np.concatenate(blocks[g * per_group:(g + 1) * per_group]), confidence)
+                 for g in range(len(rows))]
+    table['ratio_lo'], table['ratio_hi'], table['ratio_std'] = (np.array(v, dtype=np.float64) for v in zip(*intervals))
+    table['label'] = table['label'].astype('Int64')
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bootstrap intervals for label totals, fractions, histograms and ratios')
+    parser.add_argument('--state', required=True, help='Aggregate state of python -m hetu.aggregates')
+    parser.add_argument('--results', default=None, help='Crossmatch results table (hetu.results) for the ratio intervals')
+    parser.add_argument('--model', default=None, help='Only the records of this model of the results table')
+    parser.add_argument('--min-score', type=float, default=MIN_SCORE, help='Score cut (rounded to a histogram bin edge)')
+    parser.add_argument('--n-boot', type=int, default=N_BOOT, help='Number of bootstrap replicates')
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE, help='Confidence level of the intervals')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--resample', choices=('both', 'fields', 'detections'), default='both',
+                        help='Resample the SBIDs, the detections within them, or both (default)')
+    parser.add_argument('-o', '--output_prefix', default='bootstrap', help='Prefix of the output CSV files')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+
+    fields, detections = args.resample in ('both', 'fields'), args.resample in ('both', 'detections')
+    executor = executor_from_args(args)
+    store = AggregateStore.load(args.state)
+    included = [s for s in sorted(store.fields) if s not in store.excluded]
+    if not included:
+        print(f"No included SBIDs in {args.state}")
+        return
+    score_hist = np.array([store.fields[s].score_hist for s in included])
+    print(f"Bootstrapping {len(included)} SBIDs, {int(score_hist.sum())} detections, {args.n_boot} replicates")
+    labels, bins = bootstrap_labels(score_hist, args.min_score, args.n_boot, args.seed, args.confidence,
+                                    fields, detections, executor)
+    outputs = {'labels': labels, 'hist': bins}
+    if args.results:
+        from hetu.results import read_results
+
+        outputs['crossmatch'] = bootstrap_ratios(read_results(args.results, args.model), args.n_boot, args.seed,
+                                                 args.confidence, fields, detections, executor)
+    for suffix, df in outputs.items():
+        path = f"{args.output_prefix}_{suffix}.csv"
+        df.to_csv(path, index=False)
+        print(f"Saved {len(df)} rows to {path}")
+    print(labels[['name', 'count', 'count_lo', 'count_hi', 'fraction', 'fraction_lo', 'fraction_hi']].to_string(index=False))
+    if 'crossmatch' in outputs and len(outputs['crossmatch']):
+        print(outputs['crossmatch'][['model', 'label', 'ratio', 'ratio_lo', 'ratio_hi']].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
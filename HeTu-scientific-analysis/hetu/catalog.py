@@ -0,0 +1,498 @@
+"""
+Lazy query layer over a directory of per-SBID catalog CSVs.
+
+A query is only a description until it is collected:
+
+    from hetu.catalog import Catalog, col
+
+    cat = Catalog('/home/ydai240628/analysis_hetu/file/bbox_overlap_removal/output_internimage_0722')
+    q = cat.where(col.score >= 0.5, col.label.isin({2, 3}), col.dec <= 32.5).select('ra', 'dec', 'score')
+    print(q.explain())
+    df = q.collect()
+    totals = cat.where(col.score >= 0.5).count_by('label')
+
+Before any row is read the plan
+  * projects the columns actually needed (select + predicate columns),
+  * prunes SBIDs whose RA/Dec footprint cannot satisfy a position predicate,
+  * prunes SBIDs whose stored min/max of a column (e.g. score) cannot satisfy a predicate.
+The per-file min/max statistics live in ``_catalog_stats.csv`` next to the catalogs and
+are refreshed only for files whose size or mtime changed. Surviving files are scanned in
+parallel and the partial results are combined in SBID order.
+
+Command line:
+    python -m hetu.catalog DIR --where "score>=0.5" --where "label in 2,3" --count-by label
+"""
+import argparse
+import glob
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from hetu.executor import Executor
+
+STATS_FILE = '_catalog_stats.csv'
+
+# Logical column name -> physical names used by the different pipeline stages
+COLUMN_ALIASES = {
+    'ra': ('bbox_center_ra', 'RA', 'ra'),
+    'dec': ('bbox_center_dec', 'Dec', 'DEC', 'dec'),
+    'label': ('label', 'labels'),
+}
+POSITION_COLUMNS = {'ra', 'dec'}
+
+# Text columns that never get min/max statistics
+SKIP_STATS_COLUMNS = {'component_id', 'bbox', 'counts', 'fits_id'}
+
+_SBID_PATTERNS = (re.compile(r'SB[_]?(\d+)', re.IGNORECASE), re.compile(r'(\d+)\.csv$'))
+
+
+def sbid_from_path(path):
+    """Extract the SBID from a catalog file name (20147.csv, processed_wcs_20147.csv, ...SB20147...)"""
+    name = os.path.basename(path)
+    for pattern in _SBID_PATTERNS:
+        match = pattern.search(name)
+        if match:
+            return match.group(1)
+    return None
+
+
+def files_by_sbid(paths):
+    """SBID -> path of catalog files; files without an SBID or repeating one are reported and skipped"""
+    files = {}
+    for path in paths:
+        sbid = sbid_from_path(path)
+        if sbid is None:
+            print(f"Skipping {os.path.basename(path)}: no SBID in the file name")
+        elif sbid in files:
+            print(f"Skipping {os.path.basename(path)}: SBID {sbid} already read from {os.path.basename(files[sbid])}")
+        else:
+            files[sbid] = path
+    return files
+
+
+def resolve_column(name, columns):
+    """Map a logical column name onto the physical column present in a file"""
+    if name in columns:
+        return name
+    for candidate in COLUMN_ALIASES.get(name, ()):
+        if candidate in columns:
+            return candidate
+    return None
+
+
+class Predicate:
+    """A single comparison that can be evaluated on data or on min/max statistics"""
+
+    OPS = ('>=', '>', '<=', '<', '==', '!=', 'in', 'between')
+
+    def __init__(self, column, op, value):
+        if op not in self.OPS:
+            raise ValueError(f"Unsupported operator: {op}")
+        self.column = column
+        self.op = op
+        self.value = tuple(value) if op in ('in', 'between') else value
+
+    def __repr__(self):
+        return f"{self.column} {self.op} {self.value!r}"
+
+    def mask(self, series):
+        """Boolean mask of the rows of `series` satisfying the predicate"""
+        v = self.value
+        if self.op == '>=':
+            return (series >= v).to_numpy()
+        if self.op == '>':
+            return (series > v).to_numpy()
+        if self.op == '<=':
+            return (series <= v).to_numpy()
+        if self.op == '<':
+            return (series < v).to_numpy()
+        if self.op == '==':
+            return (series == v).to_numpy()
+        if self.op == '!=':
+            return (series != v).to_numpy()
+        if self.op == 'in':
+            return series.isin(v).to_numpy()
+        return ((series >= v[0]) & (series <= v[1])).to_numpy()
+
+    def may_match(self, lo, hi):
+        """Whether any value inside [lo, hi] can satisfy the predicate (True when unknown)"""
+        if pd.isna(lo) or pd.isna(hi):
+            return True
+        v = self.value
+        if self.op == '>=':
+            return hi >= v
+        if self.op == '>':
+            return hi > v
+        if self.op == '<=':
+            return lo <= v
+        if self.op == '<':
+            return lo < v
+        if self.op == '==':
+            return lo <= v <= hi
+        if self.op == '!=':
+            return not (lo == hi == v)
+        if self.op == 'in':
+            return any(lo <= x <= hi for x in v)
+        return hi >= v[0] and lo <= v[1]
+
+
+class Column:
+    """Column reference used to build predicates: col.score >= 0.5"""
+
+    __hash__ = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def __ge__(self, value):
+        return Predicate(self.name, '>=', value)
+
+    def __gt__(self, value):
+        return Predicate(self.name, '>', value)
+
+    def __le__(self, value):
+        return Predicate(self.name, '<=', value)
+
+    def __lt__(self, value):
+        return Predicate(self.name, '<', value)
+
+    def __eq__(self, value):
+        return Predicate(self.name, '==', value)
+
+    def __ne__(self, value):
+        return Predicate(self.name, '!=', value)
+
+    def isin(self, values):
+        return Predicate(self.name, 'in', sorted(values))
+
+    def between(self, lo, hi):
+        return Predicate(self.name, 'between', (lo, hi))
+
+
+class _ColumnFactory:
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return Column(name)
+
+    def __call__(self, name):
+        return Column(name)
+
+
+col = _ColumnFactory()
+
+_PREDICATE_RE = re.compile(r'^\s*(\w+)\s*(>=|<=|==|!=|>|<|\s+in\s+|\s+between\s+)\s*(.+?)\s*$')
+
+
+def _parse_value(text):
+    text = text.strip().strip('"\'')
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    return int(number) if number.is_integer() and '.' not in text else number
+
+
+def parse_predicate(text):
+    """Parse 'score>=0.5', 'label in 2,3' or 'dec between -40,-30' into a Predicate"""
+    match = _PREDICATE_RE.match(text)
+    if not match:
+        raise ValueError(f"Cannot parse predicate: {text!r}")
+    column, op, value = match.group(1), match.group(2).strip(), match.group(3)
+    if op in ('in', 'between'):
+        values = [_parse_value(v) for v in value.strip('{}[]()').split(',') if v.strip()]
+        if op == 'between' and len(values) != 2:
+            raise ValueError(f"'between' needs two values: {text!r}")
+        return Predicate(column, op, values)
+    return Predicate(column, op, _parse_value(value))
+
+
+def compute_file_stats(path):
+    """Row count, column list and per-column min/max of one catalog file"""
+    header = pd.read_csv(path, nrows=0).columns.tolist()
+    usecols = [c for c in header if c not in SKIP_STATS_COLUMNS]
+    df = pd.read_csv(path, usecols=usecols)
+    st = os.stat(path)
+    row = {
+        'file': os.path.basename(path),
+        'sbid': sbid_from_path(path),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'n_rows': len(df),
+        'columns': '|'.join(header),
+    }
+    for c in df.columns:
+        if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c]):
+            row[f'min__{c}'] = df[c].min()
+            row[f'max__{c}'] = df[c].max()
+    return row
+
+
+def _scan_file(path, usecols, rename, predicates, select, sbid):
+    """Read the projected columns of one file and apply the predicates"""
+    df = pd.read_csv(path, usecols=usecols).rename(columns=rename)
+    if predicates:
+        keep = np.ones(len(df), dtype=bool)
+        for pred in predicates:
+            keep &= pred.mask(df[pred.column])
+        df = df[keep]
+    if select:
+        df = df[list(select)]
+    if sbid is not None:
+        df = df.assign(SBID=sbid)
+    return df.reset_index(drop=True)
+
+
+def _count_rows(path, usecols, rename, predicates):
+    return len(_scan_file(path, usecols, rename, predicates, None, None))
+
+
+def _count_file(path, usecols, rename, predicates, column):
+    df = _scan_file(path, usecols, rename, predicates, [column], None)
+    return df[column].value_counts()
+
+
+class Catalog:
+    """A directory of per-SBID catalog CSVs"""
+
+    def __init__(self, directory, pattern='*.csv', exclude_sbids=(), stats_path=None, workers=None):
+        self.directory = directory
+        self.pattern = pattern
+        self.exclude_sbids = {str(s) for s in exclude_sbids}
+        self.stats_path = stats_path or os.path.join(directory, STATS_FILE)
+        self.workers = workers
+        self._stats = None
+
+    def files(self):
+        """Catalog files in SBID order, excluding the stats file and excluded SBIDs"""
+        paths = []
+        for path in glob.glob(os.path.join(self.directory, self.pattern)):
+            if os.path.abspath(path) == os.path.abspath(self.stats_path):
+                continue
+            if sbid_from_path(path) in self.exclude_sbids:
+                continue
+            paths.append(path)
+        return sorted(paths, key=lambda p: (sbid_from_path(p) or '', os.path.basename(p)))
+
+    def stats(self, refresh=False):
+        """Per-file statistics, recomputed only for files that changed since they were stored"""
+        if self._stats is not None and not refresh:
+            return self._stats
+        cached = {}
+        if os.path.exists(self.stats_path):
+            for row in pd.read_csv(self.stats_path, dtype={'sbid': str}).to_dict('records'):
+                cached[row['file']] = row
+        rows, stale = [], []
+        for path in self.files():
+            st = os.stat(path)
+            row = cached.get(os.path.basename(path))
+            if row is not None and row['size'] == st.st_size and row['mtime_ns'] == st.st_mtime_ns:
+                rows.append(row)
+            else:
+                stale.append(path)
+        if stale:
+            print(f"Computing statistics for {len(stale)} new or modified catalog files")
+            for path, row, error in self.executor().run(compute_file_stats, stale):
+                if error is not None:
+                    # Unreadable files stay out of the statistics, so no query scans them
+                    print(f"Skipping {os.path.basename(path)}: {error}")
+                    continue
+                rows.append(row)
+            self._save_stats(rows)
+        self._stats = pd.DataFrame(rows)
+        return self._stats
+
+    def _save_stats(self, rows):
+        try:
+            pd.DataFrame(rows).to_csv(self.stats_path, index=False)
+        except OSError as e:
+            print(f"Warning: cannot write catalog statistics to {self.stats_path}: {e}")
+
+    def executor(self):
+        """Thread executor used to read the files (CSV parsing releases the GIL)"""
+        return Executor('threads', self.workers)
+
+    def query(self):
+        return Query(self)
+
+    def where(self, *predicates):
+        return Query(self).where(*predicates)
+
+    def select(self, *columns):
+        return Query(self).select(*columns)
+
+
+class Query:
+    """An immutable, lazily evaluated query over a Catalog"""
+
+    def __init__(self, catalog, predicates=(), columns=None):
+        self.catalog = catalog
+        self.predicates = tuple(predicates)
+        self.columns = tuple(columns) if columns is not None else None
+
+    def where(self, *predicates):
+        parsed = [parse_predicate(p) if isinstance(p, str) else p for p in predicates]
+        return Query(self.catalog, self.predicates + tuple(parsed), self.columns)
+
+    def select(self, *columns):
+        return Query(self.catalog, self.predicates, columns)
+
+    def plan(self, extra_columns=()):
+        """Resolve projection and pruning for every file; returns (tasks, pruned)"""
+        stats = self.catalog.stats()
+        tasks, pruned = [], []
+        for row in stats.to_dict('records'):
+            path = os.path.join(self.catalog.directory, row['file'])
+            header = row['columns'].split('|')
+            wanted = list(self.columns) if self.columns is not None else list(header)
+            wanted += [c for c in extra_columns if c not in wanted]
+            needed = wanted + [p.column for p in self.predicates if p.column not in wanted]
+            rename, reason = {}, None
+            for name in needed:
+                physical = resolve_column(name, header)
+                if physical is None:
+                    reason = f"missing column '{name}'"
+                    break
+                rename[physical] = name
+            if reason is None:
+                for pred in self.predicates:
+                    physical = resolve_column(pred.column, header)
+                    lo, hi = row.get(f'min__{physical}'), row.get(f'max__{physical}')
+                    if not pred.may_match(lo, hi):
+                        kind = 'footprint' if pred.column in POSITION_COLUMNS else 'statistics'
+                        reason = f"{kind}: {pred} outside [{lo}, {hi}]"
+                        break
+            if reason is not None:
+                pruned.append((row['file'], reason))
+                continue
+            tasks.append({
+                'path': path,
+                'sbid': row['sbid'],
+                'n_rows': row['n_rows'],
+                'usecols': list(rename),
+                'rename': rename,
+                'select': wanted if self.columns is not None else None,
+            })
+        return tasks, pruned
+
+    def explain(self):
+        """Human readable description of the plan without reading any catalog rows"""
+        tasks, pruned = self.plan()
+        n_footprint = sum(1 for _, r in pruned if r.startswith('footprint'))
+        n_stats = sum(1 for _, r in pruned if r.startswith('statistics'))
+        lines = [
+            f"Catalog: {self.catalog.directory}",
+            f"Predicates: {', '.join(map(repr, self.predicates)) or '(none)'}",
+            f"Projection: {', '.join(self.columns) if self.columns else '(all columns)'}",
+            f"Files to scan: {len(tasks)} ({sum(t['n_rows'] for t in tasks)} rows)",
+            f"Pruned: {len(pruned)} (footprint={n_footprint}, statistics={n_stats}, "
+            f"schema={len(pruned) - n_footprint - n_stats})",
+        ]
+        if tasks:
+            lines.append(f"Columns read per file: {', '.join(tasks[0]['usecols'])}")
+        return '\n'.join(lines)
+
+    def _run(self, func, argument_lists):
+        return list(self.catalog.executor().map(func, *argument_lists))
+
+    def collect(self, with_sbid=False):
+        """Execute the plan and return the matching rows as one DataFrame"""
+        tasks, _ = self.plan()
+        if not tasks:
+            return pd.DataFrame(columns=list(self.columns or ()))
+        frames = self._run(_scan_file, zip(*[
+            (t['path'], t['usecols'], t['rename'], self.predicates, t['select'],
+             t['sbid'] if with_sbid else None) for t in tasks]))
+        return pd.concat(frames, ignore_index=True)
+
+    def count(self):
+        """Number of matching rows"""
+        if not self.predicates:
+            tasks, _ = self.plan()
+            return int(sum(t['n_rows'] for t in tasks))
+        # Only the predicate columns are read; rows are counted on the filtered mask, so a
+        # matching row with a missing value (e.g. 'label != 3' and no label) still counts
+        tasks, _ = Query(self.catalog, self.predicates, ()).plan()
+        if not tasks:
+            return 0
+        return int(sum(self._run(_count_rows, zip(*[
+            (t['path'], t['usecols'], t['rename'], self.predicates) for t in tasks]))))
+
+    def count_by(self, column):
+        """Matching row counts per value of `column`, reduced file by file"""
+        query = Query(self.catalog, self.predicates, (column,))
+        tasks, _ = query.plan()
+        if not tasks:
+            return pd.Series(dtype='int64', name='count')
+        partials = self._run(_count_file, zip(*[
+            (t['path'], t['usecols'], t['rename'], self.predicates, column) for t in tasks]))
+        total = pd.concat(partials).groupby(level=0).sum().sort_index()
+        total.index.name = column
+        return total.rename('count')
+
+
+def plan_tasks(source, columns, predicates=(), pattern='*.csv', exclude_sbids=()):
+    """(tasks, statistics) for a catalog directory, a single CSV or a list of CSVs; tasks hold path/usecols/rename
+
+    A list is planned file by file (exclusions are left to the caller); a file without the
+    needed columns is reported and skipped.
+    """
+    if not isinstance(source, str):
+        tasks = []
+        for path in source:
+            try:
+                tasks += plan_tasks(path, columns, predicates)[0]
+            except Exception as e:
+                print(f"Skipping {os.path.basename(path)}: {e}")
+        return tasks, None
+    if os.path.isdir(source):
+        catalog = Catalog(source, pattern, exclude_sbids=exclude_sbids)
+        tasks, pruned = catalog.where(*predicates).select(*columns).plan()
+        if pruned:
+            print(f"Pruned {len(pruned)} files from their statistics")
+        return tasks, catalog.stats()
+    header = pd.read_csv(source, nrows=0).columns.tolist()
+    needed = list(columns) + [p.column for p in predicates if p.column not in columns]
+    rename = {}
+    for name in needed:
+        physical = resolve_column(name, header)
+        if physical is None:
+            raise ValueError(f"{source} has no column '{name}'")
+        rename[physical] = name
+    return [{'path': source, 'usecols': list(rename), 'rename': rename}], None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query a directory of per-SBID catalog CSVs')
+    parser.add_argument('directory', help='Directory containing per-SBID catalog CSV files')
+    parser.add_argument('--where', action='append', default=[],
+                        help="Predicate such as 'score>=0.5', 'label in 2,3', 'dec<=32.5' (repeatable)")
+    parser.add_argument('--select', default=None, help='Comma separated output columns')
+    parser.add_argument('--count-by', default=None, help='Report matching row counts per value of this column')
+    parser.add_argument('--exclude', default='', help='Comma separated SBIDs to exclude')
+    parser.add_argument('--explain', action='store_true', help='Only print the query plan')
+    parser.add_argument('--with-sbid', action='store_true', help='Add an SBID column to the output')
+    parser.add_argument('--workers', type=int, default=None, help='Number of parallel readers')
+    parser.add_argument('-o', '--output', default=None, help='Output CSV (default: print a preview)')
+    args = parser.parse_args()
+
+    exclude = [s.strip() for s in args.exclude.split(',') if s.strip()]
+    query = Catalog(args.directory, exclude_sbids=exclude, workers=args.workers).where(*args.where)
+    if args.select:
+        query = query.select(*[c.strip() for c in args.select.split(',')])
+
+    print(query.explain())
+    if args.explain:
+        return
+    result = query.count_by(args.count_by).reset_index() if args.count_by else query.collect(args.with_sbid)
+    if args.output:
+        result.to_csv(args.output, index=False)
+        print(f"Saved {len(result)} rows to {args.output}")
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+One entry point for the HeTu pipeline stages: ``python -m hetu <command> [options]``.
+
+Each command is the ``main()`` of an existing module or script, loaded only when that
+command runs: this file imports nothing beyond the standard library, so ``--help`` and the
+light commands do not pay for astropy, healpy, matplotlib or bdsf. The stages themselves
+import their heavy dependencies inside the functions that need them (FITS/WCS in wcs,
+rtree in dedup, scipy in crossmatch, matplotlib in plot, bdsf after the arguments are
+parsed), so ``python -m hetu <command> --help`` stays fast too. ``--timing`` reports the
+import and run time of a command on stderr; ``python -X importtime -m hetu ...`` breaks the
+import time down per module.
+
+    python -m hetu --help
+    python -m hetu ingest pack output_resnet shards_resnet
+    python -m hetu wcs -c predictions -f /groups/hetu_ai/home/share/racs-mid-images -o wcs_output
+    python -m hetu dedup --input_dir wcs_output --output_dir bbox_overlap_removal
+    python -m hetu stats bbox_overlap_removal --where "score>=0.5" --count-by label
+    python -m hetu --timing plot sky bbox_overlap_removal -o sky.png
+"""
+import argparse
+import importlib
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Command -> (module name or script path relative to the repository root, help)
+COMMANDS = {
+    'ingest': ('hetu.shards', 'Pack per-cutout detection JSONs into per-SBID shards (pack / info)'),
+    'wcs': ('cateloge_creation/add_wcs_all.py', 'Convert pixel bounding boxes to sky coordinates'),
+    'stitch': ('hetu.stitch', 'Merge detections split at cutout edges into single sources'),
+    'dedup': ('cateloge_creation/bbox_overlap_removal_all.py', 'Remove overlapping bounding boxes per SBID'),
+    'maskdedup': ('hetu.masks', 'Mask-IoU dedup of the detections of every cutout in packed shards'),
+    'master': ('hetu.master', 'Merge the per-SBID catalogs into one HEALPix-sorted master catalog'),
+    'crossmatch': ('hetu.crossmatch', 'Crossmatch the HeTu catalog against RACS components'),
+    'stats': ('hetu.catalog', 'Query the catalog and count detections (--where, --count-by)'),
+    'aggregate': ('hetu.aggregates', 'Incrementally update per-SBID counts, score histograms and HEALPix maps'),
+    'density': ('hetu.density', 'Sources per square degree per label, per SBID and per HEALPix pixel'),
+    'bootstrap': ('hetu.bootstrap', 'Bootstrap intervals for label totals, fractions, score histograms and crossmatch ratios'),
+    'plot': ('hetu.raster', 'Rasterized sky and column density plots'),
+    'bdsf': ('pybdsf_detect_and_measure/pybdsf_detect_and_measure_psfscale.py',
+             'Run PyBDSF with a PSF-scaled rms box on one image'),
+    'lrmatch': ('hetu.lrmatch', 'Likelihood-ratio crossmatch with reliabilities'),
+    'fof': ('hetu.fof', 'Friends-of-friends grouping of radio components within HeTu sources'),
+    'ensemble': ('hetu.ensemble', 'Weighted box fusion of the detections of several models'),
+    'compare': ('hetu.compare', 'Compare the catalogs of several detection models'),
+    'footprint': ('hetu.moc', 'HEALPix MOC footprints of the fields from their FITS WCS (build / info / lookup / overlaps)'),
+    'index': ('hetu.skyindex', 'Build and query the HEALPix spatial index (build / cone / box)'),
+    'stamps': ('hetu.stamps', 'Cut postage stamps of a catalog selection'),
+    'anomaly': ('hetu.anomaly', 'Per-SBID anomaly scores of the detection statistics'),
+    'jobarray': ('hetu.jobarray', 'Shard a stage over a SLURM job array (plan / submit / run / merge)'),
+}
+
+
+def load_command(name):
+    """Import the module or script behind a command and return its main()
+
+    A script is imported under its own name from its directory, so the functions it hands
+    to a process pool can be pickled and found again by the workers (fork or spawn).
+    """
+    target, _ = COMMANDS[name]
+    if not target.endswith('.py'):
+        return importlib.import_module(target).main
+    directory, filename = os.path.split(os.path.join(REPO_ROOT, target))
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    return importlib.import_module(filename[:-len('.py')]).main
+
+
+def run(name, argv, timing=False):
+    """Run a command with its own argument list, as if its script was started directly"""
+    start = time.perf_counter()
+    main = load_command(name)
+    loaded = time.perf_counter()
+    saved_argv = sys.argv
+    sys.argv = [f'hetu {name}', *argv]
+    try:
+        return main()
+    finally:
+        sys.argv = saved_argv
+        if timing:
+            end = time.perf_counter()
+            print(f"hetu {name}: import {loaded - start:.3f} s, run {end - loaded:.3f} s", file=sys.stderr)
+
+
+def build_parser():
+    width = max(map(len, COMMANDS))
+    listing = '\n'.join(f'  {name:<{width}}  {help_}' for name, (_, help_) in COMMANDS.items())
+    parser = argparse.ArgumentParser(
+        prog='hetu', description='HeTu radio-morphology pipeline',
+        epilog=f"commands:\n{listing}\n\nRun 'hetu <command> --help' for the options of a command.",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--timing', action='store_true', help='Report import and run time of the command on stderr')
+    parser.add_argument('command', choices=list(COMMANDS), metavar='command', help='Pipeline stage to run')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Options of the command')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return run(args.command, args.args, args.timing)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Multi-model catalog comparison (ResNet vs InternImage vs maskb ...).
+
+For every SBID present in all model directories the per-model catalogs are loaded
+(one SBID at a time, so memory scales with one field), detections are keyed by their
+cutout (`component_id`) plus a spatial hash cell of the pixel bbox centre, and every
+pair of models is matched with a vectorized hash join: each detection probes the 3x3
+neighbouring cells of the other model and pairs within `tolerance` pixels are kept when
+they are mutual nearest neighbours.
+
+Outputs (one SBID column each, no hand joins):
+  <prefix>_counts.csv   per-SBID label counts of every model side by side
+  <prefix>_pairs.csv    per-SBID, per-model-pair agreement, label confusion and score deltas
+  <prefix>_survey.csv   survey-wide totals of the pair statistics
+
+Command line:
+    python -m hetu.compare --model resnet=/path/output_resnet --model internimage=/path/output_internimage_0722 \
+        --model maskb=/path/bbox_overlap_removal_maskb --min-score 0.5 -o comparison
+"""
+import argparse
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from hetu.bbox import bbox_array, bbox_usecols
+from hetu.catalog import Catalog, files_by_sbid, resolve_column
+from hetu.executor import add_executor_arguments, executor_from_args
+
+N_LABELS = 4
+DEFAULT_TOLERANCE = 5.0
+DELTA_BINS = np.linspace(-1.0, 1.0, 201)
+
+
+def load_detections(path, min_score=0.0):
+    """component_id, label, score and pixel bbox centre of one model catalog
+
+    A missing label becomes -1: the detection still takes part in the matching, but not in
+    the label counts and the label confusion.
+    """
+    header = pd.read_csv(path, nrows=0).columns.tolist()
+    label_col = resolve_column('label', header)
+    df = pd.read_csv(path, usecols=['component_id', label_col, 'score'] + bbox_usecols(header))
+    df = df.rename(columns={label_col: 'label'})
+    df = df[df['score'] >= min_score].reset_index(drop=True)
+    bboxes = bbox_array(df).astype(np.float64)
+    return pd.DataFrame({
+        'component_id': df['component_id'].to_numpy(),
+        'label': df['label'].fillna(-1).to_numpy(np.int64),
+        'score': df['score'].to_numpy(np.float64),
+        'x': (bboxes[:, 0] + bboxes[:, 2]) / 2,
+        'y': (bboxes[:, 1] + bboxes[:, 3]) / 2,
+    })
+
+
+def match_detections(a, b, tolerance=DEFAULT_TOLERANCE):
+    """Mutual nearest-neighbour pairs (index_a, index_b, distance) within the same cutout"""
+    empty = pd.DataFrame({'ia': np.zeros(0, np.int64), 'ib': np.zeros(0, np.int64), 'dist': np.zeros(0)})
+    if a.empty or b.empty:
+        return empty
+    codes, _ = pd.factorize(pd.concat([a['component_id'], b['component_id']], ignore_index=True))
+    keys_b = pd.DataFrame({
+        'cid': codes[len(a):],
+        'cx': np.floor(b['x'].to_numpy() / tolerance).astype(np.int64),
+        'cy': np.floor(b['y'].to_numpy() / tolerance).astype(np.int64),
+        'ib': np.arange(len(b)),
+    })
+    cx_a = np.floor(a['x'].to_numpy() / tolerance).astype(np.int64)
+    cy_a = np.floor(a['y'].to_numpy() / tolerance).astype(np.int64)
+    probes = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            probes.append(pd.DataFrame({'cid': codes[:len(a)], 'cx': cx_a + dx, 'cy': cy_a + dy,
+                                        'ia': np.arange(len(a))}))
+    pairs = pd.concat(probes, ignore_index=True).merge(keys_b, on=['cid', 'cx', 'cy'])
+    if pairs.empty:
+        return empty
+    ia, ib = pairs['ia'].to_numpy(), pairs['ib'].to_numpy()
+    dist = np.hypot(a['x'].to_numpy()[ia] - b['x'].to_numpy()[ib], a['y'].to_numpy()[ia] - b['y'].to_numpy()[ib])
+    pairs = pd.DataFrame({'ia': ia, 'ib': ib, 'dist': dist})
+    pairs = pairs[pairs['dist'] <= tolerance].sort_values('dist', kind='stable')
+    best_a = pairs.drop_duplicates('ia')
+    best_b = pairs.drop_duplicates('ib')
+    mutual = best_a.merge(best_b[['ia', 'ib']], on=['ia', 'ib'])
+    return mutual.reset_index(drop=True)
+
+
+def compare_pair(a, b, tolerance=DEFAULT_TOLERANCE):
+    """Agreement, label confusion and score-delta statistics for two models on one SBID"""
+    pairs = match_detections(a, b, tolerance)
+    la = a['label'].to_numpy()[pairs['ia'].to_numpy()]
+    lb = b['label'].to_numpy()[pairs['ib'].to_numpy()]
+    delta = b['score'].to_numpy()[pairs['ib'].to_numpy()] - a['score'].to_numpy()[pairs['ia'].to_numpy()]
+    valid = (la >= 0) & (la < N_LABELS) & (lb >= 0) & (lb < N_LABELS)
+    confusion = np.bincount(la[valid] * N_LABELS + lb[valid], minlength=N_LABELS * N_LABELS)
+    n_matched = len(pairs)
+    union = len(a) + len(b) - n_matched
+    stats = {
+        'n_a': len(a),
+        'n_b': len(b),
+        'n_matched': n_matched,
+        'agreement': n_matched / union if union else np.nan,
+        'label_agreement': np.trace(confusion.reshape(N_LABELS, N_LABELS)) / n_matched if n_matched else np.nan,
+        'score_delta_median': float(np.median(delta)) if n_matched else np.nan,
+        'score_delta_mean': float(np.mean(delta)) if n_matched else np.nan,
+        'median_offset_pix': float(pairs['dist'].median()) if n_matched else np.nan,
+    }
+    for i in range(N_LABELS):
+        for j in range(N_LABELS):
+            stats[f'conf_a{i}_b{j}'] = int(confusion[i * N_LABELS + j])
+    return stats, np.histogram(delta, bins=DELTA_BINS)[0]
+
+
+def compare_sbid(sbid, model_paths, min_score=0.0, tolerance=DEFAULT_TOLERANCE):
+    """Compare every model pair on one SBID; returns (counts row, pair rows, delta histograms)"""
+    detections = {model: load_detections(path, min_score) for model, path in model_paths.items()}
+    counts = {'SBID': sbid}
+    for model, det in detections.items():
+        labels = det['label'].to_numpy()
+        per_label = np.bincount(labels[(labels >= 0) & (labels < N_LABELS)], minlength=N_LABELS)
+        for k in range(N_LABELS):
+            counts[f'label_{k}_count_{model}'] = int(per_label[k])
+    pair_rows, hists = [], {}
+    for model_a, model_b in combinations(detections, 2):
+        stats, hist = compare_pair(detections[model_a], detections[model_b], tolerance)
+        pair_rows.append({'SBID': sbid, 'model_a': model_a, 'model_b': model_b, **stats})
+        hists[(model_a, model_b)] = hist
+    return counts, pair_rows, hists
+
+
+def survey_summary(pairs, delta_hists):
+    """Survey-wide statistics per model pair from the per-SBID rows"""
+    rows = []
+    centers = (DELTA_BINS[:-1] + DELTA_BINS[1:]) / 2
+    for (model_a, model_b), group in pairs.groupby(['model_a', 'model_b'], sort=False):
+        n_a, n_b, n_matched = group['n_a'].sum(), group['n_b'].sum(), group['n_matched'].sum()
+        conf = {c: int(group[c].sum()) for c in group.columns if c.startswith('conf_')}
+        hist = delta_hists[(model_a, model_b)]
+        cdf = np.cumsum(hist) / hist.sum() if hist.sum() else None
+        rows.append({
+            'model_a': model_a,
+            'model_b': model_b,
+            'n_sbids': len(group),
+            'n_a': int(n_a),
+            'n_b': int(n_b),
+            'n_matched': int(n_matched),
+            'agreement': n_matched / (n_a + n_b - n_matched) if n_a + n_b - n_matched else np.nan,
+            'label_agreement': sum(conf[f'conf_a{i}_b{i}'] for i in range(N_LABELS)) / n_matched
+            if n_matched else np.nan,
+            'score_delta_median': centers[np.searchsorted(cdf, 0.5)] if cdf is not None else np.nan,
+            'score_delta_mean': (hist * centers).sum() / hist.sum() if hist.sum() else np.nan,
+            **conf,
+        })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the per-SBID catalogs of several detection models')
+    parser.add_argument('--model', action='append', required=True, metavar='NAME=DIR',
+                        help='Model name and its per-SBID catalog directory (repeat for every model)')
+    parser.add_argument('--min-score', type=float, default=0.0, help='Only compare detections with score >= this')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Match radius between bbox centres in pixels (default 5)')
+    parser.add_argument('-o', '--output_prefix', default='comparison', help='Prefix of the output CSV files')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+
+    models = {}
+    for spec in args.model:
+        name, _, directory = spec.partition('=')
+        if not directory:
+            parser.error(f"--model expects NAME=DIR, got '{spec}'")
+        models[name] = files_by_sbid(Catalog(directory).files())
+    if len(models) < 2:
+        parser.error('At least two models are needed')
+
+    common = sorted(set.intersection(*[set(files) for files in models.values()]))
+    print(f"Comparing {len(models)} models on {len(common)} common SBIDs")
+    for name, files in models.items():
+        if len(files) > len(common):
+            print(f"  {name}: {len(files) - len(common)} SBIDs without a counterpart are skipped")
+
+    model_paths = [{name: files[sbid] for name, files in models.items()} for sbid in common]
+    results = executor_from_args(args).run(compare_sbid, common, model_paths,
+                                           [args.min_score] * len(common), [args.tolerance] * len(common))
+    count_rows, pair_rows, delta_hists = [], [], {}
+    for sbid, result, error in results:
+        if error is not None:
+            print(f"Error comparing SBID {sbid}: {error}")
+            continue
+        counts, pairs, hists = result
+        count_rows.append(counts)
+        pair_rows.extend(pairs)
+        for key, hist in hists.items():
+            delta_hists[key] = delta_hists.get(key, 0) + hist
+
+    if not pair_rows:
+        print("No SBIDs could be compared.")
+        return
+    pairs = pd.DataFrame(pair_rows)
+    outputs = {
+        'counts': pd.DataFrame(count_rows),
+        'pairs': pairs,
+        'survey': survey_summary(pairs, delta_hists),
+    }
+    for suffix, df in outputs.items():
+        path = f"{args.output_prefix}_{suffix}.csv"
+        df.to_csv(path, index=False)
+        print(f"Saved {len(df)} rows to {path}")
+    print(outputs['survey'][['model_a', 'model_b', 'agreement', 'label_agreement', 'score_delta_median']])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Full label-confusion crossmatch of HeTu detections against RACS components.
+
+Unlike match_cs*.py (labels == 1 only, merge on component_id), every HeTu class is
+matched with a nearest-neighbour query: a KD-tree over the RACS component unit vectors
+of the SB is queried with the HeTu positions, streamed in fixed-size batches within a
+memory budget (hetu.batches), and every batch is reduced into
+  * a confusion table of HeTu label vs RACS class (island component count 1 / 2 / 3+,
+    or any categorical RACS column, plus 'none' for unmatched detections),
+  * completeness of RACS components vs HeTu score threshold per RACS class, from
+    mergeable per-SBID histograms of the best matching score,
+  * optional typed records (hetu.results) with per-label recall for every SBID.
+All SBIDs are processed in one parallel job.
+
+Command line:
+    python -m hetu.crossmatch /groups/hetu_ai/home/share/racs-mid-csv/ \
+        /groups/hetu_ai/home/share/HeTu/xzj_code/rst/output_resnet/csv/ --model resnet -o confusion_resnet
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from hetu.batches import DEFAULT_BUDGET, NearestMatch, reduce_batches
+from hetu.catalog import Catalog, files_by_sbid, resolve_column
+from hetu.executor import add_executor_arguments, executor_from_args
+from hetu.results import ResultsWriter, make_record
+
+N_LABELS = 4
+LABEL_NAMES = {0: 'CJ', 1: 'CS', 2: 'FRI', 3: 'FRII'}
+UNMATCHED = 'none'
+DEFAULT_RADIUS_ARCSEC = 40.0
+SCORE_BINS = np.linspace(0.0, 1.0, 101)
+
+RACS_ID = 'col_component_id'
+RACS_ISLAND = 'col_island_id'
+RACS_RA = 'col_ra_deg_cont'
+RACS_DEC = 'col_dec_deg_cont'
+
+
+def racs_classes(racs, class_column=None):
+    """RACS class per component: a categorical column, or the island component count (1, 2, 3+)"""
+    if class_column:
+        return racs[class_column].astype(str).to_numpy()
+    if RACS_ISLAND not in racs:
+        return np.full(len(racs), '1', dtype=object)
+    n_comp = racs.groupby(RACS_ISLAND)[RACS_ID].transform('size').to_numpy()
+    return np.where(n_comp >= 3, '3+', n_comp.astype(str)).astype(object)
+
+
+def load_hetu(path):
+    """RA, Dec, label and score of one HeTu catalog, whatever stage produced it"""
+    header = pd.read_csv(path, nrows=0).columns.tolist()
+    columns = {name: resolve_column(name, header) for name in ('ra', 'dec', 'label', 'score')}
+    missing = [name for name, physical in columns.items() if physical is None]
+    if missing:
+        raise ValueError(f"missing columns {missing}")
+    df = pd.read_csv(path, usecols=list(columns.values()))
+    return df.rename(columns={v: k for k, v in columns.items()})
+
+
+class ConfusionMatch(NearestMatch):
+    """Confusion counts, best scores and per-label reached components, accumulated per batch"""
+
+    def __init__(self, racs_ra, racs_dec, classes, radius_arcsec=DEFAULT_RADIUS_ARCSEC, budget=DEFAULT_BUDGET):
+        super().__init__(racs_ra, racs_dec, radius_arcsec, columns=('label', 'score'), budget=budget)
+        self.classes = classes
+        self.confusion = {}
+        self.best = np.full(len(classes), -np.inf)
+        # Row 0: any label, row k + 1: label k
+        self.reached = np.zeros((N_LABELS + 1, len(classes)), dtype=bool)
+        self.separations = [[] for _ in range(N_LABELS + 1)]
+
+    def accumulate(self, batch, idx, sep, matched):
+        super().accumulate(batch, idx, sep, matched)
+        labels = batch['label'].to_numpy(np.int64)
+        hetu_class = np.full(len(batch), UNMATCHED, dtype=object)
+        hetu_class[matched] = self.classes[idx[matched]]
+        pairs = pd.DataFrame({'hetu_label': labels, 'racs_class': hetu_class}).value_counts()
+        for key, n in pairs.items():
+            self.confusion[key] = self.confusion.get(key, 0) + int(n)
+        np.maximum.at(self.best, idx[matched], batch['score'].to_numpy(np.float64)[matched])
+        for k, label in enumerate([None] + list(range(N_LABELS))):
+            sel = matched if label is None else matched & (labels == label)
+            self.reached[k, idx[sel]] = True
+            self.separations[k].append(sep[sel].astype(np.float32))
+
+
+def confusion_sbid(racs_path, hetu_path, radius_arcsec=DEFAULT_RADIUS_ARCSEC, class_column=None,
+                   budget=DEFAULT_BUDGET):
+    """Confusion counts, best-score histograms and per-label recall for one SBID
+
+    The RACS components of the SB are held in a KD-tree; the HeTu catalog is streamed
+    through it in batches of at most ``budget`` bytes.
+    """
+    usecols = [RACS_ID, RACS_RA, RACS_DEC]
+    header = pd.read_csv(racs_path, nrows=0).columns
+    usecols += [c for c in (RACS_ISLAND, class_column) if c and c in header]
+    racs = pd.read_csv(racs_path, usecols=usecols)
+    classes = racs_classes(racs, class_column)
+
+    # One neighbour query per batch: nearest RACS component for every HeTu detection
+    match = ConfusionMatch(racs[RACS_RA], racs[RACS_DEC], classes, radius_arcsec, budget)
+    reduce_batches(hetu_path, [match])
+    confusion = pd.DataFrame([(label, cls, n) for (label, cls), n in match.confusion.items()],
+                             columns=['hetu_label', 'racs_class', 'count'])
+    confusion = confusion.sort_values('count', ascending=False, kind='stable', ignore_index=True)
+
+    # Best HeTu score reaching every RACS component
+    best = match.best
+    hists = {}
+    for cls in np.unique(classes):
+        in_class = classes == cls
+        hists[cls] = (int(in_class.sum()), np.histogram(best[in_class & np.isfinite(best)], bins=SCORE_BINS)[0])
+
+    recall = {}
+    for k, label in enumerate([None] + list(range(N_LABELS))):
+        recall[label] = (int(match.reached[k].sum()), len(racs), np.concatenate(match.separations[k] + [np.zeros(0)]))
+    return confusion, hists, recall
+
+
+def completeness_table(hists):
+    """Fraction of RACS components reached by a HeTu detection with score >= threshold"""
+    rows = []
+    for cls, (n_total, hist) in sorted(hists.items()):
+        above = np.cumsum(hist[::-1])[::-1]
+        for threshold, n_detected in zip(SCORE_BINS[:-1], above):
+            rows.append({
+                'racs_class': cls,
+                'score_threshold': round(float(threshold), 4),
+                'n_racs': n_total,
+                'n_detected': int(n_detected),
+                'completeness': n_detected / n_total if n_total else np.nan,
+            })
+    return pd.DataFrame(rows)
+
+
+def pair_catalogs(racs_dir, hetu_dir):
+    """SBID -> (RACS path, HeTu path) for SBIDs present in both directories"""
+    racs = files_by_sbid(Catalog(racs_dir).files())
+    hetu = files_by_sbid(Catalog(hetu_dir).files())
+    return {sbid: (racs[sbid], hetu[sbid]) for sbid in sorted(set(racs) & set(hetu))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crossmatch all HeTu classes against RACS components')
+    parser.add_argument('racs_dir', help='Directory of per-SB RACS component CSVs')
+    parser.add_argument('hetu_dir', help='Directory of per-SBID HeTu catalog CSVs')
+    parser.add_argument('--model', default='hetu', help='Model name used in the results table')
+    parser.add_argument('--radius', type=float, default=DEFAULT_RADIUS_ARCSEC, help='Match radius in arcsec')
+    parser.add_argument('--racs-class-column', default=None,
+                        help='Categorical RACS column used as class (default: island component count)')
+    parser.add_argument('--memory-budget', default=DEFAULT_BUDGET,
+                        help='Memory per worker for the streamed HeTu batches (e.g. 256MB)')
+    parser.add_argument('--results-table', default=None, help='Append per-label recall records to this table')
+    parser.add_argument('-o', '--output_prefix', default='confusion', help='Prefix of the output CSV files')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+
+    pairs = pair_catalogs(args.racs_dir, args.hetu_dir)
+    print(f"Crossmatching {len(pairs)} SBIDs within {args.radius} arcsec")
+    racs_paths, hetu_paths = [p[0] for p in pairs.values()], [p[1] for p in pairs.values()]
+    results = executor_from_args(args).run(confusion_sbid, racs_paths, hetu_paths, [args.radius] * len(pairs),
+                                           [args.racs_class_column] * len(pairs), [args.memory_budget] * len(pairs),
+                                           keys=pairs)
+
+    confusions, survey_hists = [], {}
+    writer = ResultsWriter(args.results_table) if args.results_table else None
+    for sbid, result, error in results:
+        if error is not None:
+            print(f"Error crossmatching SBID {sbid}: {error}")
+            continue
+        confusion, hists, recall = result
+        confusions.append(confusion.assign(SBID=sbid))
+        for cls, (n_total, hist) in hists.items():
+            total, acc = survey_hists.get(cls, (0, 0))
+            survey_hists[cls] = (total + n_total, acc + hist)
+        if writer is not None:
+            for label, (n_hit, n_total, separations) in recall.items():
+                writer.append(make_record(sbid, args.model, n_hit, n_total, separations,
+                                          label=label, radius_arcsec=args.radius))
+    if writer is not None:
+        writer.close()
+        print(f"Recall records appended to {args.results_table}")
+    if not confusions:
+        print("No SBIDs could be crossmatched.")
+        return
+
+    per_sbid = pd.concat(confusions, ignore_index=True)[['SBID', 'hetu_label', 'racs_class', 'count']]
+    survey = per_sbid.pivot_table(index='hetu_label', columns='racs_class', values='count',
+                                  aggfunc='sum', fill_value=0)
+    survey.index = [LABEL_NAMES.get(label, label) for label in survey.index]
+    outputs = {
+        'per_sbid': per_sbid,
+        'survey': survey.reset_index(names='hetu_label'),
+        'completeness': completeness_table(survey_hists),
+    }
+    for suffix, df in outputs.items():
+        path = f"{args.output_prefix}_{suffix}.csv"
+        df.to_csv(path, index=False)
+        print(f"Saved {len(df)} rows to {path}")
+    print(survey)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Area-normalized source densities per field and per HEALPix pixel.
+
+The HEALPix figure plotted raw counts per field centre, so large or overlapping fields
+looked denser. Here the deduplicated counts maintained by hetu.aggregates are divided by
+the sky area actually observed, taken from the MOC footprints of hetu.moc:
+  * per SBID: detections per label with score >= min score over the field footprint area
+    (plus the part of the field shared with other fields),
+  * per HEALPix pixel (the map order of the aggregates): the per-label survey counts over
+    the area of the pixel inside the union of the footprints, so overlaps are not counted
+    twice and partially observed edge pixels are not diluted.
+Both tables come from one vectorized pass over the stored states and the footprint
+ranges. They are written next to the count tables and only recomputed when the
+aggregate state or the footprint file is newer than them (or with --force).
+
+Command line:
+    python -m hetu.density --state aggregates_internimage.npz --footprints footprints.hmoc \
+        --output-dir density_internimage --min-coverage 0.5
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from hetu.aggregates import MIN_SCORE, AggregateStore
+from hetu.moc import FULL_SKY_DEG2, FootprintSet
+
+MIN_COVERAGE = 0.5
+SBID_TABLE = 'density_sbid.csv'
+PIXEL_TABLE = 'density_healpix.csv'
+
+
+def field_density(store, footprints, min_score=MIN_SCORE):
+    """Sources per square degree per label of every SBID of the aggregate store"""
+    sbids = sorted(store.fields)
+    counts = np.array([store.fields[s].label_counts(min_score) for s in sbids], dtype=np.int64).reshape(-1, store.n_labels)
+    area = np.full(len(sbids), np.nan)
+    shared = np.full(len(sbids), np.nan)
+    known = [k for k, s in enumerate(sbids) if s in footprints.sbids]
+    if known:
+        per_field = footprints.shared_area_deg2()
+        area[known] = [footprints.area_deg2(sbids[k]) for k in known]
+        shared[known] = [per_field[footprints.field_index(sbids[k])] for k in known]
+    table = pd.DataFrame({'SBID': sbids, 'area_deg2': area, 'shared_area_deg2': shared})
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for label in range(store.n_labels):
+            table[f'label_{label}_count'] = counts[:, label]
+            table[f'label_{label}_per_deg2'] = counts[:, label] / area
+        table['total_per_deg2'] = counts.sum(axis=1) / area
+    table['excluded'] = [s in store.excluded for s in sbids]
+    return table
+
+
+def pixel_density(store, footprints, min_coverage=MIN_COVERAGE, excluded_sbids=()):
+    """Sources per square degree per label of every HEALPix pixel of the store's map order"""
+    included = [s for s in footprints.sbids if s not in set(excluded_sbids)]
+    if len(included) == len(footprints.sbids):
+        coverage = footprints.union()
+    else:
+        coverage = footprints.union_of(included)
+    pixels, fraction = coverage.pixel_coverage(store.order)
+    pixel_area = FULL_SKY_DEG2 / (12 * 4 ** store.order)
+    counts = store.map[pixels]
+    # Pixels with detections but no footprint (positions outside every image) are kept
+    stray = np.setdiff1d(np.flatnonzero(store.map.sum(axis=1)), pixels)
+    pixels = np.concatenate([pixels, stray])
+    fraction = np.concatenate([fraction, np.zeros(len(stray))])
+    counts = np.concatenate([counts, store.map[stray]])
+    table = pd.DataFrame({'pixel': pixels, 'coverage_fraction': fraction, 'area_deg2': fraction * pixel_area})
+    usable = fraction >= min_coverage
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for label in range(store.n_labels):
+            table[f'label_{label}_count'] = counts[:, label]
+            table[f'label_{label}_per_deg2'] = np.where(usable, counts[:, label] / table['area_deg2'], np.nan)
+        table['total_per_deg2'] = np.where(usable, counts.sum(axis=1) / table['area_deg2'], np.nan)
+    return table.sort_values('pixel', ignore_index=True)
+
+
+def up_to_date(outputs, inputs):
+    """Whether every output exists and is newer than every input"""
+    if not all(os.path.exists(p) for p in outputs):
+        return False
+    return min(os.path.getmtime(p) for p in outputs) >= max(os.path.getmtime(p) for p in inputs)
+
+
+def save_density_map(path, table, order, n_labels):
+    """Per-label NESTED HEALPix density maps (UNSEEN where the coverage is too small)"""
+    import healpy as hp
+
+    maps = np.full((n_labels, 12 * 4 ** order), hp.UNSEEN)
+    for label in range(n_labels):
+        values = table[f'label_{label}_per_deg2'].to_numpy()
+        ok = np.isfinite(values)
+        maps[label, table['pixel'].to_numpy()[ok]] = values[ok]
+    hp.write_map(path, list(maps), nest=True, dtype=np.float64, coord='C', overwrite=True,
+                 column_names=[f'label_{label}' for label in range(n_labels)],
+                 extra_header=[('BUNIT', 'deg-2', 'sources per square degree')])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Area-normalized source densities per field and per HEALPix pixel')
+    parser.add_argument('--state', required=True, help='Aggregate state of python -m hetu.aggregates')
+    parser.add_argument('--footprints', required=True, help='Field footprints of python -m hetu.moc build')
+    parser.add_argument('--output-dir', default='.', help=f'Directory of {SBID_TABLE} and {PIXEL_TABLE}')
+    parser.add_argument('--min-score', type=float, default=MIN_SCORE, help='Score cut of the per-SBID densities')
+    parser.add_argument('--min-coverage', type=float, default=MIN_COVERAGE,
+                        help='Observed fraction below which a pixel gets no density (default 0.5)')
+    parser.add_argument('--map-out', default=None, help='Per-label HEALPix density maps (FITS)')
+    parser.add_argument('--force', action='store_true', help='Recompute even when the tables are up to date')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    sbid_path = os.path.join(args.output_dir, SBID_TABLE)
+    pixel_path = os.path.join(args.output_dir, PIXEL_TABLE)
+    if not args.force and up_to_date([sbid_path, pixel_path], [args.state, args.footprints]):
+        print(f"Density tables in {args.output_dir} are up to date")
+        return
+
+    store = AggregateStore.load(args.state)
+    with FootprintSet(args.footprints) as footprints:
+        fields = field_density(store, footprints, args.min_score)
+        pixels = pixel_density(store, footprints, args.min_coverage, store.excluded)
+    missing = fields['area_deg2'].isna().sum()
+    if missing:
+        print(f"Warning: {missing} SBIDs have no footprint and no field density")
+    fields.to_csv(sbid_path, index=False)
+    pixels.to_csv(pixel_path, index=False)
+    print(f"Densities of {len(fields)} SBIDs saved to {sbid_path}")
+    print(f"Densities of {len(pixels)} order-{store.order} pixels (score >= {store.map_min_score}) saved to {pixel_path}")
+    if args.map_out:
+        save_density_map(args.map_out, pixels, store.order, store.n_labels)
+        print(f"HEALPix density maps saved to {args.map_out}")
+
+
+if __name__ == "__main__":
+    main()
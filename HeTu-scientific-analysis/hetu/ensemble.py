@@ -0,0 +1,205 @@
+"""
+Weighted box fusion (WBF) of the detections of several models.
+
+Instead of choosing one model's catalog (ResNet-50/101, FlashInternImage-T/B, maskb),
+the per-cutout detections of all models are fused. For every SBID the models' detections
+are read together (packed shards from ``python -m hetu.shards pack``, or per-SBID catalog
+CSVs), and within every cutout:
+  * the IoU of every pair of boxes of the same cutout (and label) is computed in one
+    vectorized pass over the SBID,
+  * boxes are clustered greedily by descending score: the best unclustered box opens a
+    cluster and takes every unclustered box overlapping it with IoU >= --iou,
+  * each cluster becomes one fused box with score-weighted coordinates,
+    score = mean member score * min(members, models) / models (so a box found by one
+    model out of four keeps a quarter of its score), the number of agreeing models, and
+    the RLE mask of the best member.
+SBIDs are streamed through the worker pool one at a time, and the work per SBID is the
+IoU of the boxes sharing a cutout, which is the same work as one model's dedup pass.
+Outputs use the only_label2.py CSV layout (plus n_models, n_boxes and models), so the
+WCS and overlap-removal stages run on them unchanged.
+
+Command line:
+    python -m hetu.ensemble --model resnet50=shards/output_resnet --model internimage_t=shards/output_internimage_t \
+        --model internimage_b=shards/output_internimage_0722 --iou 0.55 -o only_label/output_wbf
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from hetu.bbox import BBOX_COLUMNS, bbox_array
+from hetu.catalog import Catalog, files_by_sbid, resolve_column
+from hetu.executor import add_executor_arguments, executor_from_args
+from hetu.shards import SHARD_SUFFIX, ShardReader, concat_ranges, list_shards
+
+DEFAULT_IOU = 0.55
+
+
+def model_files(directory):
+    """SBID -> detection file of one model: packed shards if present, else catalog CSVs"""
+    shards = list_shards(directory)
+    if shards:
+        return {os.path.basename(p)[:-len(SHARD_SUFFIX)]: p for p in shards}
+    return files_by_sbid(Catalog(directory).files())
+
+
+def load_detections(path, min_score=0.0):
+    """component_id, label, score, pixel bbox and RLE counts of one model on one SBID"""
+    if path.endswith(SHARD_SUFFIX):
+        with ShardReader(path) as reader:
+            names = np.array(reader.component_ids(), dtype=object)
+            df = pd.DataFrame({'component_id': names[reader.component_rows()],
+                               'label': np.asarray(reader.arrays['labels'], dtype=np.int64),
+                               'score': np.array(reader.arrays['scores'])})
+            df[BBOX_COLUMNS] = np.array(reader.arrays['bboxes'])
+            df['counts'] = [reader.counts(k) for k in range(len(reader))]
+    else:
+        df = pd.read_csv(path)
+        df = df.rename(columns={resolve_column('label', df.columns): 'label'})
+        bboxes = bbox_array(df)
+        df = df[['component_id', 'label', 'score'] + (['counts'] if 'counts' in df else [])].copy()
+        df[BBOX_COLUMNS] = bboxes
+        if 'counts' not in df:
+            df['counts'] = ''
+    return df[df['score'] >= min_score].reset_index(drop=True)
+
+
+def cutout_pairs(groups):
+    """(i, j) index pairs, i < j, of rows sharing a group, for rows sorted by group"""
+    starts = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]])) if len(groups) else np.zeros(0, int)
+    sizes = np.diff(np.concatenate([starts, [len(groups)]]))
+    # Row i pairs with the rows after it in its group
+    group_end = np.repeat(starts + sizes, sizes)
+    i = np.repeat(np.arange(len(groups)), group_end - np.arange(len(groups)) - 1)
+    j = concat_ranges(np.arange(len(groups)) + 1, group_end)
+    return i, j
+
+
+def box_iou(a, b):
+    """IoU of matching rows of two (N, 4) [x1, y1, x2, y2] arrays"""
+    w = np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None)
+    h = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    inter = w * h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a + area_b - inter
+    return np.where(union > 0, inter / np.where(union > 0, union, 1), 0.0)
+
+
+def cluster_boxes(n, i, j, iou, threshold):
+    """Greedy clusters: rows are in descending score order within each cutout"""
+    keep = iou >= threshold
+    i, j = i[keep], j[keep]
+    order = np.argsort(i, kind='stable')
+    i, j = i[order], j[order]
+    first = np.searchsorted(i, np.arange(n + 1))
+    cluster = np.full(n, -1, dtype=np.int64)
+    for row in range(n):
+        if cluster[row] >= 0:
+            continue
+        cluster[row] = row
+        # j > row always, so the neighbours' clusters are still open
+        neighbours = j[first[row]:first[row + 1]]
+        neighbours = neighbours[cluster[neighbours] < 0]
+        cluster[neighbours] = row
+    return cluster
+
+
+def fuse_sbid(model_paths, iou_threshold=DEFAULT_IOU, min_score=0.0, by_label=True):
+    """Fused detections of one SBID from {model: detection file}"""
+    frames = []
+    for k, (model, path) in enumerate(model_paths.items()):
+        frames.append(load_detections(path, min_score).assign(model=k))
+    det = pd.concat(frames, ignore_index=True)
+    keys = ['component_id', 'label'] if by_label else ['component_id']
+    det = det.sort_values(keys + ['score'], ascending=[True] * len(keys) + [False], kind='stable',
+                          ignore_index=True)
+    if det.empty:
+        return det.assign(n_models=0, n_boxes=0, models='')
+    groups = det.groupby(keys, sort=False).ngroup().to_numpy()
+    boxes = det[BBOX_COLUMNS].to_numpy(np.float64)
+    i, j = cutout_pairs(groups)
+    cluster = cluster_boxes(len(det), i, j, box_iou(boxes[i], boxes[j]), iou_threshold)
+
+    seeds, inverse = np.unique(cluster, return_inverse=True)
+    scores = det['score'].to_numpy(np.float64)
+    weight = np.bincount(inverse, weights=scores)
+    fused = np.column_stack([np.bincount(inverse, weights=scores * boxes[:, k]) for k in range(4)])
+    fused /= np.where(weight > 0, weight, 1)[:, None]
+    n_boxes = np.bincount(inverse)
+    model_bits = np.zeros(len(seeds), dtype=np.int64)
+    np.bitwise_or.at(model_bits, inverse, 1 << det['model'].to_numpy(np.int64))
+    n_models = np.array([bin(b).count('1') for b in model_bits.tolist()], dtype=np.int64)
+    n_total = len(model_paths)
+
+    out = det.iloc[seeds][['component_id', 'label', 'counts']].reset_index(drop=True)
+    if not by_label:
+        # Label with the largest summed score in the cluster
+        label_score = pd.DataFrame({'c': inverse, 'label': det['label'].to_numpy(), 's': scores})
+        best = label_score.groupby(['c', 'label'])['s'].sum().reset_index()
+        best = best.sort_values(['c', 's'], ascending=[True, False]).drop_duplicates('c')
+        out['label'] = best['label'].to_numpy()
+    out['score'] = weight / n_boxes * np.minimum(n_boxes, n_total) / n_total
+    out[BBOX_COLUMNS] = fused.astype(np.float32)
+    out['n_models'] = n_models
+    out['n_boxes'] = n_boxes
+    names = list(model_paths)
+    out['models'] = [';'.join(names[k] for k in range(n_total) if b >> k & 1) for b in model_bits.tolist()]
+    return out[['component_id', 'label', 'score'] + BBOX_COLUMNS + ['counts', 'n_models', 'n_boxes', 'models']]
+
+
+def fuse_to_csv(sbid, model_paths, output_dir, iou_threshold=DEFAULT_IOU, min_score=0.0, by_label=True):
+    """Fuse one SBID into <output_dir>/<SBID>.csv; returns (input boxes, fused boxes)"""
+    fused = fuse_sbid(model_paths, iou_threshold, min_score, by_label)
+    fused.to_csv(os.path.join(output_dir, f"{sbid}.csv"), index=False)
+    return int(fused['n_boxes'].sum()), len(fused)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Weighted box fusion of the detections of several models')
+    parser.add_argument('--model', action='append', required=True, metavar='NAME=DIR',
+                        help='Model name and its shard or per-SBID catalog directory (repeat for every model)')
+    parser.add_argument('--iou', type=float, default=DEFAULT_IOU, help='IoU at which boxes are fused (default 0.55)')
+    parser.add_argument('--min-score', type=float, default=0.0, help='Ignore boxes below this score')
+    parser.add_argument('--ignore-labels', action='store_true',
+                        help='Fuse boxes of different labels; the fused label has the largest summed score')
+    parser.add_argument('-o', '--output_dir', required=True, help='Output directory of the fused per-SBID CSVs')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+
+    models = {}
+    for spec in args.model:
+        name, _, directory = spec.partition('=')
+        if not directory:
+            parser.error(f"--model expects NAME=DIR, got '{spec}'")
+        models[name] = model_files(directory)
+    if len(models) < 2:
+        parser.error('At least two models are needed')
+    if len(models) > 62:
+        parser.error('At most 62 models can be fused')
+
+    common = sorted(set.intersection(*[set(files) for files in models.values()]))
+    print(f"Fusing {len(models)} models on {len(common)} common SBIDs")
+    for name, files in models.items():
+        if len(files) > len(common):
+            print(f"  {name}: {len(files) - len(common)} SBIDs without a counterpart are skipped")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    n = len(common)
+    model_paths = [{name: files[sbid] for name, files in models.items()} for sbid in common]
+    results = executor_from_args(args).run(fuse_to_csv, common, model_paths, [args.output_dir] * n, [args.iou] * n,
+                                           [args.min_score] * n, [not args.ignore_labels] * n)
+    n_in = n_out = 0
+    for sbid, result, error in results:
+        if error is not None:
+            print(f"Error fusing SBID {sbid}: {error}")
+            continue
+        n_in += result[0]
+        n_out += result[1]
+        print(f"  {sbid}: {result[0]} boxes -> {result[1]} fused")
+    print(f"\nFused {n_in} boxes into {n_out} detections in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
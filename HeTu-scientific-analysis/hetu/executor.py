@@ -0,0 +1,106 @@
+"""
+Pluggable executor backend (serial / threads / processes) for the per-SBID batch loops.
+
+Every stage maps one function over a list of tasks, usually one per SBID. ``Executor``
+runs that map with the backend chosen on the command line:
+  * 'serial'    in the calling process (debugging, profiling, tiny inputs),
+  * 'threads'   a thread pool, for stages dominated by CSV/FITS reading,
+  * 'processes' a process pool, for CPU-bound stages (the function and its arguments
+                must be picklable, i.e. module-level).
+Results always come back in task order. ``chunksize`` groups tasks per round trip to the
+process pool. The default worker count is the SLURM CPU allocation of the job
+(SLURM_CPUS_PER_TASK), else the CPUs this process may run on.
+
+``run`` isolates failures: it yields ``(key, result, error)`` per task, with the exception
+text in ``error`` instead of stopping the whole batch.
+
+    from hetu.executor import Executor
+
+    executor = Executor('processes', workers=8)
+    for sbid, result, error in executor.run(process_file, paths, keys=sbids):
+        if error is not None:
+            print(f"Error processing SBID {sbid}: {error}")
+
+Scripts add ``--backend/--workers/--chunksize`` with ``add_executor_arguments(parser)``
+and build the executor with ``executor_from_args(args)``.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+BACKENDS = ('serial', 'threads', 'processes')
+
+
+def default_workers():
+    """CPUs allocated by SLURM to this task, else the CPUs this process may use"""
+    for name in ('SLURM_CPUS_PER_TASK', 'SLURM_CPUS_ON_NODE'):
+        value = os.environ.get(name, '')
+        if value.isdigit() and int(value) > 0:
+            return int(value)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class _Isolated:
+    """Picklable wrapper that returns (result, error) instead of raising"""
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *args):
+        try:
+            return self.func(*args), None
+        except Exception as e:
+            return None, str(e) or type(e).__name__
+
+
+class Executor:
+    """Ordered map of a function over tasks with a serial, thread or process backend"""
+
+    def __init__(self, backend='processes', workers=None, chunksize=1):
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown executor backend '{backend}' (choose from {', '.join(BACKENDS)})")
+        self.backend = backend
+        self.workers = workers or default_workers()
+        self.chunksize = max(1, chunksize)
+
+    def __repr__(self):
+        return f"Executor({self.backend!r}, workers={self.workers}, chunksize={self.chunksize})"
+
+    def map(self, func, *iterables):
+        """Results of func(*args) in task order; the first exception is raised"""
+        tasks = [list(it) for it in iterables]
+        n_tasks = min(map(len, tasks)) if tasks else 0
+        workers = min(self.workers, n_tasks)
+        if self.backend == 'serial' or workers <= 1:
+            yield from map(func, *tasks)
+            return
+        if self.backend == 'threads':
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                yield from pool.map(func, *tasks)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                yield from pool.map(func, *tasks, chunksize=self.chunksize)
+
+    def run(self, func, *iterables, keys=None):
+        """Yield (key, result, error) per task in order; a failing task does not stop the others"""
+        tasks = [list(it) for it in iterables]
+        keys = tasks[0] if keys is None else list(keys)
+        for key, (result, error) in zip(keys, self.map(_Isolated(func), *tasks)):
+            yield key, result, error
+
+
+def add_executor_arguments(parser, backend='processes'):
+    """--backend / --workers / --chunksize options shared by the batch scripts"""
+    group = parser.add_argument_group('execution')
+    group.add_argument('--backend', choices=BACKENDS, default=backend,
+                       help=f'Executor backend (default {backend})')
+    group.add_argument('--workers', type=int, default=None,
+                       help='Number of workers (default: SLURM_CPUS_PER_TASK or all available CPUs)')
+    group.add_argument('--chunksize', type=int, default=1, help='Tasks sent to a worker process at a time')
+    return group
+
+
+def executor_from_args(args):
+    return Executor(args.backend, args.workers, args.chunksize)
@@ -0,0 +1,202 @@
+"""
+Friends-of-friends grouping of radio components and their association with HeTu sources.
+
+RACS and PyBDSF list the lobes and the core of a double-lobed source as separate
+components, and crossmatch_bdsf_hetu_1.py keeps only the nearest one, so an FRII box is
+linked to a single lobe. Here
+  * components closer than the linking length are friends, and groups are the
+    connected components of the friendship graph (KD-tree pair search on unit vectors,
+    scipy.sparse.csgraph),
+  * every component inside the sky bbox of a HeTu detection is assigned to it (the
+    highest-scoring detection when boxes overlap),
+  * every HeTu detection gets its multiplicity: the number of components inside its box,
+    the number of FoF groups they belong to, and the size of those groups.
+The sky is cut into declination shards of equal component count (as in hetu.lrmatch),
+each padded by the linking length and the largest box radius; shards are processed in
+parallel and their links are merged globally, so groups crossing a shard boundary stay
+whole.
+
+Command line:
+    python -m hetu.fof /home/ydai240628/analysis_hetu/file/match_bdsf_hetu/matched_bdsf_racs_srl_20arcsec.csv \
+        /home/ydai240628/analysis_hetu/file/bbox_overlap_removal/output_internimage_0722 \
+        --ra RA --dec DEC --link 30 --shards 16 -o components_fof.csv --sources-out hetu_multiplicity.csv
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from hetu import skygeom
+from hetu.catalog import Catalog
+from hetu.executor import Executor, add_executor_arguments, executor_from_args
+from hetu.lrmatch import dec_shards
+from hetu.skygeom import chord_from_arcsec, radec_to_xyz
+
+DEFAULT_LINK_ARCSEC = 30.0
+BOX_COLUMNS = ['bbox_ra_min', 'bbox_ra_max', 'bbox_dec_min', 'bbox_dec_max']
+
+
+def box_circles(ra_min, ra_max, dec_min, dec_max):
+    """Centre (RA, Dec) and enclosing radius (degrees) of wrap-aware sky boxes"""
+    start, width = skygeom.interval_from_bounds(ra_min, ra_max)
+    ra_c = skygeom.normalize_ra(start + width / 2)
+    dec_c = (np.asarray(dec_min, np.float64) + dec_max) / 2
+    radius = np.max([skygeom.angular_distance(ra_c, dec_c, ra, dec)
+                     for ra in (start, start + width) for dec in (dec_min, dec_max)], axis=0)
+    return ra_c, dec_c, radius
+
+
+def _shard_links(ra, dec, link_arcsec, boxes, box_ra, box_dec, box_radius):
+    """Friend pairs and (component, box) memberships of one shard (local indices)"""
+    from scipy.spatial import cKDTree
+
+    empty = np.zeros((0, 2), dtype=np.int64)
+    if len(ra) == 0:
+        return empty, empty
+    tree = cKDTree(radec_to_xyz(ra, dec))
+    pairs = tree.query_pairs(chord_from_arcsec(link_arcsec), output_type='ndarray').astype(np.int64)
+    if len(boxes) == 0:
+        return pairs, empty
+    candidates = tree.query_ball_point(radec_to_xyz(box_ra, box_dec), chord_from_arcsec(box_radius * 3600.0))
+    n_cand = np.fromiter(map(len, candidates), dtype=np.int64, count=len(candidates))
+    if n_cand.sum() == 0:
+        return pairs, empty
+    b = np.repeat(np.arange(len(boxes)), n_cand)
+    c = np.concatenate(candidates).astype(np.int64)
+    inside = skygeom.box_contains_point(*boxes[b].T, ra[c], dec[c])
+    return pairs, np.column_stack([c[inside], b[inside]])
+
+
+def fof_groups(ra, dec, boxes=None, box_scores=None, link_arcsec=DEFAULT_LINK_ARCSEC, n_shards=1, executor=None):
+    """
+    Friends-of-friends groups of components and their HeTu box of membership.
+
+    boxes is an (M, 4) array of ra_min, ra_max, dec_min, dec_max (ra_min > ra_max crosses
+    RA = 0). Returns (group, multiplicity, box) per component: the group label, the group
+    size and the index of the highest-scoring box containing the component (-1 for none).
+    Components without a finite position get group -1 and multiplicity 0; boxes with a
+    non-finite bound contain nothing.
+    """
+    ra, dec = np.asarray(ra, np.float64), np.asarray(dec, np.float64)
+    boxes = np.zeros((0, 4)) if boxes is None else np.asarray(boxes, np.float64).reshape(-1, 4)
+    box_scores = np.zeros(len(boxes)) if box_scores is None else np.asarray(box_scores, np.float64)
+    ok = np.isfinite(ra) & np.isfinite(dec)
+    good_boxes = np.flatnonzero(np.isfinite(boxes).all(axis=1))
+    if not ok.all() or len(good_boxes) < len(boxes):
+        group = np.full(len(ra), -1, dtype=np.int64)
+        multiplicity = np.zeros(len(ra), dtype=np.int64)
+        box = np.full(len(ra), -1, dtype=np.int64)
+        g, m, b = fof_groups(ra[ok], dec[ok], boxes[good_boxes], box_scores[good_boxes], link_arcsec, n_shards,
+                             executor)
+        group[ok], multiplicity[ok] = g, m
+        box[ok] = np.where(b >= 0, good_boxes[np.maximum(b, 0)], -1)
+        return group, multiplicity, box
+
+    box_ra, box_dec, box_radius = box_circles(*boxes.T) if len(boxes) else (np.zeros(0),) * 3
+    margin = max(link_arcsec / 3600.0, float(box_radius.max()) if len(boxes) else 0.0)
+
+    shards, tasks = [], []
+    bands = dec_shards(dec, n_shards)
+    # Band edges midway between neighbouring bands; boxes go to the band holding their centre
+    edges = [(dec[a].max() + dec[b].min()) / 2 for a, b in zip(bands[:-1], bands[1:])]
+    box_band = np.searchsorted(np.array(edges), box_dec, side='right')
+    edges = [-90.0] + edges + [90.0]
+    for k, rows in enumerate(bands):
+        local = np.flatnonzero((dec >= edges[k] - margin) & (dec <= edges[k + 1] + margin))
+        band_boxes = np.flatnonzero(box_band == k)
+        shards.append((local, band_boxes))
+        tasks.append((ra[local], dec[local], link_arcsec, boxes[band_boxes], box_ra[band_boxes],
+                      box_dec[band_boxes], box_radius[band_boxes]))
+
+    executor = executor or Executor('processes')
+    results = list(executor.map(_shard_links, *zip(*tasks))) if tasks else []
+    all_pairs, all_members = [np.zeros((0, 2), dtype=np.int64)], [np.zeros((0, 2), dtype=np.int64)]
+    for (local, band_boxes), (pairs, members) in zip(shards, results):
+        all_pairs.append(local[pairs])
+        all_members.append(np.column_stack([local[members[:, 0]], band_boxes[members[:, 1]]]))
+    pairs = np.unique(np.concatenate(all_pairs), axis=0)
+    members = np.concatenate(all_members)
+
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    n = len(ra)
+    graph = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    _, group = connected_components(graph, directed=False)
+    multiplicity = np.bincount(group)[group]
+    box = np.full(n, -1, dtype=np.int64)
+    if len(members):
+        # Highest-scoring box first, so each component keeps its best box
+        order = np.lexsort((-box_scores[members[:, 1]], members[:, 0]))
+        members = members[order]
+        first = np.concatenate([[True], members[1:, 0] != members[:-1, 0]])
+        box[members[first, 0]] = members[first, 1]
+    return group, multiplicity, box
+
+
+def source_multiplicity(group, multiplicity, box, n_boxes):
+    """Per HeTu box: components inside, distinct FoF groups, and components of those groups"""
+    assigned = box >= 0
+    n_components = np.bincount(box[assigned], minlength=n_boxes)
+    pairs = np.unique(np.column_stack([box[assigned], group[assigned]]), axis=0)
+    n_groups = np.bincount(pairs[:, 0], minlength=n_boxes)
+    group_size = np.bincount(group[group >= 0])
+    n_group_components = np.bincount(pairs[:, 0], weights=group_size[pairs[:, 1]], minlength=n_boxes).astype(np.int64)
+    return pd.DataFrame({'n_components': n_components, 'n_fof_groups': n_groups,
+                         'n_group_components': n_group_components})
+
+
+def load_hetu(source):
+    """HeTu detections with sky boxes, from a catalog CSV or a directory of per-SBID catalogs"""
+    if os.path.isdir(source):
+        df = Catalog(source).query().collect(with_sbid=True)
+    else:
+        df = pd.read_csv(source)
+    missing = [c for c in BOX_COLUMNS + ['score'] if c not in df.columns]
+    if missing:
+        raise ValueError(f"{source} is missing columns: {', '.join(missing)}")
+    return df.dropna(subset=BOX_COLUMNS).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Friends-of-friends grouping of components within HeTu sources')
+    parser.add_argument('components', help='Component catalog CSV (RACS, PyBDSF srl/gaul)')
+    parser.add_argument('hetu', help='HeTu catalog CSV with sky bboxes, or a directory of per-SBID catalogs')
+    parser.add_argument('--ra', default='RA', help='RA column of the components (degrees)')
+    parser.add_argument('--dec', default='DEC', help='Dec column of the components (degrees)')
+    parser.add_argument('--link', type=float, default=DEFAULT_LINK_ARCSEC, help='Linking length in arcsec')
+    parser.add_argument('--shards', type=int, default=1, help='Number of declination shards')
+    parser.add_argument('-o', '--output', default='components_fof.csv', help='Components with group and HeTu source')
+    parser.add_argument('--sources-out', default=None, help='HeTu catalog with the multiplicity columns')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+
+    components = pd.read_csv(args.components, comment='#')
+    components.columns = components.columns.str.strip()
+    hetu = load_hetu(args.hetu)
+    group, multiplicity, box = fof_groups(components[args.ra], components[args.dec], hetu[BOX_COLUMNS].to_numpy(),
+                                          hetu['score'].to_numpy(), args.link, args.shards, executor_from_args(args))
+
+    components['fof_group'] = group
+    components['fof_multiplicity'] = multiplicity
+    components['hetu_row'] = box
+    for column in ('component_id', 'label', 'score', 'SBID'):
+        if column in hetu:
+            values = hetu[column].to_numpy()
+            components[f'hetu_{column}'] = pd.Series(values[np.maximum(box, 0)]).where(box >= 0).to_numpy()
+    components.to_csv(args.output, index=False)
+    n_groups = len(np.unique(group[group >= 0]))
+    print(f"{len(components)} components in {n_groups} FoF groups (link {args.link}\"), "
+          f"{(multiplicity > 1).sum()} in groups of 2+; {(box >= 0).sum()} inside {len(hetu)} HeTu boxes")
+    print(f"Saved {len(components)} rows to {args.output}")
+
+    sources = pd.concat([hetu, source_multiplicity(group, multiplicity, box, len(hetu))], axis=1)
+    print(sources['n_components'].value_counts().sort_index().rename('HeTu sources by component count').to_string())
+    if args.sources_out:
+        sources.to_csv(args.sources_out, index=False)
+        print(f"Saved {len(sources)} rows to {args.sources_out}")
+
+
+if __name__ == "__main__":
+    main()
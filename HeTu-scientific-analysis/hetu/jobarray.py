@@ -0,0 +1,299 @@
+"""
+Split a per-SBID pipeline stage into a SLURM job array and merge the shard outputs.
+
+plot_2.slurm / plot_3.slurm / plot7.slurm run one Python process on one node whatever the
+number of SBIDs. ``plan`` splits the input files of a stage into N shards of balanced
+weight (file size, or detection count from the hetu.catalog statistics), greedily giving
+the heaviest remaining file to the lightest shard, and writes ``plan.json`` plus a
+``job.slurm`` array script into a work directory. Every array task runs the unchanged
+stage script on its own shard: ``{input}`` in the command is replaced by a directory of
+symlinks to the shard's files and ``{output}`` by the shard's output directory.
+``merge`` then moves the per-shard outputs into the final directory (CSV files written
+by several shards are concatenated) and writes ``_shards.csv`` with the per-shard
+statistics (files, bytes, weight, return code, runtime).
+
+``submit --local`` runs the same array script through a local stand-in scheduler that
+sets SLURM_ARRAY_TASK_ID / SLURM_ARRAY_JOB_ID / SLURM_CPUS_PER_TASK like sbatch would, so
+the whole flow can be tested without a cluster.
+
+Command line (the stage command runs in the directory where ``plan`` was called):
+    python -m hetu.jobarray plan /home/ydai240628/analysis_hetu/file/wcs_output_new/wcs_resnet101 \
+        work/bbox_resnet --shards 16 --balance rows \
+        --cmd "python cateloge_creation/bbox_overlap_removal_all.py --input_dir {input} --output_dir {output}"
+    python -m hetu.jobarray submit work/bbox_resnet            # sbatch --array=0-15
+    python -m hetu.jobarray submit work/bbox_resnet --local    # stand-in scheduler
+    python -m hetu.jobarray merge work/bbox_resnet /home/ydai240628/analysis_hetu/file/bbox_overlap_removal/output_resnet
+"""
+import argparse
+import heapq
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from hetu.catalog import STATS_FILE, Catalog, sbid_from_path
+from hetu.executor import Executor
+
+PLAN_FILE = 'plan.json'
+SCRIPT_FILE = 'job.slurm'
+SUMMARY_FILE = '_shards.csv'
+
+SBATCH_TEMPLATE = """#!/bin/bash
+
+#SBATCH --job-name={job_name}
+#SBATCH --partition={partition}
+#SBATCH --nodes=1
+#SBATCH --ntasks-per-node=1
+#SBATCH --cpus-per-task={cpus}
+#SBATCH --comment=hetu_ai
+#SBATCH --array=0-{last}%{max_parallel}
+#SBATCH --output={log_dir}/%x_%A_%a.out
+#SBATCH --error={log_dir}/%x_%A_%a.err
+
+cd {cwd}
+export PYTHONPATH={package_root}${{PYTHONPATH:+:$PYTHONPATH}}
+{python} -m hetu.jobarray run {work_dir} "$SLURM_ARRAY_TASK_ID"
+"""
+
+
+def balance_shards(weights, n_shards):
+    """Greedy longest-processing-time split: item indices per shard, heaviest first"""
+    n_shards = max(1, min(n_shards, len(weights)))
+    heap = [(0, k) for k in range(n_shards)]
+    shards = [[] for _ in range(n_shards)]
+    for i in sorted(range(len(weights)), key=lambda i: -weights[i]):
+        load, k = heapq.heappop(heap)
+        shards[k].append(i)
+        heapq.heappush(heap, (load + weights[i], k))
+    return shards
+
+
+def file_weights(catalog, balance):
+    """Weight of every catalog file: its size in bytes or its row (detection) count
+
+    A file the statistics skipped (unreadable) keeps its place in the plan with weight 1;
+    the stage itself reports what is wrong with it.
+    """
+    paths = catalog.files()
+    if balance == 'rows':
+        stats = catalog.stats()
+        rows = dict(zip(stats['file'], stats['n_rows'])) if len(stats) else {}
+        return paths, [int(rows.get(os.path.basename(p), 1)) for p in paths]
+    return paths, [os.path.getsize(p) for p in paths]
+
+
+def make_plan(input_dir, work_dir, command, n_shards, balance='size', pattern='*.csv', exclude_sbids=()):
+    """Balanced shard assignment of a stage's input files, written to work_dir/plan.json"""
+    # Keep the row-count statistics in the work directory, out of the stage's input
+    os.makedirs(work_dir, exist_ok=True)
+    catalog = Catalog(input_dir, pattern, exclude_sbids=exclude_sbids,
+                      stats_path=os.path.join(work_dir, STATS_FILE))
+    paths, weights = file_weights(catalog, balance)
+    shards = []
+    for k, members in enumerate(balance_shards(weights, n_shards)):
+        members = sorted(members)
+        shards.append({
+            'task_id': k,
+            'files': [os.path.abspath(paths[i]) for i in members],
+            'sbids': [sbid_from_path(paths[i]) for i in members],
+            'weight': int(sum(weights[i] for i in members)),
+        })
+    plan = {
+        'input_dir': os.path.abspath(input_dir),
+        'work_dir': os.path.abspath(work_dir),
+        'cwd': os.getcwd(),
+        'command': command,
+        'balance': balance,
+        'shards': shards,
+    }
+    with open(os.path.join(work_dir, PLAN_FILE), 'w') as f:
+        json.dump(plan, f, indent=1)
+    return plan
+
+
+def load_plan(work_dir):
+    with open(os.path.join(work_dir, PLAN_FILE), 'r') as f:
+        return json.load(f)
+
+
+def write_script(plan, partition='insp-128C4T', cpus=28, max_parallel=32, job_name='HeTu'):
+    """sbatch array script running every shard of the plan"""
+    log_dir = os.path.join(plan['work_dir'], 'log')
+    os.makedirs(log_dir, exist_ok=True)
+    script = SBATCH_TEMPLATE.format(
+        job_name=job_name, partition=partition, cpus=cpus, last=len(plan['shards']) - 1,
+        max_parallel=max_parallel, log_dir=log_dir, cwd=plan['cwd'], python=sys.executable,
+        package_root=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        work_dir=plan['work_dir'])
+    path = os.path.join(plan['work_dir'], SCRIPT_FILE)
+    with open(path, 'w') as f:
+        f.write(script)
+    return path
+
+
+def shard_dirs(work_dir, task_id):
+    base = os.path.join(work_dir, f'shard_{int(task_id):04d}')
+    return os.path.join(base, 'input'), os.path.join(base, 'output'), os.path.join(base, 'status.json')
+
+
+def run_shard(work_dir, task_id):
+    """Run the stage command on one shard (executed inside an array task); returns its status"""
+    plan = load_plan(work_dir)
+    shard = plan['shards'][int(task_id)]
+    input_dir, output_dir, status_path = shard_dirs(work_dir, task_id)
+    shutil.rmtree(input_dir, ignore_errors=True)
+    os.makedirs(input_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    for path in shard['files']:
+        os.symlink(path, os.path.join(input_dir, os.path.basename(path)))
+
+    command = plan['command'].format(input=input_dir, output=output_dir)
+    print(f"Shard {task_id}: {len(shard['files'])} files, weight {shard['weight']}")
+    print(f"  {command}", flush=True)
+    start = time.time()
+    returncode = subprocess.call(command, shell=True, cwd=plan['cwd'])
+    status = {
+        'task_id': int(task_id),
+        'n_files': len(shard['files']),
+        'bytes': sum(os.path.getsize(p) for p in shard['files']),
+        'weight': shard['weight'],
+        'returncode': returncode,
+        'seconds': round(time.time() - start, 3),
+        'host': os.uname().nodename,
+        'sbids': ','.join(s or '' for s in shard['sbids']),
+    }
+    with open(status_path, 'w') as f:
+        json.dump(status, f)
+    return status
+
+
+class LocalScheduler:
+    """Stand-in for sbatch: runs every array task of a script as a local subprocess"""
+
+    def __init__(self, max_parallel=2, cpus_per_task=1):
+        self.max_parallel = max_parallel
+        self.cpus_per_task = cpus_per_task
+
+    def _run_task(self, script, job_id, task_id):
+        env = dict(os.environ, SLURM_ARRAY_JOB_ID=str(job_id), SLURM_ARRAY_TASK_ID=str(task_id),
+                   SLURM_JOB_ID=f'{job_id}_{task_id}', SLURM_CPUS_PER_TASK=str(self.cpus_per_task))
+        return task_id, subprocess.call(['bash', script], env=env)
+
+    def submit(self, script, task_ids):
+        """Run the array and return {task_id: return code}"""
+        job_id = os.getpid()
+        executor = Executor('threads', self.max_parallel)
+        return dict(executor.map(self._run_task, [script] * len(task_ids), [job_id] * len(task_ids), task_ids))
+
+
+def submit(work_dir, local=False, max_parallel=2, cpus=1, task_ids=None):
+    """Submit the array with sbatch, or run it with the local stand-in scheduler"""
+    plan = load_plan(work_dir)
+    script = os.path.join(plan['work_dir'], SCRIPT_FILE)
+    task_ids = list(range(len(plan['shards']))) if task_ids is None else task_ids
+    if local:
+        return LocalScheduler(max_parallel, cpus).submit(script, task_ids)
+    array = ','.join(str(t) for t in task_ids)
+    output = subprocess.check_output(['sbatch', f'--array={array}', script], text=True)
+    print(output.strip())
+    return output
+
+
+def merge_shards(work_dir, output_dir):
+    """Move shard outputs into output_dir and write the per-shard statistics; returns the summary"""
+    plan = load_plan(work_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    rows, sources = [], {}
+    for shard in plan['shards']:
+        _, shard_output, status_path = shard_dirs(work_dir, shard['task_id'])
+        if not os.path.exists(status_path):
+            rows.append({'task_id': shard['task_id'], 'n_files': len(shard['files']),
+                         'weight': shard['weight'], 'returncode': None})
+            continue
+        with open(status_path, 'r') as f:
+            status = json.load(f)
+        status['n_outputs'] = 0
+        for root, _, files in os.walk(shard_output):
+            for name in files:
+                rel = os.path.relpath(os.path.join(root, name), shard_output)
+                sources.setdefault(rel, []).append(os.path.join(root, name))
+                status['n_outputs'] += 1
+        rows.append(status)
+
+    for rel, paths in sorted(sources.items()):
+        target = os.path.join(output_dir, rel)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if len(paths) == 1:
+            shutil.move(paths[0], target)
+        elif rel.endswith('.csv'):
+            # The same file from several shards (e.g. a summary table): concatenate the rows
+            pd.concat([pd.read_csv(p) for p in paths], ignore_index=True).to_csv(target, index=False)
+        else:
+            print(f"Warning: {rel} written by {len(paths)} shards, keeping the first")
+            shutil.move(paths[0], target)
+
+    summary = pd.DataFrame(rows).sort_values('task_id')
+    summary.to_csv(os.path.join(output_dir, SUMMARY_FILE), index=False)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SLURM job-array sharding and merge for per-SBID stages')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_plan = sub.add_parser('plan', help='Split the input files into balanced shards and write the array script')
+    p_plan.add_argument('input_dir', help='Directory of per-SBID input files')
+    p_plan.add_argument('work_dir', help='Work directory for the plan, shard inputs/outputs and logs')
+    p_plan.add_argument('--cmd', required=True, help='Stage command with {input} and {output} placeholders')
+    p_plan.add_argument('--shards', type=int, default=16, help='Number of array tasks')
+    p_plan.add_argument('--balance', choices=['size', 'rows'], default='size',
+                        help='Balance shards by file size or by detection count')
+    p_plan.add_argument('--pattern', default='*.csv', help='Glob pattern of the input files')
+    p_plan.add_argument('--exclude', default='', help='Comma separated SBIDs to exclude')
+    p_plan.add_argument('--partition', default='insp-128C4T')
+    p_plan.add_argument('--cpus', type=int, default=28, help='CPUs per array task')
+    p_plan.add_argument('--max-parallel', type=int, default=32, help='Maximum simultaneously running tasks')
+    p_submit = sub.add_parser('submit', help='Submit the array with sbatch or run it locally')
+    p_submit.add_argument('work_dir')
+    p_submit.add_argument('--local', action='store_true', help='Use the local stand-in scheduler')
+    p_submit.add_argument('--max-parallel', type=int, default=2, help='Concurrent local tasks')
+    p_submit.add_argument('--cpus', type=int, default=1, help='SLURM_CPUS_PER_TASK of local tasks')
+    p_submit.add_argument('--tasks', default=None, help='Comma separated task ids (default: all, e.g. to resubmit)')
+    p_run = sub.add_parser('run', help='Run one shard (called by the array script)')
+    p_run.add_argument('work_dir')
+    p_run.add_argument('task_id', type=int)
+    p_merge = sub.add_parser('merge', help='Combine the shard outputs and statistics')
+    p_merge.add_argument('work_dir')
+    p_merge.add_argument('output_dir')
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        exclude = [s.strip() for s in args.exclude.split(',') if s.strip()]
+        plan = make_plan(args.input_dir, args.work_dir, args.cmd, args.shards, args.balance, args.pattern, exclude)
+        script = write_script(plan, args.partition, args.cpus, args.max_parallel)
+        weights = [s['weight'] for s in plan['shards']]
+        print(f"Planned {len(plan['shards'])} shards over {sum(len(s['files']) for s in plan['shards'])} files "
+              f"(weight min {min(weights, default=0)}, max {max(weights, default=0)})")
+        print(f"Array script: {script}")
+    elif args.command == 'submit':
+        task_ids = [int(t) for t in args.tasks.split(',')] if args.tasks else None
+        result = submit(args.work_dir, args.local, args.max_parallel, args.cpus, task_ids)
+        if args.local:
+            failed = sorted(t for t, code in result.items() if code != 0)
+            print(f"Ran {len(result)} tasks locally, {len(failed)} failed{': ' + str(failed) if failed else ''}")
+    elif args.command == 'run':
+        sys.exit(run_shard(args.work_dir, args.task_id)['returncode'])
+    else:
+        summary = merge_shards(args.work_dir, args.output_dir)
+        failed = summary[summary['returncode'].fillna(-1) != 0]
+        print(summary.to_string(index=False))
+        print(f"Merged {len(summary) - len(failed)}/{len(summary)} shards into {args.output_dir}")
+        if len(failed):
+            print(f"Failed or missing shards: {','.join(str(t) for t in failed['task_id'])}")
+
+
+if __name__ == "__main__":
+    main()
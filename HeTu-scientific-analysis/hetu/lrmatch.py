@@ -0,0 +1,218 @@
+"""
+Vectorized likelihood-ratio crossmatch with reliability estimates.
+
+Replaces the fixed-radius nearest neighbour of crossmatch_bdsf_*.py. For every
+candidate pair within the search radius
+
+    LR_ij = Q f(r_ij) / n_i,   f(r) = exp(-r^2 / 2 sigma^2) / (2 pi sigma^2),  sigma^2 = sigma_i^2 + sigma_j^2
+
+where n_i is the local background density of catalog-2 sources around source i,
+counted with a KD-tree in an annulus (search radius .. background radius) so crowded
+fields get a higher background. Reliabilities follow Sutherland & Saunders (1992):
+
+    R_ij = LR_ij / (sum_k LR_ik + 1 - Q)
+
+with Q, the fraction of catalog-1 sources that have a true counterpart, estimated from
+the sources without any candidate: 1 - Q = observed blanks / expected random blanks,
+where a source is blank by chance with probability exp(-n_i pi r_s^2).
+Candidate search and background counting run in parallel over declination shards
+(full RA range per shard, so no RA wrap handling is needed; one shard per executor
+worker unless --shards is given); LR and reliability are
+then evaluated in batch array operations over all pairs.
+
+Command line:
+    python -m hetu.lrmatch hetu.csv racs.csv --ra1 bbox_center_ra --dec1 bbox_center_dec \
+        --ra2 RA --dec2 Dec --err2 E_RA,E_DEC --err-unit deg --radius 20 -o matched_lr.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from hetu.executor import Executor, add_executor_arguments, executor_from_args
+from hetu.skygeom import arcsec_from_chord, chord_from_arcsec, radec_to_xyz
+
+DEFAULT_RADIUS_ARCSEC = 20.0
+DEFAULT_BG_RADIUS_ARCSEC = 300.0
+DEFAULT_SIGMA_ARCSEC = 2.0
+
+
+def _shard_candidates(ra1, dec1, ra2, dec2, radius_arcsec, bg_radius_arcsec):
+    """Candidate pairs and annulus background counts for one shard (local indices)"""
+    from scipy.spatial import cKDTree
+
+    empty = np.zeros(0, dtype=np.int64)
+    if len(ra1) == 0 or len(ra2) == 0:
+        return empty, empty, np.zeros(0), np.zeros(len(ra1), dtype=np.int64), np.zeros(len(ra1), dtype=np.int64)
+    xyz1, xyz2 = radec_to_xyz(ra1, dec1), radec_to_xyz(ra2, dec2)
+    tree = cKDTree(xyz2)
+    neighbours = tree.query_ball_point(xyz1, chord_from_arcsec(radius_arcsec))
+    n_cand = np.fromiter(map(len, neighbours), dtype=np.int64, count=len(neighbours))
+    i = np.repeat(np.arange(len(xyz1)), n_cand)
+    j = np.concatenate(neighbours).astype(np.int64) if n_cand.sum() else empty
+    sep = arcsec_from_chord(np.linalg.norm(xyz1[i] - xyz2[j], axis=1))
+    n_bg = tree.query_ball_point(xyz1, chord_from_arcsec(bg_radius_arcsec), return_length=True)
+    return i, j, sep, n_cand, np.asarray(n_bg, dtype=np.int64)
+
+
+def dec_shards(dec1, n_shards):
+    """Split catalog 1 into declination bands of roughly equal source count"""
+    order = np.argsort(dec1, kind='stable')
+    return [chunk for chunk in np.array_split(order, max(1, n_shards)) if len(chunk)]
+
+
+def find_candidates(ra1, dec1, ra2, dec2, radius_arcsec=DEFAULT_RADIUS_ARCSEC,
+                    bg_radius_arcsec=DEFAULT_BG_RADIUS_ARCSEC, n_shards=None, executor=None):
+    """All pairs within radius (global indices) plus per-source candidate and background counts
+
+    n_shards defaults to the number of workers of the executor.
+    """
+    executor = executor or Executor('processes')
+    n_shards = executor.workers if n_shards is None else n_shards
+    ra1, dec1 = np.asarray(ra1, np.float64), np.asarray(dec1, np.float64)
+    ra2, dec2 = np.asarray(ra2, np.float64), np.asarray(dec2, np.float64)
+    margin = max(radius_arcsec, bg_radius_arcsec) / 3600.0
+    shards, tasks = [], []
+    for rows1 in dec_shards(dec1, n_shards):
+        lo, hi = dec1[rows1].min() - margin, dec1[rows1].max() + margin
+        rows2 = np.flatnonzero((dec2 >= lo) & (dec2 <= hi))
+        shards.append((rows1, rows2))
+        tasks.append((ra1[rows1], dec1[rows1], ra2[rows2], dec2[rows2], radius_arcsec, bg_radius_arcsec))
+
+    results = list(executor.map(_shard_candidates, *zip(*tasks))) if tasks else []
+
+    n_cand = np.zeros(len(ra1), dtype=np.int64)
+    n_bg = np.zeros(len(ra1), dtype=np.int64)
+    pairs_i, pairs_j, seps = [], [], []
+    for (rows1, rows2), (i, j, sep, cand, bg) in zip(shards, results):
+        pairs_i.append(rows1[i])
+        pairs_j.append(rows2[j])
+        seps.append(sep)
+        n_cand[rows1] = cand
+        n_bg[rows1] = bg
+    if not pairs_i:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0), n_cand, n_bg
+    return np.concatenate(pairs_i), np.concatenate(pairs_j), np.concatenate(seps), n_cand, n_bg
+
+
+def background_density(n_cand, n_bg, radius_arcsec, bg_radius_arcsec):
+    """Local catalog-2 surface density (per arcsec^2) in the annulus around each source"""
+    annulus = np.pi * (bg_radius_arcsec ** 2 - radius_arcsec ** 2)
+    density = (n_bg - n_cand) / annulus
+    positive = density[density > 0]
+    floor = np.median(positive) if positive.size else 1.0 / annulus
+    return np.where(density > 0, density, floor)
+
+
+def estimate_q(n_cand, density, radius_arcsec):
+    """Fraction of sources with a true counterpart: 1 - observed blanks / expected random blanks"""
+    if len(n_cand) == 0:
+        return 1.0
+    random_blanks = np.exp(-density * np.pi * radius_arcsec ** 2).sum()
+    q = 1.0 - (n_cand == 0).sum() / random_blanks
+    return float(np.clip(q, 0.01, 1.0))
+
+
+def lr_match(ra1, dec1, ra2, dec2, sigma1=DEFAULT_SIGMA_ARCSEC, sigma2=DEFAULT_SIGMA_ARCSEC,
+             radius_arcsec=DEFAULT_RADIUS_ARCSEC, bg_radius_arcsec=DEFAULT_BG_RADIUS_ARCSEC,
+             q0=None, n_shards=None, executor=None):
+    """
+    Likelihood-ratio crossmatch of catalog 1 against catalog 2.
+
+    sigma1 / sigma2 are positional errors in arcsec (scalars or per-source arrays).
+    Returns (pairs, q): one row per candidate pair with idx1, idx2, sep_arcsec, lr,
+    reliability and is_best (highest LR for its catalog-1 source).
+    """
+    i, j, sep, n_cand, n_bg = find_candidates(ra1, dec1, ra2, dec2, radius_arcsec,
+                                              bg_radius_arcsec, n_shards, executor)
+    density = background_density(n_cand, n_bg, radius_arcsec, bg_radius_arcsec)
+    q = estimate_q(n_cand, density, radius_arcsec) if q0 is None else float(q0)
+
+    sigma1 = np.broadcast_to(np.asarray(sigma1, np.float64), (len(n_cand),))
+    sigma2 = np.broadcast_to(np.asarray(sigma2, np.float64), (len(np.asarray(ra2)),))
+    var = sigma1[i] ** 2 + sigma2[j] ** 2
+    f = np.exp(-sep ** 2 / (2 * var)) / (2 * np.pi * var)
+    lr = q * f / density[i]
+    lr_sum = np.bincount(i, weights=lr, minlength=len(n_cand))
+    reliability = lr / (lr_sum[i] + 1 - q)
+
+    pairs = pd.DataFrame({'idx1': i, 'idx2': j, 'sep_arcsec': sep, 'lr': lr, 'reliability': reliability})
+    pairs = pairs.sort_values(['idx1', 'lr'], ascending=[True, False], kind='stable').reset_index(drop=True)
+    pairs['is_best'] = ~pairs['idx1'].duplicated()
+    return pairs, q
+
+
+def sigma_from_columns(df, columns, unit, default):
+    """Per-source positional sigma in arcsec from RA/Dec error columns, or a constant"""
+    if not columns:
+        return default
+    scale = 3600.0 if unit == 'deg' else 1.0
+    errors = [df[c].to_numpy(np.float64) * scale for c in columns.split(',')]
+    sigma = np.sqrt(np.mean(np.square(errors), axis=0))
+    return np.where(np.isfinite(sigma) & (sigma > 0), sigma, default)
+
+
+def summarize(pairs, q, n1, min_reliability=0.0):
+    """Counts and expected false matches among accepted best matches"""
+    best = pairs[pairs['is_best'] & (pairs['reliability'] >= min_reliability)]
+    return {
+        'n_sources': n1,
+        'n_candidates': len(pairs),
+        'n_matched': len(best),
+        'q': q,
+        'expected_false': float((1 - best['reliability']).sum()),
+        'false_match_rate': float((1 - best['reliability']).mean()) if len(best) else np.nan,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Likelihood-ratio crossmatch with reliability estimates')
+    parser.add_argument('catalog1', help='Primary catalog CSV (every source gets its candidates)')
+    parser.add_argument('catalog2', help='Counterpart catalog CSV')
+    parser.add_argument('--ra1', default='RA')
+    parser.add_argument('--dec1', default='DEC')
+    parser.add_argument('--ra2', default='RA')
+    parser.add_argument('--dec2', default='Dec')
+    parser.add_argument('--err1', default=None, help='Comma separated RA,Dec error columns of catalog 1')
+    parser.add_argument('--err2', default=None, help='Comma separated RA,Dec error columns of catalog 2')
+    parser.add_argument('--err-unit', choices=['deg', 'arcsec'], default='deg', help='Unit of the error columns')
+    parser.add_argument('--sigma', type=float, default=DEFAULT_SIGMA_ARCSEC,
+                        help='Positional sigma in arcsec when no error columns are given (default 2)')
+    parser.add_argument('--radius', type=float, default=DEFAULT_RADIUS_ARCSEC, help='Search radius in arcsec')
+    parser.add_argument('--bg-radius', type=float, default=DEFAULT_BG_RADIUS_ARCSEC,
+                        help='Outer radius of the background annulus in arcsec')
+    parser.add_argument('--q0', type=float, default=None, help='Fix Q instead of estimating it')
+    parser.add_argument('--min-reliability', type=float, default=0.0, help='Reliability cut for the best matches')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='Number of declination shards (default: one per worker)')
+    parser.add_argument('--all-pairs', action='store_true', help='Write every candidate pair, not only best matches')
+    parser.add_argument('-o', '--output', default='matched_lr.csv', help='Output CSV')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+
+    df1 = pd.read_csv(args.catalog1, comment='#')
+    df2 = pd.read_csv(args.catalog2, comment='#')
+    df1.columns = df1.columns.str.strip()
+    df2.columns = df2.columns.str.strip()
+
+    pairs, q = lr_match(
+        df1[args.ra1], df1[args.dec1], df2[args.ra2], df2[args.dec2],
+        sigma_from_columns(df1, args.err1, args.err_unit, args.sigma),
+        sigma_from_columns(df2, args.err2, args.err_unit, args.sigma),
+        args.radius, args.bg_radius, args.q0, args.shards, executor_from_args(args))
+    summary = summarize(pairs, q, len(df1), args.min_reliability)
+
+    if not args.all_pairs:
+        pairs = pairs[pairs['is_best'] & (pairs['reliability'] >= args.min_reliability)]
+    result = df1.iloc[pairs['idx1']].reset_index(drop=True)
+    result = result.join(df2.add_prefix('df2_').iloc[pairs['idx2']].reset_index(drop=True))
+    for column in ('sep_arcsec', 'lr', 'reliability', 'is_best'):
+        result[column] = pairs[column].to_numpy()
+    result.to_csv(args.output, index=False)
+    print(f"Saved {len(result)} rows to {args.output}")
+    for key, value in summary.items():
+        print(f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
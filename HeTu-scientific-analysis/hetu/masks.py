@@ -0,0 +1,215 @@
+"""
+Mask-IoU suppression of duplicate detections, computed directly on the RLE masks.
+
+The bbox dedup (only_label2.is_overlapping) treats any bbox contact as a duplicate, which
+merges a compact source lying inside the large bbox of an FRII into the FRII. Here two
+detections of one cutout are duplicates only when their masks overlap enough:
+  * candidate pairs come from the bbox overlap test, vectorized over the cutout,
+  * masks (COCO RLE: compressed 'counts' string, or the uncompressed list) are never
+    decoded to images: the run lengths become foreground intervals of the column-major
+    pixel index, and the intersection of two masks is the overlap of their interval
+    lists (binary searches, O(runs log runs)),
+  * greedy suppression by descending score drops a detection whose mask IoU with an
+    already kept detection reaches the threshold.
+Only masks that take part in a candidate pair are decoded.
+
+Command line (dedup packed shards into the only_label2.py CSV layout, one CSV per SBID):
+    python -m hetu.masks shards/output_resnet /home/ydai240628/analysis_hetu/file/only_label/output_resnet_maskiou \
+        --iou 0.5
+"""
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+
+from hetu.bbox import BBOX_COLUMNS
+from hetu.executor import add_executor_arguments, executor_from_args
+from hetu.shards import ShardReader, list_shards
+
+IOU_THRESHOLD = 0.5
+
+
+def rle_counts(counts):
+    """Run lengths (alternating background/foreground, column-major) of a COCO RLE 'counts'"""
+    if not isinstance(counts, str):
+        return np.asarray(counts, dtype=np.int64)
+    # A compressed string may start with '[' but never ends with ']' (0x20 is set in it)
+    if counts.startswith('[') and counts.endswith(']'):
+        return np.asarray(json.loads(counts), dtype=np.int64)
+    c = np.frombuffer(counts.encode('ascii'), dtype=np.uint8).astype(np.int64) - 48
+    if len(c) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Each value is a little-endian group of 5-bit digits; 0x20 marks "more digits follow"
+    last = (c & 0x20) == 0
+    group = np.concatenate([[0], np.cumsum(last)[:-1]])
+    starts = np.flatnonzero(np.concatenate([[True], last[:-1]]))
+    digit = np.arange(len(c)) - starts[group]
+    values = np.zeros(last.sum(), dtype=np.int64)
+    np.add.at(values, group, (c & 0x1f) << (5 * digit))
+    # Sign bit of the final digit
+    end_digit = digit[last] + 1
+    negative = (c[last] & 0x10) != 0
+    values[negative] -= np.left_shift(1, 5 * end_digit[negative])
+    # From the fourth run on, values are deltas to the run two places earlier
+    out = values.copy()
+    out[3::2] = np.cumsum(values[1::2])[1:]
+    out[4::2] = np.cumsum(values[2::2])[1:]
+    return out
+
+
+def rle_string(runs):
+    """Compressed COCO RLE string of run lengths (inverse of rle_counts)"""
+    chars = []
+    runs = [int(x) for x in runs]
+    for i, x in enumerate(runs):
+        if i > 2:
+            x -= runs[i - 2]
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return ''.join(chars)
+
+
+def rle_encode(mask):
+    """COCO RLE {'size', 'counts'} of a 2D boolean mask"""
+    flat = np.asarray(mask, dtype=bool).ravel(order='F')
+    edges = np.flatnonzero(np.diff(flat.astype(np.int8))) + 1
+    bounds = np.concatenate([[0], edges, [len(flat)]])
+    runs = np.diff(bounds)
+    if len(flat) and flat[0]:
+        runs = np.concatenate([[0], runs])
+    return {'size': list(np.shape(mask)), 'counts': rle_string(runs)}
+
+
+class RleMask:
+    """Foreground intervals [start, stop) of a mask in column-major pixel order"""
+
+    def __init__(self, size, counts):
+        self.size = tuple(int(v) for v in size)
+        runs = rle_counts(counts)
+        edges = np.concatenate([[0], np.cumsum(runs)])
+        starts, stops = edges[1:len(runs):2], edges[2:len(runs) + 1:2]
+        keep = stops > starts
+        self.starts, self.stops = starts[keep], stops[keep]
+        self.lengths = self.stops - self.starts
+        self.cumulative = np.concatenate([[0], np.cumsum(self.lengths)])
+
+    @classmethod
+    def from_dict(cls, mask):
+        return cls(mask.get('size', (0, 0)), mask.get('counts', ''))
+
+    @property
+    def area(self):
+        return int(self.cumulative[-1])
+
+    def covered(self, x):
+        """Foreground pixels with flat index < x, for an array of positions"""
+        k = np.searchsorted(self.starts, x, side='right') - 1
+        inside = np.minimum(x - self.starts[np.maximum(k, 0)], self.lengths[np.maximum(k, 0)])
+        return np.where(k >= 0, self.cumulative[np.maximum(k, 0)] + inside, 0)
+
+    def intersection(self, other):
+        if self.size != other.size:
+            raise ValueError(f"mask sizes differ: {self.size} vs {other.size}")
+        if len(self.starts) > len(other.starts):
+            self, other = other, self
+        if len(self.starts) == 0:
+            return 0
+        return int((other.covered(self.stops) - other.covered(self.starts)).sum())
+
+    def iou(self, other):
+        inter = self.intersection(other)
+        union = self.area + other.area - inter
+        return inter / union if union else 0.0
+
+
+def bbox_overlap_pairs(bboxes):
+    """(i, j) index pairs, i < j, of boxes that overlap or touch (the only_label2 test)
+
+    Only the first four values [x1, y1, x2, y2] of every box are used: the JSON output of
+    the detectors appends the score to each bbox.
+    """
+    b = np.asarray([list(box)[:4] for box in bboxes], dtype=np.float64).reshape(-1, 4)
+    x1, y1, x2, y2 = (b[:, k] for k in range(4))
+    overlap = ~((x2[:, None] < x1[None, :]) | (x2[None, :] < x1[:, None])
+                | (y2[:, None] < y1[None, :]) | (y2[None, :] < y1[:, None]))
+    i, j = np.nonzero(np.triu(overlap, k=1))
+    return i, j
+
+
+def suppress(scores, bboxes, masks, iou_threshold=IOU_THRESHOLD):
+    """Indices of the detections kept by greedy mask-IoU suppression, by descending score"""
+    scores = np.asarray(scores, dtype=np.float64)
+    order = np.argsort(-scores, kind='stable')
+    i, j = bbox_overlap_pairs(bboxes)
+    neighbours = {}
+    for a, b in zip(i.tolist(), j.tolist()):
+        neighbours.setdefault(a, []).append(b)
+        neighbours.setdefault(b, []).append(a)
+    decoded = {}
+
+    def mask(k):
+        if k not in decoded:
+            decoded[k] = RleMask.from_dict(masks[k])
+        return decoded[k]
+
+    kept, is_kept = [], np.zeros(len(scores), dtype=bool)
+    for k in order.tolist():
+        duplicate = any(is_kept[n] and mask(k).iou(mask(n)) >= iou_threshold for n in neighbours.get(k, ()))
+        if not duplicate:
+            kept.append(k)
+            is_kept[k] = True
+    return kept
+
+
+def suppress_shard(shard_path, out_dir, iou_threshold=IOU_THRESHOLD):
+    """Mask-IoU dedup of every cutout of one shard into <SBID>.csv; returns (cutouts, in, out)"""
+    fieldnames = ['component_id', 'label', 'score'] + BBOX_COLUMNS + ['counts']
+    n_in = n_out = 0
+    with ShardReader(shard_path) as reader:
+        out_path = os.path.join(out_dir, f"{reader.meta['sbid']}.csv")
+        with open(out_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            for name, cutout in reader.iter_cutouts():
+                keep = suppress(cutout['scores'], cutout['bboxes'], cutout['masks'], iou_threshold)
+                n_in += len(cutout['scores'])
+                n_out += len(keep)
+                for k in keep:
+                    row = {'component_id': name, 'label': int(cutout['labels'][k]),
+                           'score': float(cutout['scores'][k]), 'counts': cutout['masks'][k]['counts']}
+                    row.update(zip(BBOX_COLUMNS, np.asarray(cutout['bboxes'][k][:4], dtype=np.float32)))
+                    writer.writerow(row)
+        return reader.n_cutouts, n_in, n_out
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mask-IoU dedup of packed detection shards')
+    parser.add_argument('shard_dir', help='Directory of <SBID>.hshard files (python -m hetu.shards pack)')
+    parser.add_argument('output_dir', help='Directory receiving one CSV per SBID (only_label2.py layout)')
+    parser.add_argument('--iou', type=float, default=IOU_THRESHOLD, help='Mask IoU at which a detection is a duplicate')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    shards = list_shards(args.shard_dir)
+    print(f"Deduplicating {len(shards)} shards with mask IoU >= {args.iou}")
+    n = len(shards)
+    for path, result, error in executor_from_args(args).run(suppress_shard, shards, [args.output_dir] * n,
+                                                            [args.iou] * n):
+        if error is not None:
+            print(f"Error processing {os.path.basename(path)}: {error}")
+            continue
+        n_cutouts, n_in, n_out = result
+        print(f"  {os.path.basename(path)}: {n_cutouts} cutouts, kept {n_out}/{n_in} detections")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+All-sky master catalog: every per-SBID output merged into one HEALPix-sorted file.
+
+After bbox_overlap_removal_all.py there is one processed_wcs_<SBID>.csv per field, and
+every consumer used to glob and concatenate them again. This stage streams them once
+into a single array file (hetu.shards layout) sorted by NESTED HEALPix index, so that
+neighbouring sources are neighbouring rows for crossmatches and map building:
+  * provenance columns: SBID and source_file (dictionary-encoded) and source_row, the
+    row number in the source CSV,
+  * ``label`` (and any ``--category`` column) is dictionary-encoded as small integer
+    codes plus a dictionary of values,
+  * ``healpix`` holds the order-29 NESTED index used as the sort key; coarser pixels are
+    ``healpix >> 2 * (29 - order)``.
+
+The sort is external, with memory bounded by ``--chunk-rows``:
+  1. runs:  every CSV is read in chunks; each chunk is sorted and spilled to a run file
+            (in parallel on the executor),
+  2. merge: runs are k-way merged block by block (at most ``--fan-in`` runs at a time,
+            in several passes if needed); each block holds at most chunk-rows keys and
+            is streamed to the output with ``hetu.shards.ArrayFileWriter``.
+Rows with equal keys keep SBID order within a merge block, so the output is deterministic.
+
+The result carries the pixel -> row-range table of hetu.skyindex, so it opens directly
+with ``SkyIndex`` for cone and box searches; ``read_master`` loads columns as a DataFrame.
+
+Command line:
+    python -m hetu.master /home/ydai240628/analysis_hetu/file/bbox_overlap_removal/output_internimage_0722 \
+        hetu_master.hidx --exclude 20147,20161 --chunk-rows 2000000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from hetu.catalog import Catalog, resolve_column, sbid_from_path
+from hetu.executor import Executor, add_executor_arguments, executor_from_args
+from hetu.shards import ArrayFile, ArrayFileWriter, concat_ranges, concat_strings, write_shard
+from hetu.skyindex import DEFAULT_ORDER, SkyIndex
+
+KEY_ORDER = 29
+CHUNK_ROWS = 1_000_000
+FAN_IN = 64
+CATEGORY_COLUMNS = ('label',)
+INVALID_KEY = np.iinfo(np.uint64).max
+
+
+def healpix_keys(ra, dec):
+    """Order-29 NESTED HEALPix index of every position; positions that are not finite sort last"""
+    import healpy as hp
+
+    ra, dec = np.asarray(ra, np.float64), np.asarray(dec, np.float64)
+    keys = np.full(len(ra), INVALID_KEY, dtype=np.uint64)
+    ok = np.isfinite(ra) & np.isfinite(dec) & (np.abs(dec) <= 90)
+    keys[ok] = hp.ang2pix(2 ** KEY_ORDER, ra[ok], dec[ok], nest=True, lonlat=True)
+    return keys
+
+
+def write_runs(path, source, run_prefix, categories=CATEGORY_COLUMNS, chunk_rows=CHUNK_ROWS):
+    """Sort one catalog CSV chunk by chunk into run files; returns the run paths"""
+    runs, start = [], 0
+    for k, df in enumerate(pd.read_csv(path, chunksize=chunk_rows)):
+        if df.empty:
+            # An empty file reads every column as text; it must not decide the schema
+            continue
+        ra_column, dec_column = resolve_column('ra', df.columns), resolve_column('dec', df.columns)
+        if ra_column is None or dec_column is None:
+            raise ValueError(f"{os.path.basename(path)} has no RA/Dec columns")
+        keys = healpix_keys(df[ra_column], df[dec_column])
+        order = np.argsort(keys, kind='stable')
+        df = df.iloc[order]
+        arrays = {
+            'key': keys[order],
+            'source': np.full(len(df), source, dtype=np.uint32),
+            'source_row': (start + order).astype(np.int64),
+        }
+        columns, distinct = [], {}
+        for name in df.columns:
+            values = df[name]
+            if pd.api.types.is_bool_dtype(values) or pd.api.types.is_numeric_dtype(values):
+                arrays[f'col.{name}'] = values.to_numpy()
+                columns.append([name, 'numeric'])
+                if name in categories:
+                    distinct[name] = np.unique(values.dropna().to_numpy()).tolist()
+            else:
+                arrays[f'str.{name}'], arrays[f'str.{name}.offsets'] = concat_strings(values.fillna('').astype(str))
+                columns.append([name, 'string'])
+        run_path = f"{run_prefix}.{k}.run"
+        write_shard(run_path, arrays, {'columns': columns, 'distinct': distinct, 'n_rows': len(df),
+                                       'ra_column': ra_column, 'dec_column': dec_column})
+        runs.append(run_path)
+        start += len(df)
+    return runs
+
+
+def merge_schema(files, categories=()):
+    """Column name -> (kind, numeric dtype) covering every run; missing values become NaN / ''"""
+    kinds, dtypes, present = {}, {}, {}
+    for f in files:
+        for name, kind in f.meta['columns']:
+            present[name] = present.get(name, 0) + 1
+            if kind == 'string' or kinds.get(name) == 'string':
+                kinds[name] = 'string'
+            else:
+                kinds[name] = 'numeric'
+                dtypes.setdefault(name, []).append(f.arrays[f'col.{name}'].dtype)
+    schema = {}
+    for name, kind in kinds.items():
+        if kind == 'string':
+            schema[name] = ('string', None)
+            continue
+        dtype = np.result_type(*dtypes[name])
+        if present[name] < len(files):
+            dtype = np.result_type(dtype, np.float64)
+        schema[name] = ('category' if name in categories else 'numeric', dtype)
+    return schema
+
+
+def merge_blocks(keys, block_rows=CHUNK_ROWS):
+    """Yield (segments, order) blocks of a k-way merge of sorted key arrays
+
+    ``segments`` lists (run, start, stop) slices taken from every run; ``order`` sorts the
+    concatenated slices. Each block holds at most about ``block_rows`` keys.
+    """
+    pos = [0] * len(keys)
+    window = max(256, block_rows // max(len(keys), 1))
+    while True:
+        active = [r for r in range(len(keys)) if pos[r] < len(keys[r])]
+        if not active:
+            return
+        # Everything up to the smallest last key of a partial window can be emitted
+        cutoff = None
+        for r in active:
+            end = pos[r] + window
+            if end < len(keys[r]):
+                last = keys[r][end - 1]
+                cutoff = last if cutoff is None else min(cutoff, last)
+        segments = []
+        for r in active:
+            stop = min(pos[r] + window, len(keys[r]))
+            if cutoff is not None:
+                stop = pos[r] + int(np.searchsorted(keys[r][pos[r]:stop], cutoff, side='right'))
+            if stop > pos[r]:
+                segments.append((r, pos[r], stop))
+                pos[r] = stop
+        block = np.concatenate([keys[r][a:b] for r, a, b in segments])
+        yield segments, np.argsort(block, kind='stable')
+
+
+def code_dtype(n_values):
+    """Smallest signed integer type for dictionary codes (-1 marks a missing value)"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_values <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _gather_numeric(files, segments, order, name, dtype):
+    parts = []
+    for r, a, b in segments:
+        values = files[r].arrays.get(f'col.{name}')
+        parts.append(np.full(b - a, np.nan, dtype=dtype) if values is None else values[a:b].astype(dtype))
+    return np.concatenate(parts)[order]
+
+
+def _gather_strings(files, segments, order, name):
+    """(bytes, lengths) of a string column for one block, in merged order"""
+    data, lengths = [], []
+    for r, a, b in segments:
+        arrays = files[r].arrays
+        if f'str.{name}' in arrays:
+            offsets = arrays[f'str.{name}.offsets']
+            data.append(arrays[f'str.{name}'][offsets[a]:offsets[b]])
+            lengths.append(np.diff(offsets[a:b + 1]).astype(np.int64))
+        elif f'col.{name}' in arrays:
+            # Numeric in this run (e.g. an all-empty column), text elsewhere
+            values = pd.Series(arrays[f'col.{name}'][a:b])
+            text, offsets = concat_strings(values.astype(str).where(values.notna(), ''))
+            data.append(text)
+            lengths.append(np.diff(offsets).astype(np.int64))
+        else:
+            lengths.append(np.zeros(b - a, dtype=np.int64))
+    lengths = np.concatenate(lengths)
+    buffer = np.concatenate(data) if data else np.zeros(0, dtype=np.uint8)
+    starts = np.cumsum(lengths) - lengths
+    return buffer[concat_ranges(starts[order], starts[order] + lengths[order])], lengths[order]
+
+
+def _append_strings(writer, name, data, lengths, base):
+    writer.append(name, data)
+    writer.append(f'{name}.offsets', base + np.cumsum(lengths, dtype=np.uint64))
+    return base + np.uint64(lengths.sum())
+
+
+def merge_runs(run_paths, out_path, categories=CATEGORY_COLUMNS, block_rows=CHUNK_ROWS, final=None):
+    """k-way merge of run files into a larger run, or into the master catalog when ``final`` is given
+
+    ``final`` holds 'sources' (file names), 'sbids' (SBID per source), 'order' and 'meta'.
+    """
+    files = [ArrayFile(p) for p in run_paths]
+    writer = ArrayFileWriter(out_path)
+    try:
+        schema = merge_schema(files, categories if final else ())
+        distinct = {}
+        for f in files:
+            for name, values in f.meta.get('distinct', {}).items():
+                distinct.setdefault(name, set()).update(values)
+        dictionaries = {name: np.asarray(sorted(distinct.get(name, ())), dtype=dtype)
+                        for name, (kind, dtype) in schema.items() if kind == 'category'}
+        # Declare every array up front (fixes its dtype, and empty inputs still get it)
+        if final:
+            sbid_values = sorted(set(final['sbids']))
+            sbid_codes = np.searchsorted(sbid_values, final['sbids']).astype(code_dtype(len(sbid_values)))
+            last_pixel, shift = None, np.uint64(2 * (KEY_ORDER - final['order']))
+            declared = {'pixels': np.uint64, 'pixel_rows': np.uint64, 'cat.SBID': sbid_codes.dtype,
+                        'cat.source_file': code_dtype(len(final['sources'])),
+                        'col.source_row': np.int64, 'col.healpix': np.uint64}
+        else:
+            declared = {'key': np.uint64, 'source': np.uint32, 'source_row': np.int64}
+        for name, (kind, dtype) in schema.items():
+            if kind == 'string':
+                declared[f'str.{name}'] = np.uint8
+                declared[f'str.{name}.offsets'] = np.uint64
+            elif kind == 'category':
+                declared[f'cat.{name}'] = code_dtype(len(dictionaries[name]))
+            else:
+                declared[f'col.{name}'] = dtype
+        for name, dtype in declared.items():
+            writer.append(name, np.zeros(1 if name.endswith('.offsets') else 0, dtype=dtype))
+        string_base = {name: np.uint64(0) for name, (kind, _) in schema.items() if kind == 'string'}
+        n_rows = 0
+        keys = [f.arrays['key'] for f in files]
+        for segments, order in merge_blocks(keys, block_rows):
+            block_keys = np.concatenate([keys[r][a:b] for r, a, b in segments])[order]
+            sources = np.concatenate([files[r].arrays['source'][a:b] for r, a, b in segments])[order]
+            source_rows = np.concatenate([files[r].arrays['source_row'][a:b] for r, a, b in segments])[order]
+            if final:
+                pixels = block_keys >> shift
+                uniq, first = np.unique(pixels, return_index=True)
+                if last_pixel is not None and len(uniq) and uniq[0] == last_pixel:
+                    uniq, first = uniq[1:], first[1:]
+                writer.append('pixels', uniq)
+                writer.append('pixel_rows', (first + n_rows).astype(np.uint64))
+                last_pixel = pixels[-1]
+                writer.append('cat.SBID', sbid_codes[sources])
+                writer.append('cat.source_file', sources)
+                writer.append('col.source_row', source_rows)
+                writer.append('col.healpix', block_keys)
+            else:
+                writer.append('key', block_keys)
+                writer.append('source', sources)
+                writer.append('source_row', source_rows)
+            for name, (kind, dtype) in schema.items():
+                if kind == 'string':
+                    data, lengths = _gather_strings(files, segments, order, name)
+                    string_base[name] = _append_strings(writer, f'str.{name}', data, lengths, string_base[name])
+                    continue
+                values = _gather_numeric(files, segments, order, name, dtype)
+                if kind == 'category':
+                    codes = np.searchsorted(dictionaries[name], values)
+                    codes[pd.isna(values)] = -1
+                    writer.append(f'cat.{name}', codes)
+                else:
+                    writer.append(f'col.{name}', values)
+            n_rows += len(order)
+
+        if not final:
+            columns = [[name, kind] for name, (kind, _) in schema.items()]
+            writer.close({'columns': columns, 'n_rows': n_rows, 'ra_column': files[0].meta['ra_column'],
+                          'dec_column': files[0].meta['dec_column'],
+                          'distinct': {k: sorted(v) for k, v in distinct.items()}})
+            return n_rows
+
+        writer.append('pixel_rows', np.asarray([n_rows], dtype=np.uint64))
+        for name, values in dictionaries.items():
+            writer.append(f'dict.{name}', values)
+        for name, values in (('SBID', sbid_values), ('source_file', final['sources'])):
+            data, offsets = concat_strings(values)
+            writer.append(f'dict.{name}', data)
+            writer.append(f'dict.{name}.offsets', offsets)
+        columns = [['SBID', 'category'], ['source_file', 'category'], ['source_row', 'numeric'],
+                   ['healpix', 'numeric']] + [[name, kind] for name, (kind, _) in schema.items()]
+        ra_column = files[0].meta['ra_column'] if files else 'ra'
+        dec_column = files[0].meta['dec_column'] if files else 'dec'
+        writer.close({**final.get('meta', {}), 'order': final['order'], 'key_order': KEY_ORDER,
+                      'n_rows': n_rows, 'columns': columns, 'ra_column': ra_column, 'dec_column': dec_column})
+        return n_rows
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        for f in files:
+            f.close()
+
+
+def build_master(paths, out_path, order=DEFAULT_ORDER, categories=CATEGORY_COLUMNS, chunk_rows=CHUNK_ROWS,
+                 fan_in=FAN_IN, executor=None, tmp_dir=None, meta=None):
+    """External merge sort of catalog CSVs into one HEALPix-sorted master catalog; returns the row count"""
+    executor = executor or Executor()
+    paths = list(paths)
+    work = tempfile.mkdtemp(prefix='hetu_master_', dir=tmp_dir or os.path.dirname(os.path.abspath(out_path)))
+    try:
+        n = len(paths)
+        prefixes = [os.path.join(work, f'src{k}') for k in range(n)]
+        runs = []
+        for path, result, error in executor.run(write_runs, paths, range(n), prefixes,
+                                                [tuple(categories)] * n, [chunk_rows] * n):
+            if error is not None:
+                raise RuntimeError(f"cannot read {os.path.basename(path)}: {error}")
+            runs.extend(result)
+        print(f"Sorted {n} files into {len(runs)} runs")
+
+        level = 0
+        while len(runs) > fan_in:
+            groups = [runs[k:k + fan_in] for k in range(0, len(runs), fan_in)]
+            outputs = [os.path.join(work, f'merge{level}.{k}.run') for k in range(len(groups))]
+            m = len(groups)
+            for out, _, error in executor.run(merge_runs, groups, outputs, [()] * m, [chunk_rows] * m, keys=outputs):
+                if error is not None:
+                    raise RuntimeError(f"merge pass {level} failed: {error}")
+            for run in runs:
+                os.remove(run)
+            print(f"Merge pass {level}: {len(runs)} runs -> {len(outputs)}")
+            runs, level = outputs, level + 1
+
+        final = {'sources': [os.path.basename(p) for p in paths],
+                 'sbids': [sbid_from_path(p) or '' for p in paths], 'order': order, 'meta': meta or {}}
+        return merge_runs(runs, out_path, tuple(categories), chunk_rows, final)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def read_master(path, columns=None):
+    """Whole columns of a master catalog as a DataFrame (dictionary columns become categoricals)"""
+    with SkyIndex(path) as index:
+        return index.rows(np.arange(len(index)), columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge the per-SBID catalogs into one HEALPix-sorted master catalog')
+    parser.add_argument('directory', help='Directory of per-SBID catalog CSVs (bbox_overlap_removal output)')
+    parser.add_argument('output', help='Master catalog file (*.hidx, opens with hetu.skyindex)')
+    parser.add_argument('--pattern', default='*.csv', help='Glob pattern of the catalog files')
+    parser.add_argument('--exclude', default='', help='Comma separated SBIDs to exclude')
+    parser.add_argument('--order', type=int, default=DEFAULT_ORDER, help='HEALPix order of the pixel lookup table')
+    parser.add_argument('--category', action='append', default=None,
+                        help='Dictionary-encoded column (repeatable, default: label)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='Rows held in memory per run / merge block')
+    parser.add_argument('--fan-in', type=int, default=FAN_IN, help='Runs merged at a time')
+    parser.add_argument('--tmp-dir', default=None, help='Directory for the sorted runs (default: next to the output)')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+
+    start = time.time()
+    exclude = [s.strip() for s in args.exclude.split(',') if s.strip()]
+    paths = Catalog(args.directory, args.pattern, exclude_sbids=exclude).files()
+    if not paths:
+        print(f"Warning: No catalog files found in '{args.directory}'")
+        return
+    print(f"Merging {len(paths)} catalog files from {args.directory}")
+    n_rows = build_master(paths, args.output, args.order, args.category or CATEGORY_COLUMNS, args.chunk_rows,
+                          args.fan_in, executor_from_args(args), args.tmp_dir, {'source': args.directory})
+    print(f"Saved {n_rows} rows to {args.output} in {time.time() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""
+HEALPix multi-order coverage (MOC) footprints of the survey fields.
+
+Field extents used to live in hand-merged ra_min/ra_max/dec_min/dec_max columns
+(plot_count_final_0.5.csv), with RA-wrap and polar rows checked by hand. Here the
+footprint of every field is derived from its FITS header: the HEALPix NESTED pixels whose
+centres project inside the NAXIS1 x NAXIS2 image through the celestial WCS (candidates
+from a query_disc around the image, one vectorized world2pix). A coverage is kept as
+sorted, disjoint [start, stop) ranges of order-29 NESTED indices, the range form of a
+MOC: a pixel of order k is the range [p << 2(29-k), (p + 1) << 2(29-k)), so coverages
+built at different orders combine exactly and wrap/poles need no special cases.
+
+Union, intersection and difference are merges of the range boundaries; containment of
+positions is one binary search per position. All field footprints are stored in one
+file of the hetu.shards layout, with an elementary-segment table (every interval of the
+sky between consecutive range boundaries, and the fields covering it) that answers
+"which fields cover this position" and field overlaps as lookups instead of scans.
+
+    from hetu.moc import FootprintSet
+
+    with FootprintSet('footprints.hmoc') as fields:
+        print(fields.area_deg2('20147'))
+        rows, sbids = fields.fields_at(ra, dec)
+        overlap = fields.moc('20147') & fields.moc('20149')
+
+Command line:
+    python -m hetu.moc build /groups/hetu_ai/home/share/racs-mid-images footprints.hmoc --order 11
+    python -m hetu.moc info footprints.hmoc
+    python -m hetu.moc lookup footprints.hmoc 301.9 -64.9
+    python -m hetu.moc overlaps footprints.hmoc -o field_overlaps.csv
+"""
+import argparse
+import glob
+import os
+
+import healpy as hp
+import numpy as np
+import pandas as pd
+
+from hetu.executor import add_executor_arguments, executor_from_args
+from hetu.shards import ArrayFile, concat_ranges, concat_strings, write_shard
+from hetu.skygeom import angular_distance
+
+MAX_ORDER = 29
+DEFAULT_ORDER = 11
+MOC_SUFFIX = '.hmoc'
+FULL_SKY_DEG2 = 4 * np.pi * np.degrees(1.0) ** 2
+
+
+def _shift(order):
+    return 2 * (MAX_ORDER - order)
+
+
+def normalize_ranges(ranges):
+    """Sorted, disjoint, non-adjacent (R, 2) int64 ranges covering the same indices"""
+    ranges = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+    ranges = ranges[ranges[:, 1] > ranges[:, 0]]
+    if len(ranges) == 0:
+        return ranges
+    ranges = ranges[np.argsort(ranges[:, 0], kind='stable')]
+    reach = np.maximum.accumulate(ranges[:, 1])
+    # A new range starts wherever the start lies beyond everything covered so far
+    new = np.concatenate([[True], ranges[1:, 0] > reach[:-1]])
+    first = np.flatnonzero(new)
+    last = np.concatenate([first[1:], [len(ranges)]]) - 1
+    return np.stack([ranges[first, 0], reach[last]], axis=1)
+
+
+def _inside(ranges, x):
+    """Whether each index x lies in the (normalized) ranges"""
+    k = np.searchsorted(ranges[:, 0], x, side='right') - 1
+    return (k >= 0) & (x < ranges[np.maximum(k, 0), 1]) if len(ranges) else np.zeros(np.shape(x), dtype=bool)
+
+
+def _combine(a, b, op):
+    """Ranges of a boolean combination of two range sets, evaluated on elementary segments"""
+    bounds = np.unique(np.concatenate([a.ravel(), b.ravel()]))
+    if len(bounds) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    starts, stops = bounds[:-1], bounds[1:]
+    keep = op(_inside(a, starts), _inside(b, starts))
+    return normalize_ranges(np.stack([starts[keep], stops[keep]], axis=1))
+
+
+class Moc:
+    """Sky coverage as sorted disjoint ranges of order-29 NESTED HEALPix indices"""
+
+    def __init__(self, ranges=()):
+        self.ranges = normalize_ranges(ranges)
+
+    @classmethod
+    def from_pixels(cls, pixels, order):
+        """Coverage of a set of NESTED pixels of one order"""
+        pixels = np.asarray(pixels, dtype=np.int64)
+        shift = _shift(order)
+        return cls(np.stack([pixels << shift, (pixels + 1) << shift], axis=1))
+
+    @classmethod
+    def from_uniq(cls, uniq):
+        """Coverage of NUNIQ cells (4 * 4**order + pixel), the IVOA MOC serialization"""
+        uniq = np.asarray(uniq, dtype=np.int64)
+        order = (np.log2(uniq).astype(np.int64) // 2) - 1
+        # Guard against float rounding of log2 next to powers of two
+        order -= uniq < (np.int64(4) << (2 * order))
+        order += uniq >= (np.int64(16) << (2 * order))
+        pixels = uniq - 4 * (np.int64(1) << (2 * order))
+        shift = 2 * (MAX_ORDER - order)
+        return cls(np.stack([pixels << shift, (pixels + 1) << shift], axis=1))
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __bool__(self):
+        return len(self.ranges) > 0
+
+    def __eq__(self, other):
+        return isinstance(other, Moc) and np.array_equal(self.ranges, other.ranges)
+
+    def __repr__(self):
+        return f"Moc({len(self.ranges)} ranges, {self.area_deg2:.3f} deg2)"
+
+    def union(self, other):
+        return Moc(np.concatenate([self.ranges, other.ranges]))
+
+    def intersection(self, other):
+        return Moc(_combine(self.ranges, other.ranges, np.logical_and))
+
+    def difference(self, other):
+        return Moc(_combine(self.ranges, other.ranges, lambda x, y: x & ~y))
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def contains_moc(self, other):
+        """Whether the coverage includes all of another one"""
+        return not other.difference(self)
+
+    def overlaps(self, other):
+        return bool(self.intersection(other))
+
+    def contains(self, ra, dec):
+        """Whether positions (degrees) fall inside the coverage"""
+        ipix = hp.ang2pix(2 ** MAX_ORDER, np.asarray(ra, np.float64), np.asarray(dec, np.float64),
+                          nest=True, lonlat=True).astype(np.int64)
+        return _inside(self.ranges, ipix)
+
+    @property
+    def sky_fraction(self):
+        return float((self.ranges[:, 1] - self.ranges[:, 0]).sum()) / (12 * 4.0 ** MAX_ORDER)
+
+    @property
+    def area_deg2(self):
+        return self.sky_fraction * FULL_SKY_DEG2
+
+    def pixel_coverage(self, order):
+        """(pixels, covered fraction) of every NESTED pixel of `order` the coverage touches"""
+        shift = _shift(order)
+        if len(self.ranges) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        starts, stops = self.ranges[:, 0], self.ranges[:, 1]
+        pixels = np.unique(concat_ranges(starts >> shift, ((stops - 1) >> shift) + 1))
+        # Covered indices below x, from the cumulative range lengths
+        cumulative = np.concatenate([[0], np.cumsum(stops - starts)])
+
+        def covered(x):
+            k = np.searchsorted(starts, x, side='right') - 1
+            inside = np.minimum(x - starts[np.maximum(k, 0)], (stops - starts)[np.maximum(k, 0)])
+            return np.where(k >= 0, cumulative[np.maximum(k, 0)] + inside, 0)
+
+        return pixels, (covered((pixels + 1) << shift) - covered(pixels << shift)) / float(1 << shift)
+
+    def uniq(self):
+        """NUNIQ cells of the coverage, each range split into its largest aligned pixels"""
+        cells = []
+        for start, stop in self.ranges.tolist():
+            while start < stop:
+                # Largest aligned pixel starting at `start` that fits in the range
+                shift = _shift(0)
+                while shift and (start & ((1 << shift) - 1) or start + (1 << shift) > stop):
+                    shift -= 2
+                order = MAX_ORDER - shift // 2
+                cells.append(4 * 4 ** order + (start >> shift))
+                start += 1 << shift
+        return np.asarray(cells, dtype=np.int64)
+
+
+def header_footprint(header, order=DEFAULT_ORDER):
+    """Moc of the pixels of order `order` whose centres fall on the image of a FITS header"""
+    from astropy.wcs import WCS
+
+    wcs = WCS(header).celestial
+    nx, ny = int(header['NAXIS1']), int(header['NAXIS2'])
+    # Image centre and corners bound the candidate disc
+    px = np.array([(nx - 1) / 2, -0.5, nx - 0.5, -0.5, nx - 0.5, (nx - 1) / 2, (nx - 1) / 2, -0.5, nx - 0.5])
+    py = np.array([(ny - 1) / 2, -0.5, -0.5, ny - 0.5, ny - 0.5, -0.5, ny - 0.5, (ny - 1) / 2, (ny - 1) / 2])
+    ra, dec = wcs.all_pix2world(px, py, 0)
+    radius = np.nanmax(angular_distance(ra[0], dec[0], ra[1:], dec[1:]))
+    nside = 2 ** order
+    radius += 2 * np.degrees(hp.max_pixrad(nside))
+    vec = hp.ang2vec(ra[0], dec[0], lonlat=True)
+    candidates = hp.query_disc(nside, vec, np.radians(min(radius, 180.0)), inclusive=True, nest=True)
+    cra, cdec = hp.pix2ang(nside, candidates, nest=True, lonlat=True)
+    x, y = wcs.all_world2pix(cra, cdec, 0)
+    on_image = (x >= -0.5) & (x < nx - 0.5) & (y >= -0.5) & (y < ny - 0.5)
+    return Moc.from_pixels(candidates[on_image], order)
+
+
+def image_footprint(path, order=DEFAULT_ORDER):
+    """(sbid, Moc, header summary) of one FITS image, reading the header only"""
+    from astropy.io import fits
+    from hetu.stamps import image_sbid
+
+    header = fits.getheader(path, 0)
+    sbid = header.get('SBID') or image_sbid(path)
+    summary = {'image': os.path.basename(path), 'crval1': header.get('CRVAL1', np.nan),
+               'crval2': header.get('CRVAL2', np.nan), 'naxis1': header['NAXIS1'], 'naxis2': header['NAXIS2']}
+    return str(sbid), header_footprint(header, order), summary
+
+
+def write_footprints(path, sbids, mocs, order, summaries=None):
+    """Write field footprints with their elementary-segment -> fields table"""
+    counts = np.array([len(m) for m in mocs], dtype=np.int64)
+    field_rows = np.concatenate([[0], np.cumsum(counts)]).astype(np.uint64)
+    ranges = np.concatenate([m.ranges for m in mocs]) if mocs else np.zeros((0, 2), dtype=np.int64)
+    # Elementary segments between consecutive boundaries, and which fields cover each
+    bounds = np.unique(ranges.ravel())
+    first = np.searchsorted(bounds, ranges[:, 0])
+    last = np.searchsorted(bounds, ranges[:, 1])
+    segments = concat_ranges(first, last)
+    fields = np.repeat(np.repeat(np.arange(len(mocs)), counts), last - first)
+    sort = np.argsort(segments, kind='stable')
+    per_segment = np.bincount(segments, minlength=max(len(bounds) - 1, 0))
+    sbid_bytes, sbid_offsets = concat_strings([str(s) for s in sbids])
+    arrays = {
+        'ranges': ranges,
+        'field_rows': field_rows,
+        'area_deg2': np.array([m.area_deg2 for m in mocs], dtype=np.float64),
+        'sbids': sbid_bytes,
+        'sbid_offsets': sbid_offsets,
+        'bounds': bounds,
+        'segment_rows': np.concatenate([[0], np.cumsum(per_segment)]).astype(np.uint64),
+        'segment_fields': fields[sort].astype(np.int32),
+    }
+    write_shard(path, arrays, {'order': order, 'n_fields': len(mocs), 'fields': summaries or []})
+
+
+class FootprintSet(ArrayFile):
+    """Memory-mapped field footprints written by write_footprints"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.sbids = [self.string('sbids', 'sbid_offsets', k) for k in range(self.meta['n_fields'])]
+        self._rows = {sbid: k for k, sbid in enumerate(self.sbids)}
+
+    def __len__(self):
+        return len(self.sbids)
+
+    def field_index(self, sbid):
+        return self._rows[str(sbid)]
+
+    def moc(self, sbid):
+        k = self.field_index(sbid)
+        start, stop = self.arrays['field_rows'][k:k + 2]
+        return Moc(self.arrays['ranges'][int(start):int(stop)])
+
+    def area_deg2(self, sbid):
+        return float(self.arrays['area_deg2'][self.field_index(sbid)])
+
+    def union(self):
+        """Coverage of the whole survey"""
+        return Moc(self.arrays['ranges'])
+
+    def union_of(self, sbids):
+        """Coverage of a subset of the fields"""
+        rows = self.arrays['field_rows']
+        k = np.array([self.field_index(s) for s in sbids], dtype=np.int64)
+        return Moc(self.arrays['ranges'][concat_ranges(rows[k].astype(np.int64), rows[k + 1].astype(np.int64))])
+
+    def _segments(self, ipix):
+        """Elementary segment of each order-29 index (-1 when outside every field)"""
+        bounds = self.arrays['bounds']
+        k = np.searchsorted(bounds, ipix, side='right') - 1
+        return np.where((k >= 0) & (k < len(bounds) - 1), k, -1)
+
+    def fields_at(self, ra, dec):
+        """(position index, field index) pairs of the fields covering each position"""
+        ipix = hp.ang2pix(2 ** MAX_ORDER, np.atleast_1d(np.asarray(ra, np.float64)),
+                          np.atleast_1d(np.asarray(dec, np.float64)), nest=True, lonlat=True).astype(np.int64)
+        seg = self._segments(ipix)
+        valid = np.flatnonzero(seg >= 0)
+        rows = self.arrays['segment_rows']
+        starts, stops = rows[seg[valid]].astype(np.int64), rows[seg[valid] + 1].astype(np.int64)
+        positions = np.repeat(valid, stops - starts)
+        return positions, self.arrays['segment_fields'][concat_ranges(starts, stops)].astype(np.int64)
+
+    def coverage_count(self, ra, dec):
+        """Number of fields covering each position"""
+        positions, _ = self.fields_at(ra, dec)
+        return np.bincount(positions, minlength=len(np.atleast_1d(ra)))
+
+    def shared_area_deg2(self):
+        """Area (deg2) of each field also covered by at least one other field, counted once"""
+        rows = self.arrays['segment_rows'].astype(np.int64)
+        n_cover = np.diff(rows)
+        length = np.diff(self.arrays['bounds'].astype(np.int64)).astype(np.float64)
+        weights = np.repeat(np.where(n_cover > 1, length, 0.0), n_cover)
+        shared = np.bincount(self.arrays['segment_fields'].astype(np.int64), weights=weights, minlength=len(self))
+        return shared * FULL_SKY_DEG2 / (12 * 4.0 ** MAX_ORDER)
+
+    def overlaps(self):
+        """Overlap area (deg2) of every pair of fields that share coverage"""
+        bounds = self.arrays['bounds'].astype(np.int64)
+        rows = self.arrays['segment_rows'].astype(np.int64)
+        fields = self.arrays['segment_fields'].astype(np.int64)
+        n_cover = np.diff(rows)
+        shared = np.flatnonzero(n_cover > 1)
+        pairs = {}
+        for s in shared.tolist():
+            members = fields[rows[s]:rows[s + 1]]
+            length = bounds[s + 1] - bounds[s]
+            for i in range(len(members)):
+                for j in range(i + 1, len(members)):
+                    key = (min(members[i], members[j]), max(members[i], members[j]))
+                    pairs[key] = pairs.get(key, 0) + length
+        scale = FULL_SKY_DEG2 / (12 * 4.0 ** MAX_ORDER)
+        result = pd.DataFrame([{'SBID_a': self.sbids[a], 'SBID_b': self.sbids[b], 'overlap_deg2': n * scale}
+                               for (a, b), n in pairs.items()], columns=['SBID_a', 'SBID_b', 'overlap_deg2'])
+        return result.sort_values('overlap_deg2', ascending=False, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HEALPix MOC footprints of the survey fields')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_build = sub.add_parser('build', help='Footprints of every FITS image from its WCS and NAXIS')
+    p_build.add_argument('image_dir', help='Directory of the FITS images')
+    p_build.add_argument('output', help=f'Output footprint file (*{MOC_SUFFIX})')
+    p_build.add_argument('--pattern', default='*.fits', help='Glob pattern of the image files')
+    p_build.add_argument('--order', type=int, default=DEFAULT_ORDER,
+                         help='HEALPix order of the footprint pixels (11: ~1.7 arcmin)')
+    add_executor_arguments(p_build)
+    p_info = sub.add_parser('info', help='Area of every field and of the survey')
+    p_info.add_argument('footprints')
+    p_info.add_argument('-o', '--output', default=None, help='Output CSV of the field areas')
+    p_lookup = sub.add_parser('lookup', help='Fields covering a position')
+    p_lookup.add_argument('footprints')
+    p_lookup.add_argument('ra', type=float)
+    p_lookup.add_argument('dec', type=float)
+    p_overlaps = sub.add_parser('overlaps', help='Pairs of overlapping fields and their shared area')
+    p_overlaps.add_argument('footprints')
+    p_overlaps.add_argument('-o', '--output', default=None, help='Output CSV (default: print)')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        images = sorted(glob.glob(os.path.join(args.image_dir, args.pattern)))
+        print(f"Building order-{args.order} footprints of {len(images)} images")
+        sbids, mocs, summaries = [], [], []
+        n = len(images)
+        for path, result, error in executor_from_args(args).run(image_footprint, images, [args.order] * n):
+            if error is not None:
+                print(f"Error processing {os.path.basename(path)}: {error}")
+                continue
+            sbid, moc, summary = result
+            if sbid in sbids:
+                print(f"Skipping {os.path.basename(path)}: SBID {sbid} already has a footprint")
+                continue
+            sbids.append(sbid)
+            mocs.append(moc)
+            summaries.append(summary)
+        write_footprints(args.output, sbids, mocs, args.order, summaries)
+        print(f"Saved {len(mocs)} footprints to {args.output}")
+        return
+
+    with FootprintSet(args.footprints) as fields:
+        if args.command == 'info':
+            table = pd.DataFrame({'SBID': fields.sbids, 'area_deg2': np.asarray(fields.arrays['area_deg2'])})
+            survey = fields.union().area_deg2
+            print(f"{len(fields)} fields at order {fields.meta['order']}: "
+                  f"{table['area_deg2'].sum():.1f} deg2 summed, {survey:.1f} deg2 covered")
+            if args.output:
+                table.to_csv(args.output, index=False)
+                print(f"Saved {len(table)} rows to {args.output}")
+            else:
+                print(table.to_string(index=False))
+        elif args.command == 'lookup':
+            _, rows = fields.fields_at(args.ra, args.dec)
+            print(f"{len(rows)} fields cover ({args.ra}, {args.dec}): {', '.join(fields.sbids[k] for k in rows)}")
+        else:
+            table = fields.overlaps()
+            if args.output:
+                table.to_csv(args.output, index=False)
+                print(f"Saved {len(table)} overlapping field pairs to {args.output}")
+            else:
+                print(table.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+Rasterized density plots of millions of detections (sky maps, score vs any column).
+
+A matplotlib scatter of the whole survey is far too slow, and concatenating every catalog
+just to call ``plt.hist`` holds the survey in memory. Here detections are binned into a
+fixed-resolution 2D count image instead:
+  * 'sky' mode projects RA/Dec (plate carree 'car', or equal-area 'hammer' Hammer-Aitoff)
+    with RA increasing to the left,
+  * 'columns' mode bins any numeric column against another (score by default on y).
+Each catalog file is read in chunks of CHUNK_ROWS rows with only the needed columns, and
+every chunk is reduced to bin counts with one ``np.bincount``; files run on the executor
+(hetu.executor) and their count images are summed, so memory is bounded by the chunk size
+and the image size whatever the number of points. With ``--value`` the image is the
+per-pixel mean of a column (e.g. mean score on the sky) instead of the counts.
+
+Column axis ranges default to the per-file min/max statistics of hetu.catalog (a single
+CSV gets one extra streamed pass). Predicates (``--where``) use the hetu.catalog syntax
+and prune whole files from the statistics before any row is read.
+
+Command line:
+    python -m hetu.raster sky /home/ydai240628/analysis_hetu/file/bbox_overlap_removal/output_internimage_0722 \
+        -o sky_density.png --projection hammer --where "score>=0.5"
+    python -m hetu.raster columns DIR -x peak_flux -y score --log-x -o score_vs_flux.png
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from hetu.catalog import parse_predicate, plan_tasks, resolve_column
+from hetu.executor import Executor, add_executor_arguments, executor_from_args
+
+CHUNK_ROWS = 1_000_000
+DEFAULT_SHAPE = (900, 1800)
+PROJECTIONS = ('car', 'hammer')
+
+
+def project(ra, dec, projection='car', ra_centre=180.0):
+    """Plane coordinates of RA/Dec positions; x grows towards smaller RA (sky view)"""
+    lon = np.radians(-((np.asarray(ra, np.float64) - ra_centre + 180.0) % 360.0 - 180.0))
+    lat = np.radians(np.asarray(dec, np.float64))
+    if projection == 'car':
+        return np.degrees(lon), np.degrees(lat)
+    if projection == 'hammer':
+        scale = np.sqrt(2.0) / np.sqrt(1.0 + np.cos(lat) * np.cos(lon / 2.0))
+        return 2.0 * scale * np.cos(lat) * np.sin(lon / 2.0), scale * np.sin(lat)
+    raise ValueError(f"unknown projection '{projection}' (choose from {', '.join(PROJECTIONS)})")
+
+
+def projection_extent(projection):
+    """(x_min, x_max, y_min, y_max) covering the whole sky in a projection"""
+    if projection == 'car':
+        return -180.0, 180.0, -90.0, 90.0
+    r2 = np.sqrt(2.0)
+    return -2.0 * r2, 2.0 * r2, -r2, r2
+
+
+class Raster:
+    """Fixed-size 2D count image (and optional value sums) filled chunk by chunk"""
+
+    def __init__(self, extent, shape=DEFAULT_SHAPE, log_x=False, log_y=False, with_values=False):
+        self.extent = tuple(float(v) for v in extent)
+        self.shape = tuple(shape)
+        self.log_x, self.log_y = log_x, log_y
+        self.counts = np.zeros(self.shape, dtype=np.int64)
+        self.sums = np.zeros(self.shape, dtype=np.float64) if with_values else None
+
+    def _axis(self, v, lo, hi, n, log):
+        if log:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                v, lo, hi = np.log10(v), np.log10(lo), np.log10(hi)
+        k = np.floor((v - lo) / (hi - lo) * n)
+        k[v == hi] = n - 1  # the upper edge belongs to the last bin
+        return k
+
+    def add(self, x, y, values=None):
+        """Bin one chunk of points; points outside the extent (or NaN) are dropped"""
+        x0, x1, y0, y1 = self.extent
+        ny, nx = self.shape
+        i = self._axis(np.asarray(x, np.float64), x0, x1, nx, self.log_x)
+        j = self._axis(np.asarray(y, np.float64), y0, y1, ny, self.log_y)
+        keep = (i >= 0) & (i < nx) & (j >= 0) & (j < ny)
+        flat = j[keep].astype(np.int64) * nx + i[keep].astype(np.int64)
+        self.counts += np.bincount(flat, minlength=nx * ny).reshape(self.shape)
+        if self.sums is not None:
+            v = np.asarray(values, np.float64)[keep]
+            finite = np.isfinite(v)
+            self.sums += np.bincount(flat[finite], weights=v[finite], minlength=nx * ny).reshape(self.shape)
+        return int(keep.sum())
+
+    def merge(self, other):
+        self.counts += other.counts
+        if self.sums is not None:
+            self.sums += other.sums
+        return self
+
+    def image(self):
+        """Counts, or the per-pixel mean value when values were binned; empty pixels are NaN"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if self.sums is not None:
+                return np.where(self.counts > 0, self.sums / self.counts, np.nan)
+            return np.where(self.counts > 0, self.counts, np.nan).astype(np.float64)
+
+
+class RasterSpec:
+    """What to bin: axis columns, how to map them to the plane, and the image geometry"""
+
+    def __init__(self, mode, x, y, extent, shape=DEFAULT_SHAPE, projection='car', ra_centre=180.0,
+                 value=None, log_x=False, log_y=False):
+        self.mode = mode
+        self.x, self.y, self.value = x, y, value
+        self.extent, self.shape = extent, shape
+        self.projection, self.ra_centre = projection, ra_centre
+        self.log_x, self.log_y = log_x, log_y
+
+    def columns(self):
+        return [c for c in (self.x, self.y, self.value) if c is not None]
+
+    def new_raster(self):
+        return Raster(self.extent, self.shape, self.log_x, self.log_y, self.value is not None)
+
+    def fill(self, raster, df):
+        x, y = df[self.x].to_numpy(np.float64), df[self.y].to_numpy(np.float64)
+        if self.mode == 'sky':
+            x, y = project(x, y, self.projection, self.ra_centre)
+        return raster.add(x, y, df[self.value].to_numpy(np.float64) if self.value else None)
+
+
+def iter_chunks(path, usecols, rename, predicates=(), chunk_rows=CHUNK_ROWS):
+    """Chunks of the projected columns of one file with the predicates applied"""
+    for df in pd.read_csv(path, usecols=usecols, chunksize=chunk_rows):
+        df = df.rename(columns=rename)
+        if predicates:
+            keep = np.ones(len(df), dtype=bool)
+            for pred in predicates:
+                keep &= pred.mask(df[pred.column])
+            df = df[keep]
+        yield df
+
+
+def rasterize_file(path, usecols, rename, predicates, spec, chunk_rows=CHUNK_ROWS):
+    """Count image of one catalog file, read chunk by chunk"""
+    raster = spec.new_raster()
+    for df in iter_chunks(path, usecols, rename, predicates, chunk_rows):
+        spec.fill(raster, df)
+    return raster
+
+
+def column_range(tasks, stats, column, predicates=(), chunk_rows=CHUNK_ROWS):
+    """(min, max) of a logical column over the planned files: statistics, else a streamed pass"""
+    lo, hi = np.inf, -np.inf
+    if stats is not None:
+        scanned = {os.path.basename(t['path']) for t in tasks}
+        for row in stats.to_dict('records'):
+            physical = resolve_column(column, row['columns'].split('|'))
+            if row['file'] in scanned and physical is not None:
+                lo = min(lo, row.get(f'min__{physical}', np.inf))
+                hi = max(hi, row.get(f'max__{physical}', -np.inf))
+    else:
+        for t in tasks:
+            for df in iter_chunks(t['path'], t['usecols'], t['rename'], predicates, chunk_rows):
+                lo, hi = min(lo, df[column].min()), max(hi, df[column].max())
+    if not (np.isfinite(lo) and np.isfinite(hi)):
+        raise ValueError(f"no finite values of '{column}' to set the axis range")
+    return float(lo), float(hi) if hi > lo else float(lo) + 1.0
+
+
+def rasterize(source, spec, predicates=(), executor=None, pattern='*.csv', exclude_sbids=(),
+              chunk_rows=CHUNK_ROWS, tasks=None):
+    """Summed count image of every planned file"""
+    if tasks is None:
+        tasks, _ = plan_tasks(source, spec.columns(), predicates, pattern, exclude_sbids)
+    total = spec.new_raster()
+    if not tasks:
+        return total
+    executor = executor or Executor()
+    n = len(tasks)
+    results = executor.run(rasterize_file, [t['path'] for t in tasks], [t['usecols'] for t in tasks],
+                           [t['rename'] for t in tasks], [predicates] * n, [spec] * n, [chunk_rows] * n)
+    for path, raster, error in results:
+        if error is not None:
+            print(f"Error rasterizing {os.path.basename(path)}: {error}")
+            continue
+        total.merge(raster)
+    return total
+
+
+def render(raster, path, spec, cmap='viridis', log=True, title=None, dpi=200):
+    """Draw the image with a colormap (log-scaled counts by default) and save it"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm, Normalize
+
+    image = raster.image()
+    finite = image[np.isfinite(image)]
+    if log and spec.value is None and finite.size:
+        norm = LogNorm(vmin=max(finite.min(), 1), vmax=max(finite.max(), 1))
+    else:
+        norm = Normalize(*(np.percentile(finite, [0.5, 99.5]) if finite.size else (0, 1)))
+    x0, x1, y0, y1 = raster.extent
+    fig, ax = plt.subplots(figsize=(12, 6.5) if spec.mode == 'sky' else (8, 6))
+    if spec.mode == 'sky' or not (spec.log_x or spec.log_y):
+        im = ax.imshow(image, origin='lower', extent=(x0, x1, y0, y1), cmap=cmap, norm=norm,
+                       aspect='equal' if spec.mode == 'sky' else 'auto', interpolation='nearest')
+    else:
+        ny, nx = raster.shape
+        xe = np.logspace(np.log10(x0), np.log10(x1), nx + 1) if spec.log_x else np.linspace(x0, x1, nx + 1)
+        ye = np.logspace(np.log10(y0), np.log10(y1), ny + 1) if spec.log_y else np.linspace(y0, y1, ny + 1)
+        im = ax.pcolormesh(xe, ye, np.ma.masked_invalid(image), cmap=cmap, norm=norm, rasterized=True)
+        ax.set_xscale('log' if spec.log_x else 'linear')
+        ax.set_yscale('log' if spec.log_y else 'linear')
+    if spec.mode == 'sky':
+        _draw_graticule(ax, spec)
+    else:
+        ax.set_xlabel(spec.x)
+        ax.set_ylabel(spec.y)
+    label = f'mean {spec.value} per pixel' if spec.value else 'detections per pixel'
+    fig.colorbar(im, ax=ax, shrink=0.7, label=label)
+    if title:
+        ax.set_title(title)
+    fig.savefig(path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+
+def _draw_graticule(ax, spec, dra=60, ddec=30):
+    """RA/Dec grid lines and labels, drawn through the same projection as the data"""
+    line = np.linspace(-90, 90, 181)
+    for ra in np.arange(0, 360, dra):
+        ax.plot(*project(np.full_like(line, ra), line, spec.projection, spec.ra_centre),
+                color='0.6', lw=0.5, alpha=0.8)
+        x, y = project(ra, 0.0, spec.projection, spec.ra_centre)
+        ax.text(x, y, f'{ra:d}°', fontsize=7, color='0.4', ha='center', va='bottom')
+    ring = spec.ra_centre - 180.0 + np.linspace(1e-6, 360 - 1e-6, 721)
+    for dec in np.arange(-90 + ddec, 90, ddec):
+        ax.plot(*project(ring, np.full_like(ring, dec), spec.projection, spec.ra_centre),
+                color='0.6', lw=0.5, alpha=0.8)
+    if spec.projection == 'hammer':
+        ax.plot(*project(np.full_like(line, spec.ra_centre + 180.0 - 1e-6), line, 'hammer', spec.ra_centre),
+                color='0.3', lw=0.8)
+        ax.plot(*project(np.full_like(line, spec.ra_centre - 180.0 + 1e-6), line, 'hammer', spec.ra_centre),
+                color='0.3', lw=0.8)
+    ax.set_axis_off()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rasterized density plots of the HeTu catalog')
+    parser.add_argument('mode', choices=('sky', 'columns'), help="'sky' RA/Dec map, or one column against another")
+    parser.add_argument('source', help='Catalog CSV, or a directory of per-SBID catalog CSVs')
+    parser.add_argument('-o', '--output', required=True, help='Output image (PNG/PDF)')
+    parser.add_argument('-x', default=None, help="X column in 'columns' mode")
+    parser.add_argument('-y', default='score', help="Y column in 'columns' mode (default score)")
+    parser.add_argument('--x-range', type=float, nargs=2, default=None, help='X axis range (default: data range)')
+    parser.add_argument('--y-range', type=float, nargs=2, default=None, help='Y axis range (default: data range)')
+    parser.add_argument('--log-x', action='store_true', help='Logarithmic X bins')
+    parser.add_argument('--log-y', action='store_true', help='Logarithmic Y bins')
+    parser.add_argument('--projection', choices=PROJECTIONS, default='car', help="Sky projection (default car)")
+    parser.add_argument('--ra-centre', type=float, default=180.0, help='RA at the centre of the sky map')
+    parser.add_argument('--bins', type=int, nargs=2, default=None, metavar=('NY', 'NX'),
+                        help='Image size in pixels (default 900 1800 for sky, 400 400 for columns)')
+    parser.add_argument('--value', default=None, help='Show the per-pixel mean of this column instead of counts')
+    parser.add_argument('--where', action='append', default=[], help="Row predicate such as 'score>=0.5' (repeatable)")
+    parser.add_argument('--pattern', default='*.csv', help='Glob pattern of the catalog files')
+    parser.add_argument('--exclude', default='', help='Comma separated SBIDs to exclude')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='Rows read per chunk')
+    parser.add_argument('--cmap', default='viridis', help='Matplotlib colormap')
+    parser.add_argument('--linear', action='store_true', help='Linear instead of logarithmic count scale')
+    parser.add_argument('--title', default=None)
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+
+    if args.mode == 'columns' and not args.x:
+        parser.error("'columns' mode needs -x COLUMN")
+    predicates = [parse_predicate(p) for p in args.where]
+    exclude = [s.strip() for s in args.exclude.split(',') if s.strip()]
+    x, y = ('ra', 'dec') if args.mode == 'sky' else (args.x, args.y)
+    columns = [c for c in (x, y, args.value) if c is not None]
+
+    start = time.time()
+    tasks, stats = plan_tasks(args.source, columns, predicates, args.pattern, exclude)
+    if args.mode == 'sky':
+        extent = projection_extent(args.projection)
+        shape = tuple(args.bins or DEFAULT_SHAPE)
+    else:
+        x_range = args.x_range or column_range(tasks, stats, x, predicates, args.chunk_rows)
+        y_range = args.y_range or column_range(tasks, stats, y, predicates, args.chunk_rows)
+        for name, lo, log in ((x, x_range[0], args.log_x), (y, y_range[0], args.log_y)):
+            if log and lo <= 0:
+                parser.error(f"logarithmic '{name}' axis needs a positive range (--x-range/--y-range)")
+        extent = (*x_range, *y_range)
+        shape = tuple(args.bins or (400, 400))
+    spec = RasterSpec(args.mode, x, y, extent, shape, args.projection, args.ra_centre,
+                      args.value, args.log_x, args.log_y)
+    raster = rasterize(args.source, spec, predicates, executor_from_args(args),
+                       chunk_rows=args.chunk_rows, tasks=tasks)
+    n_points = int(raster.counts.sum())
+    print(f"Binned {n_points} detections from {len(tasks)} files into {shape[1]}x{shape[0]} pixels "
+          f"in {time.time() - start:.1f} s")
+    render(raster, args.output, spec, args.cmap, not args.linear, args.title)
+    print(f"Saved {args.output} ({time.time() - start:.1f} s total)")
+
+
+if __name__ == "__main__":
+    main()
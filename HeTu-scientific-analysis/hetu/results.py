@@ -0,0 +1,166 @@
+"""
+Typed crossmatch result records collected in one results table.
+
+The crossmatch scripts append one record per SB (SBID, model, matched, total, fraction,
+median separation) as they run, and the accuracy aggregation reads the table once
+instead of reopening thousands of ``match_ratio_SB_*.txt`` files.
+
+The table is a CSV with a fixed schema (appended in place), or a Parquet file when the
+path ends in ``.parquet`` and pyarrow is installed (records are buffered and written on
+close). Old text summaries can be converted once with ``import_legacy_txt``; summaries
+that only kept the percentage give records whose matched/total are NA.
+
+Command line:
+    python -m hetu.results crossmatch_results.csv --model resnet
+    python -m hetu.results crossmatch_results.csv --import-txt output_resnet/txt --model resnet
+"""
+import argparse
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+RESULT_SCHEMA = {
+    'SBID': 'string',
+    'model': 'string',
+    'label': 'Int64',
+    'matched': 'Int64',
+    'total': 'Int64',
+    'fraction': 'float64',
+    'median_sep_arcsec': 'float64',
+    'radius_arcsec': 'float64',
+}
+RESULT_COLUMNS = list(RESULT_SCHEMA)
+
+
+def make_record(sbid, model, matched, total, separations=None, label=None, radius_arcsec=np.nan, fraction=None):
+    """Build one typed result record; matched and total may be None (unknown) when the fraction is given"""
+    separations = np.asarray(separations if separations is not None else [], dtype=np.float64)
+    if fraction is None:
+        fraction = matched / total if total > 0 else 0.0
+    return {
+        'SBID': str(sbid),
+        'model': model,
+        'label': label,
+        'matched': pd.NA if matched is None else int(matched),
+        'total': pd.NA if total is None else int(total),
+        'fraction': float(fraction),
+        'median_sep_arcsec': float(np.median(separations)) if separations.size else np.nan,
+        'radius_arcsec': float(radius_arcsec),
+    }
+
+
+class ResultsWriter:
+    """Append result records to one table; use as a context manager"""
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.endswith('.parquet')
+        self._buffer = []
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def append(self, record):
+        if self.parquet:
+            self._buffer.append(record)
+            return
+        header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        pd.DataFrame([record], columns=RESULT_COLUMNS).to_csv(self.path, mode='a', header=header, index=False)
+
+    def close(self):
+        if not self.parquet or not self._buffer:
+            return
+        new = _typed(pd.DataFrame(self._buffer, columns=RESULT_COLUMNS))
+        if os.path.exists(self.path):
+            new = pd.concat([pd.read_parquet(self.path), new], ignore_index=True)
+        new.to_parquet(self.path, index=False)
+        self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _typed(df):
+    for column, dtype in RESULT_SCHEMA.items():
+        if column not in df:
+            df[column] = pd.NA
+        df[column] = df[column].astype(dtype)
+    return df[RESULT_COLUMNS]
+
+
+def read_results(path, model=None, latest=True):
+    """Read the whole results table in one go; keep the last record per (SBID, model, label)"""
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path, dtype={'SBID': str, 'model': str})
+    df = _typed(df)
+    if model is not None:
+        df = df[df['model'] == model]
+    if latest:
+        df = df.drop_duplicates(['SBID', 'model', 'label'], keep='last')
+    return df.reset_index(drop=True)
+
+
+_LEGACY_RATIO = re.compile(r'Matched A sources / Total A sources:\s*(\d+)\s*/\s*(\d+)')
+_LEGACY_SUBDIR = re.compile(r'Subdirectory:\s*(\d+)')
+_LEGACY_PROPORTION = re.compile(r'Proportion:\s*([\d\.]+)')
+_SB_IN_NAME = re.compile(r'(\d+)\.txt$')
+
+
+def import_legacy_txt(folder_path, model, label=None):
+    """Convert an old folder of match_ratio_SB_*.txt / crossmatch-result-*.txt files into records"""
+    records = []
+    for file_name in sorted(os.listdir(folder_path)):
+        if not file_name.endswith('.txt'):
+            continue
+        with open(os.path.join(folder_path, file_name), 'r', encoding='utf-8') as f:
+            text = f.read()
+        name_match = _SB_IN_NAME.search(file_name)
+        subdir = _LEGACY_SUBDIR.search(text)
+        sbid = subdir.group(1) if subdir else (name_match.group(1) if name_match else None)
+        ratio = _LEGACY_RATIO.search(text)
+        if ratio:
+            records.append(make_record(sbid, model, int(ratio.group(1)), int(ratio.group(2)), label=label))
+            continue
+        proportion = _LEGACY_PROPORTION.search(text)
+        if proportion:
+            # Only the percentage survives in these files: the counts are unknown (NA)
+            records.append(make_record(sbid, model, None, None, label=label,
+                                       fraction=float(proportion.group(1)) / 100))
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarise or import crossmatch result records')
+    parser.add_argument('table', help='Results table (.csv or .parquet)')
+    parser.add_argument('--model', default=None, help='Only report this model')
+    parser.add_argument('--import-txt', default=None, help='Folder of legacy txt summaries to append to the table')
+    parser.add_argument('--label', type=int, default=None, help='HeTu label the legacy summaries refer to')
+    args = parser.parse_args()
+
+    if args.import_txt:
+        if not args.model:
+            parser.error('--import-txt requires --model')
+        records = import_legacy_txt(args.import_txt, args.model, args.label)
+        with ResultsWriter(args.table) as writer:
+            for record in records:
+                writer.append(record)
+        print(f"Imported {len(records)} records from {args.import_txt} into {args.table}")
+
+    df = read_results(args.table, args.model)
+    for model, group in df.groupby('model'):
+        counted = group[group['matched'].notna() & group['total'].notna()]
+        matched, total = counted['matched'].sum(), counted['total'].sum()
+        unknown = f" ({len(group) - len(counted)} with a fraction only)" if len(counted) < len(group) else ''
+        print(f"{model}: {len(group)} SBIDs, matched {matched}/{total} over {len(counted)} SBIDs with counts{unknown}, "
+              f"median per-SB fraction {group['fraction'].median():.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Pack per-cutout detection JSONs into one indexed binary shard per SBID.
+
+The raw output under AI4Astronomy_zhuanyi/output_* has one JSON per cutout
+({"labels", "scores", "bboxes", "masks": [{"size", "counts"}]}). Reading millions of
+small files on /groups is dominated by open/stat latency, so each SBID folder is
+converted once into ``<SBID>.hshard``:
+
+    magic 'HETUSHD1' | uint64 header length | JSON header | 64-byte aligned arrays
+
+Arrays (N detections, C cutouts):
+    cutout_names  uint8 (concatenated utf-8 component_id)   cutout_name_offsets uint64 (C+1)
+    cutout_rows   uint64 (C+1)  detection row range of every cutout (the offset table)
+    labels int16 (N)   scores float64 (N)   bboxes float64 (N, 4)   mask_size int32 (N, 2)
+    rle_bytes uint8 (concatenated RLE 'counts')   rle_offsets uint64 (N+1)
+
+ShardReader maps the file with mmap and exposes every array as a zero-copy NumPy view;
+``reader.cutout(component_id)`` returns the detections of one cutout by random access.
+
+Command line:
+    python -m hetu.shards pack /groups/hetu_ai/home/share/HeTu/pjlab/AI4Astronomy_zhuanyi/output_resnet/ shards/output_resnet
+    python -m hetu.shards info shards/output_resnet/20147.hshard
+"""
+import argparse
+import json
+import mmap
+import os
+import shutil
+import struct
+
+import numpy as np
+
+from hetu.executor import add_executor_arguments, executor_from_args
+
+MAGIC = b'HETUSHD1'
+VERSION = 1
+ALIGN = 64
+SHARD_SUFFIX = '.hshard'
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_shard(path, arrays, meta=None):
+    """Write named arrays into one aligned binary file (atomically via a temp file)"""
+    entries, offset = {}, 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({'version': VERSION, 'meta': meta or {}, 'arrays': entries}).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(data_start + entries[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+class ArrayFileWriter:
+    """Build an array file by appending chunks to each array, for outputs larger than memory
+
+    Every array is streamed to its own part file next to ``path``; ``close`` writes the
+    header (sizes are known by then) and copies the parts into their aligned slots.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._parts = {}
+
+    def append(self, name, array):
+        """Append rows (first axis) to an array; dtype and row shape are fixed by the first chunk"""
+        part = self._parts.get(name)
+        if part is None:
+            array = np.ascontiguousarray(array)
+            part = {'file': open(f"{self.path}.{len(self._parts)}.part", 'wb'),
+                    'dtype': array.dtype, 'row_shape': list(array.shape[1:]), 'rows': 0}
+            self._parts[name] = part
+        array = np.ascontiguousarray(array, dtype=part['dtype'])
+        part['file'].write(array.tobytes())
+        part['rows'] += len(array)
+
+    def close(self, meta=None):
+        """Assemble the parts into the final file (atomically via a temp file)"""
+        entries, offset = {}, 0
+        for name, part in self._parts.items():
+            part['file'].close()
+            shape = [part['rows']] + part['row_shape']
+            entries[name] = {'dtype': part['dtype'].str, 'shape': shape, 'offset': offset}
+            offset = _align(offset + int(np.prod(shape, dtype=np.int64)) * part['dtype'].itemsize)
+        header = json.dumps({'version': VERSION, 'meta': meta or {}, 'arrays': entries}).encode()
+        data_start = _align(len(MAGIC) + 8 + len(header))
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+            for name, part in self._parts.items():
+                f.seek(data_start + entries[name]['offset'])
+                with open(part['file'].name, 'rb') as src:
+                    shutil.copyfileobj(src, f, 16 << 20)
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, self.path)
+        self.abort()
+
+    def abort(self):
+        """Remove the part files"""
+        for part in self._parts.values():
+            part['file'].close()
+            if os.path.exists(part['file'].name):
+                os.remove(part['file'].name)
+        self._parts = {}
+
+
+def concat_strings(strings):
+    """Concatenated utf-8 bytes of a list of strings and their (len + 1) offsets"""
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded], dtype=np.uint64)
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def concat_ranges(starts, stops):
+    """Concatenated positions of a set of [start, stop) ranges"""
+    lengths = (np.asarray(stops) - np.asarray(starts)).astype(np.int64)
+    ends = np.cumsum(lengths)
+    return np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - lengths - np.asarray(starts).astype(np.int64), lengths)
+
+
+def pack_json_files(json_paths, out_path, sbid=None):
+    """Pack the per-cutout JSONs of one SBID into a shard; returns (cutouts, detections, errors)"""
+    names, rows = [], [0]
+    labels, scores, bboxes, sizes, counts = [], [], [], [], []
+    errors = 0
+    for json_path in sorted(json_paths, key=os.path.basename):
+        try:
+            with open(json_path, 'r') as f:
+                data = json.load(f)
+            n = len(data['labels'])
+            masks = data.get('masks') or [{}] * n
+            cut_bboxes = [list(b)[:4] for b in data['bboxes']]
+            if len(data['scores']) != n or len(cut_bboxes) != n or len(masks) != n:
+                raise ValueError('labels/scores/bboxes/masks lengths differ')
+        except Exception as e:
+            print(f"Skipping {json_path}: {e}")
+            errors += 1
+            continue
+        names.append(os.path.basename(json_path))
+        rows.append(rows[-1] + n)
+        labels.extend(data['labels'])
+        scores.extend(data['scores'])
+        bboxes.extend(cut_bboxes)
+        sizes.extend(m.get('size', [0, 0]) for m in masks)
+        for m in masks:
+            c = m.get('counts', '')
+            # Uncompressed (list) RLE is kept as its JSON text
+            counts.append(c if isinstance(c, str) else json.dumps(c))
+
+    name_bytes, name_offsets = concat_strings(names)
+    rle_bytes, rle_offsets = concat_strings(counts)
+    arrays = {
+        'cutout_names': name_bytes,
+        'cutout_name_offsets': name_offsets,
+        'cutout_rows': np.asarray(rows, dtype=np.uint64),
+        'labels': np.asarray(labels, dtype=np.int16),
+        'scores': np.asarray(scores, dtype=np.float64),
+        'bboxes': np.asarray(bboxes, dtype=np.float64).reshape(-1, 4),
+        'mask_size': np.asarray(sizes, dtype=np.int32).reshape(-1, 2),
+        'rle_bytes': rle_bytes,
+        'rle_offsets': rle_offsets,
+    }
+    write_shard(out_path, arrays, {'sbid': sbid, 'n_cutouts': len(names), 'n_detections': len(labels)})
+    return len(names), len(labels), errors
+
+
+class ArrayFile:
+    """Memory-mapped, zero-copy access to the named arrays of a file written by write_shard"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a HeTu array file")
+        (header_len,) = struct.unpack('<Q', self._mmap[len(MAGIC):len(MAGIC) + 8])
+        header = json.loads(self._mmap[len(MAGIC) + 8:len(MAGIC) + 8 + header_len])
+        self.meta = header['meta']
+        data_start = _align(len(MAGIC) + 8 + header_len)
+        self.arrays = {}
+        for name, entry in header['arrays'].items():
+            dtype = np.dtype(entry['dtype'])
+            count = int(np.prod(entry['shape'], dtype=np.int64))
+            view = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=data_start + entry['offset'])
+            self.arrays[name] = view.reshape(entry['shape'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.arrays = {}
+        try:
+            self._mmap.close()
+        except (BufferError, AttributeError):
+            # Views still referenced elsewhere keep the mapping alive until they are dropped
+            pass
+        self._file.close()
+
+    def __getattr__(self, name):
+        arrays = self.__dict__.get('arrays', {})
+        if name in arrays:
+            return arrays[name]
+        raise AttributeError(name)
+
+    def string(self, name, offsets, k):
+        """k-th string of an array of concatenated utf-8 bytes with its offsets array"""
+        start, stop = self.arrays[offsets][k:k + 2]
+        return self.arrays[name][start:stop].tobytes().decode('utf-8')
+
+
+class ShardReader(ArrayFile):
+    """Memory-mapped, zero-copy access to one detection shard"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._index = None
+
+    def __len__(self):
+        return len(self.arrays['labels'])
+
+    @property
+    def n_cutouts(self):
+        return len(self.arrays['cutout_rows']) - 1
+
+    def component_id(self, k):
+        return self.string('cutout_names', 'cutout_name_offsets', k)
+
+    def component_ids(self):
+        return [self.component_id(k) for k in range(self.n_cutouts)]
+
+    def component_rows(self):
+        """component_id of every detection row, as a NumPy array of cutout numbers"""
+        return np.repeat(np.arange(self.n_cutouts), np.diff(self.arrays['cutout_rows']).astype(np.int64))
+
+    def rows_of(self, component_id):
+        """Detection row range (start, stop) of one cutout"""
+        if self._index is None:
+            self._index = {name: k for k, name in enumerate(self.component_ids())}
+        k = self._index[component_id]
+        start, stop = self.arrays['cutout_rows'][k:k + 2]
+        return int(start), int(stop)
+
+    def counts(self, row):
+        """RLE counts string of one detection"""
+        return self.string('rle_bytes', 'rle_offsets', row)
+
+    def cutout(self, component_id):
+        """Detections of one cutout in the JSON layout (arrays are views into the shard)"""
+        return self._detections(*self.rows_of(component_id))
+
+    def _detections(self, start, stop):
+        return {
+            'labels': self.arrays['labels'][start:stop],
+            'scores': self.arrays['scores'][start:stop],
+            'bboxes': self.arrays['bboxes'][start:stop],
+            'masks': [{'size': self.arrays['mask_size'][i].tolist(), 'counts': self.counts(i)}
+                      for i in range(start, stop)],
+        }
+
+    def iter_cutouts(self):
+        """Yield (component_id, detections) for every cutout in shard order"""
+        rows = self.arrays['cutout_rows']
+        for k in range(self.n_cutouts):
+            yield self.component_id(k), self._detections(int(rows[k]), int(rows[k + 1]))
+
+
+def find_sbid_json_dirs(root_directory):
+    """SBID -> JSON files, using the same folder convention as only_label2.py"""
+    groups = {}
+    for root, dirs, files in os.walk(root_directory):
+        json_files = [os.path.join(root, f) for f in files if f.endswith('.json')]
+        if json_files:
+            sbid = os.path.basename(os.path.dirname(root))
+            groups.setdefault(sbid, []).extend(json_files)
+    return groups
+
+
+def list_shards(shard_dir):
+    return sorted(os.path.join(shard_dir, f) for f in os.listdir(shard_dir) if f.endswith(SHARD_SUFFIX))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack per-cutout detection JSONs into per-SBID binary shards')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_pack = sub.add_parser('pack', help='Convert every SBID folder under a root directory')
+    p_pack.add_argument('root_directory', help='Root of the per-cutout JSON output (output_resnet, ...)')
+    p_pack.add_argument('output_dir', help='Directory receiving <SBID>.hshard files')
+    p_pack.add_argument('--force', action='store_true', help='Repack SBIDs whose shard is newer than the JSONs')
+    add_executor_arguments(p_pack)
+    p_info = sub.add_parser('info', help='Print a summary of one shard')
+    p_info.add_argument('shard')
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        with ShardReader(args.shard) as reader:
+            print(f"{args.shard}: {reader.meta}")
+            print(f"  {reader.n_cutouts} cutouts, {len(reader)} detections, "
+                  f"{reader.arrays['rle_bytes'].nbytes} bytes of RLE")
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    groups = find_sbid_json_dirs(args.root_directory)
+    print(f"Found {len(groups)} SBID folders under {args.root_directory}")
+    sbids, json_lists, out_paths = [], [], []
+    for sbid, json_paths in sorted(groups.items()):
+        out_path = os.path.join(args.output_dir, f"{sbid}{SHARD_SUFFIX}")
+        if not args.force and os.path.exists(out_path):
+            newest = max(os.path.getmtime(p) for p in json_paths)
+            if os.path.getmtime(out_path) >= newest:
+                continue
+        sbids.append(sbid)
+        json_lists.append(json_paths)
+        out_paths.append(out_path)
+    print(f"Packing {len(sbids)} SBIDs ({len(groups) - len(sbids)} shards up to date)")
+
+    for sbid, result, error in executor_from_args(args).run(pack_json_files, json_lists, out_paths, sbids, keys=sbids):
+        if error is not None:
+            print(f"Error packing SBID {sbid}: {error}")
+            continue
+        n_cutouts, n_detections, n_errors = result
+        print(f"  {sbid}: {n_cutouts} cutouts, {n_detections} detections, {n_errors} unreadable JSON files")
+
+
+if __name__ == "__main__":
+    main()
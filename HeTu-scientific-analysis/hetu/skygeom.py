@@ -0,0 +1,119 @@
+"""
+Vectorized, RA-wraparound-aware sky geometry shared by the WCS, overlap-removal and
+crossmatch stages. Every function takes scalars or NumPy arrays (broadcasting) in degrees.
+
+RA intervals are represented as (start, width): the interval runs eastwards from `start`
+over `width` degrees and may cross RA = 0/360. Catalog columns keep the
+``bbox_ra_min``/``bbox_ra_max`` pair with both ends in [0, 360); ``ra_min > ra_max`` means
+the box crosses RA = 0.
+"""
+import numpy as np
+
+
+def normalize_ra(ra):
+    """Map RA onto [0, 360)"""
+    return np.mod(ra, 360.0)
+
+
+def ra_delta(ra1, ra2):
+    """Signed RA difference ra1 - ra2 wrapped onto [-180, 180)"""
+    return np.mod(np.asarray(ra1, dtype=np.float64) - ra2 + 180.0, 360.0) - 180.0
+
+
+def ra_distance(ra1, ra2):
+    """Minimum RA separation (0-180 degrees)"""
+    return np.abs(ra_delta(ra1, ra2))
+
+
+def unwrap_ra(ra, ra_ref):
+    """RA expressed within +-180 degrees of a reference, so nearby values are continuous"""
+    return ra_ref + ra_delta(ra, ra_ref)
+
+
+def circular_mean_ra(ra):
+    """Mean RA that respects the 0/360 wrap"""
+    rad = np.radians(np.asarray(ra, dtype=np.float64))
+    return normalize_ra(np.degrees(np.arctan2(np.sin(rad).mean(), np.cos(rad).mean())))
+
+
+def ra_interval(ra_a, ra_b):
+    """Shortest RA interval spanned by two endpoints in any order: returns (start, width)"""
+    start = np.where(ra_delta(ra_b, ra_a) >= 0, ra_a, ra_b)
+    return normalize_ra(start), ra_distance(ra_a, ra_b)
+
+
+def ra_interval_bounds(start, width):
+    """(ra_min, ra_max) columns for an interval; ra_min > ra_max when it crosses RA = 0"""
+    return normalize_ra(start), normalize_ra(np.asarray(start) + width)
+
+
+def interval_from_bounds(ra_min, ra_max):
+    """(start, width) from stored ra_min/ra_max columns (wrap when ra_min > ra_max)"""
+    return normalize_ra(ra_min), np.mod(np.asarray(ra_max, dtype=np.float64) - ra_min, 360.0)
+
+
+def ra_in_interval(ra, start, width):
+    """Whether RA lies inside the wrap-aware interval"""
+    return np.mod(np.asarray(ra, dtype=np.float64) - start, 360.0) <= width
+
+
+def ra_intervals_overlap(start1, width1, start2, width2):
+    """Whether two wrap-aware RA intervals intersect"""
+    return ra_in_interval(start2, start1, width1) | ra_in_interval(start1, start2, width2)
+
+
+def ra_interval_contains(start1, width1, start2, width2):
+    """Whether interval 1 fully contains interval 2"""
+    return ra_in_interval(start2, start1, width1) & (np.mod(np.asarray(start2) - start1, 360.0) + width2 <= width1)
+
+
+def boxes_overlap(ra_min1, ra_max1, dec_min1, dec_max1, ra_min2, ra_max2, dec_min2, dec_max2):
+    """Overlap of sky boxes given as ra_min/ra_max/dec_min/dec_max columns (touching counts)"""
+    s1, w1 = interval_from_bounds(ra_min1, ra_max1)
+    s2, w2 = interval_from_bounds(ra_min2, ra_max2)
+    dec_overlap = (np.asarray(dec_min1) <= dec_max2) & (np.asarray(dec_min2) <= dec_max1)
+    return ra_intervals_overlap(s1, w1, s2, w2) & dec_overlap
+
+
+def box_contains_point(ra_min, ra_max, dec_min, dec_max, ra, dec):
+    """Whether positions fall inside sky boxes"""
+    start, width = interval_from_bounds(ra_min, ra_max)
+    return ra_in_interval(ra, start, width) & (np.asarray(dec) >= dec_min) & (np.asarray(dec) <= dec_max)
+
+
+def angular_distance(ra1, dec1, ra2, dec2):
+    """Great-circle distance in degrees (Vincenty formula, stable at all separations)"""
+    ra1, dec1, ra2, dec2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (ra1, dec1, ra2, dec2))
+    dra = ra2 - ra1
+    num = np.hypot(np.cos(dec2) * np.sin(dra),
+                   np.cos(dec1) * np.sin(dec2) - np.sin(dec1) * np.cos(dec2) * np.cos(dra))
+    den = np.sin(dec1) * np.sin(dec2) + np.cos(dec1) * np.cos(dec2) * np.cos(dra)
+    return np.degrees(np.arctan2(num, den))
+
+
+def tangent_plane_offsets(ra, dec, ra0, dec0):
+    """Gnomonic (xi, eta) offsets in degrees of positions from a tangent point"""
+    ra, dec, ra0, dec0 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (ra, dec, ra0, dec0))
+    dra = ra - ra0
+    cos_c = np.sin(dec0) * np.sin(dec) + np.cos(dec0) * np.cos(dec) * np.cos(dra)
+    xi = np.cos(dec) * np.sin(dra) / cos_c
+    eta = (np.cos(dec0) * np.sin(dec) - np.sin(dec0) * np.cos(dec) * np.cos(dra)) / cos_c
+    return np.degrees(xi), np.degrees(eta)
+
+
+def radec_to_xyz(ra_deg, dec_deg):
+    """Unit vectors (N, 3) for RA/Dec in degrees"""
+    ra = np.radians(np.asarray(ra_deg, dtype=np.float64))
+    dec = np.radians(np.asarray(dec_deg, dtype=np.float64))
+    cos_dec = np.cos(dec)
+    return np.column_stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)])
+
+
+def chord_from_arcsec(radius_arcsec):
+    """Chord length on the unit sphere for an angular radius"""
+    return 2 * np.sin(np.radians(np.asarray(radius_arcsec) / 3600.0) / 2)
+
+
+def arcsec_from_chord(chord):
+    """Angular separation in arcsec for a chord length on the unit sphere"""
+    return np.degrees(2 * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))) * 3600.0
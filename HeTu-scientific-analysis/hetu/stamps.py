@@ -0,0 +1,280 @@
+"""
+Batch postage-stamp extraction from the RACS images for candidate review.
+
+Instead of opening every FITS image by hand, a catalog selection (a CSV file, or a
+catalog directory filtered with hetu.catalog predicates) is turned into stamps in one run:
+  * every detection is assigned to its source image: the image of its SBID when the
+    selection has one (image file names carry the SBID), else the image whose centre is
+    nearest on the sky,
+  * requests are grouped by image and cut into chunks that run on the executor
+    (hetu.executor, process pool by default); each worker keeps an LRU cache of open,
+    memory-mapped image handles, so consecutive chunks of one image reuse the handle
+    (evicted handles are closed, and the rest are closed when the run ends),
+  * only the pixel section of each stamp is read (``hdu.section``), positions are
+    converted with the celestial part of the image WCS, and pixels outside the image
+    are NaN.
+Stamps are written as one (N, size, size) float32 stack in the hetu.shards array-file
+layout (readable with ``hetu.shards.ArrayFile``), and/or as a mosaic PNG contact sheet.
+
+Command line:
+    python -m hetu.stamps /home/ydai240628/analysis_hetu/file/bbox_overlap_removal/output_internimage_0722 \
+        /groups/hetu_ai/home/share/racs-mid-images --where "label==3" --where "score>=0.8" \
+        --size 64 -o frii_candidates.hstamp --png frii_candidates.png
+"""
+import argparse
+import glob
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from hetu.catalog import Catalog, parse_predicate, resolve_column, sbid_from_path
+from hetu.executor import Executor, add_executor_arguments, executor_from_args
+from hetu.shards import concat_strings, write_shard
+
+DEFAULT_SIZE = 64
+CHUNK_STAMPS = 256
+IMAGE_CACHE_SIZE = 8
+STAMP_SUFFIX = '.hstamp'
+
+
+def image_sbid(path):
+    """SBID of an image file: SB<digits> in the name, or an all-digit file name"""
+    sbid = sbid_from_path(path)
+    if sbid is None:
+        stem = os.path.basename(path).split('.')[0]
+        sbid = stem if stem.isdigit() else None
+    return sbid
+
+
+_local = threading.local()
+_caches = []
+_caches_lock = threading.Lock()
+
+
+def _image_cache():
+    """LRU cache of open images for the calling thread"""
+    cache = getattr(_local, 'images', None)
+    if cache is None:
+        cache = _local.images = OrderedDict()
+        with _caches_lock:
+            _caches.append(cache)
+    return cache
+
+
+def open_image(path):
+    """Memory-mapped primary HDU and celestial WCS of one image (cached per worker)
+
+    At most IMAGE_CACHE_SIZE images stay open; the least recently used one is closed
+    when another is opened.
+    """
+    cache = _image_cache()
+    entry = cache.pop(path, None)
+    if entry is None:
+        from astropy.io import fits
+        from astropy.wcs import WCS
+
+        while len(cache) >= IMAGE_CACHE_SIZE:
+            cache.popitem(last=False)[1][0].close()
+        hdul = fits.open(path, memmap=True)
+        hdu = hdul[0]
+        entry = (hdul, hdu, WCS(hdu.header).celestial)
+    cache[path] = entry
+    return entry
+
+
+def close_images():
+    """Close every image still open in this process"""
+    with _caches_lock:
+        for cache in _caches:
+            while cache:
+                cache.popitem()[1][0].close()
+
+
+def extract_stamps(image_path, ra, dec, size=DEFAULT_SIZE):
+    """(N, size, size) float32 stamps centred on the positions; pixels off the image are NaN"""
+    _, hdu, wcs = open_image(image_path)
+    ny, nx = hdu.shape[-2:]
+    lead = (0,) * (len(hdu.shape) - 2)  # degenerate frequency / Stokes axes
+    x, y = wcs.all_world2pix(np.asarray(ra, np.float64), np.asarray(dec, np.float64), 0)
+    stamps = np.full((len(x), size, size), np.nan, dtype=np.float32)
+    x0 = np.round(x).astype(np.int64) - size // 2
+    y0 = np.round(y).astype(np.int64) - size // 2
+    for k in range(len(x)):
+        if not (np.isfinite(x[k]) and np.isfinite(y[k])):
+            continue
+        xa, xb = max(x0[k], 0), min(x0[k] + size, nx)
+        ya, yb = max(y0[k], 0), min(y0[k] + size, ny)
+        if xa >= xb or ya >= yb:
+            continue
+        section = hdu.section[lead + (slice(ya, yb), slice(xa, xb))]
+        stamps[k, ya - y0[k]:yb - y0[k], xa - x0[k]:xb - x0[k]] = section
+    return stamps
+
+
+def image_centres(image_paths):
+    """RA/Dec of the reference pixel of every image, from the headers only"""
+    from astropy.io import fits
+
+    rows = []
+    for path in image_paths:
+        header = fits.getheader(path, 0)
+        rows.append({'image': path, 'ra': header.get('CRVAL1', np.nan), 'dec': header.get('CRVAL2', np.nan)})
+    return pd.DataFrame(rows)
+
+
+def assign_images(selection, image_paths):
+    """Source image of every selected row: by SBID when available, else the nearest image centre
+
+    Rows without a finite RA/Dec, or without any image centre to match, get no image (None)
+    and keep an empty stamp.
+    """
+    by_sbid = {}
+    for path in image_paths:
+        by_sbid.setdefault(image_sbid(path), path)
+    images = pd.Series(None, index=selection.index, dtype=object)
+    if 'SBID' in selection:
+        images = selection['SBID'].astype(str).map(by_sbid)
+    ra, dec = selection['ra'].to_numpy(np.float64), selection['dec'].to_numpy(np.float64)
+    missing = images.isna().to_numpy() & np.isfinite(ra) & np.isfinite(dec)
+    if missing.any() and len(image_paths):
+        from scipy.spatial import cKDTree
+        from hetu.skygeom import radec_to_xyz
+
+        centres = image_centres(image_paths)
+        centres = centres[np.isfinite(centres['ra'].astype(np.float64)) & np.isfinite(centres['dec'].astype(np.float64))]
+        if len(centres):
+            tree = cKDTree(radec_to_xyz(centres['ra'].to_numpy(np.float64), centres['dec'].to_numpy(np.float64)))
+            _, nearest = tree.query(radec_to_xyz(ra[missing], dec[missing]))
+            images[missing] = centres['image'].to_numpy()[nearest]
+    return images
+
+
+def plan_chunks(images, chunk_stamps=CHUNK_STAMPS):
+    """(image, row positions) tasks: rows grouped by image, large groups split into chunks"""
+    tasks = []
+    for image, rows in pd.Series(np.arange(len(images))).groupby(images.to_numpy()):
+        rows = rows.to_numpy()
+        for start in range(0, len(rows), chunk_stamps):
+            tasks.append((image, rows[start:start + chunk_stamps]))
+    return tasks
+
+
+def stamp_stack(selection, image_paths, size=DEFAULT_SIZE, executor=None, chunk_stamps=CHUNK_STAMPS):
+    """Stamps of every selected row in selection order, plus the image each came from"""
+    executor = executor or Executor()
+    images = assign_images(selection, image_paths)
+    tasks = plan_chunks(images, chunk_stamps)
+    ra, dec = selection['ra'].to_numpy(np.float64), selection['dec'].to_numpy(np.float64)
+    stack = np.full((len(selection), size, size), np.nan, dtype=np.float32)
+    if not tasks:
+        return stack, images
+    results = executor.run(extract_stamps, [t[0] for t in tasks], [ra[t[1]] for t in tasks],
+                           [dec[t[1]] for t in tasks], [size] * len(tasks), keys=tasks)
+    try:
+        for (image, rows), stamps, error in results:
+            if error is not None:
+                print(f"Error reading {os.path.basename(image)}: {error}")
+                continue
+            stack[rows] = stamps
+    finally:
+        # serial and thread workers share this process; process workers close theirs on exit
+        close_images()
+    return stack, images
+
+
+def write_stamps(path, stack, selection, images):
+    """Stamp stack plus ra/dec/source image of every stamp, as one mmap-readable array file"""
+    arrays = {
+        'stamps': stack,
+        'ra': selection['ra'].to_numpy(np.float64),
+        'dec': selection['dec'].to_numpy(np.float64),
+    }
+    arrays['images'], arrays['images_offsets'] = concat_strings(images.fillna('').map(os.path.basename))
+    if 'component_id' in selection:
+        arrays['component_ids'], arrays['component_ids_offsets'] = concat_strings(selection['component_id'].astype(str))
+    write_shard(path, arrays, {'n_stamps': len(stack), 'size': stack.shape[-1] if stack.ndim == 3 else 0})
+
+
+def mosaic(stack, ncols=16, gap=2, percentiles=(1.0, 99.5)):
+    """One 2D contact-sheet array of the stamps, each asinh-scaled to [0, 1] by its own percentiles"""
+    n, size = len(stack), stack.shape[-1]
+    nrows = max(1, -(-n // ncols))
+    flat = stack.reshape(n, -1)
+    valid = np.isfinite(flat).any(axis=1)
+    lo = np.zeros(n, dtype=np.float32)
+    hi = np.ones(n, dtype=np.float32)
+    if valid.any():
+        lo[valid], hi[valid] = np.nanpercentile(flat[valid], percentiles, axis=1)
+    span = np.where(hi > lo, hi - lo, 1.0)[:, None, None]
+    scaled = np.arcsinh(np.clip((stack - lo[:, None, None]) / span, 0, 1) * 10) / np.arcsinh(10)
+    # Pad every stamp with the gap and tile the grid in one reshape
+    cells = np.full((nrows * ncols, size + gap, size + gap), np.nan, dtype=np.float32)
+    cells[:n, :size, :size] = scaled
+    sheet = cells.reshape(nrows, ncols, size + gap, size + gap).transpose(0, 2, 1, 3)
+    return sheet.reshape(nrows * (size + gap), ncols * (size + gap))[:-gap or None, :-gap or None]
+
+
+def save_mosaic_png(path, stack, ncols=16, cmap='inferno'):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plt.imsave(path, np.nan_to_num(mosaic(stack, ncols), nan=0.0), cmap=cmap, origin='lower')
+
+
+def load_selection(source, predicates=(), limit=None):
+    """Rows to stamp with logical ra/dec columns (and SBID when known), from a CSV or a catalog directory"""
+    if os.path.isdir(source):
+        df = Catalog(source).where(*predicates).collect(with_sbid=True)
+    else:
+        df = pd.read_csv(source)
+        for pred in map(parse_predicate, predicates):
+            df = df[pred.mask(df[resolve_column(pred.column, df.columns)])]
+        sbid = sbid_from_path(source)
+        if 'SBID' not in df and sbid is not None:
+            df = df.assign(SBID=sbid)
+    rename = {resolve_column(name, df.columns): name for name in ('ra', 'dec')}
+    if None in rename:
+        raise ValueError(f"{source} has no RA/Dec columns")
+    df = df.rename(columns=rename).reset_index(drop=True)
+    return df.head(limit) if limit else df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch postage-stamp extraction from the RACS images')
+    parser.add_argument('selection', help='Catalog CSV, or a directory of per-SBID catalog CSVs')
+    parser.add_argument('image_dir', help='Directory of RACS FITS images')
+    parser.add_argument('--where', action='append', default=[], help="Row predicate such as 'label==3' (repeatable)")
+    parser.add_argument('--limit', type=int, default=None, help='Stamp only the first N selected rows')
+    parser.add_argument('--size', type=int, default=DEFAULT_SIZE, help='Stamp size in pixels (default 64)')
+    parser.add_argument('--image-pattern', default='*.fits', help='Glob pattern of the image files')
+    parser.add_argument('--chunk-stamps', type=int, default=CHUNK_STAMPS, help='Stamps per task')
+    parser.add_argument('-o', '--output', default=None, help=f'Stamp stack array file (*{STAMP_SUFFIX})')
+    parser.add_argument('--png', default=None, help='Mosaic PNG contact sheet')
+    parser.add_argument('--ncols', type=int, default=16, help='Stamps per row of the mosaic')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+
+    start = time.time()
+    selection = load_selection(args.selection, args.where, args.limit)
+    image_paths = sorted(glob.glob(os.path.join(args.image_dir, args.image_pattern)))
+    print(f"Extracting {len(selection)} stamps of {args.size}px from {len(image_paths)} images")
+    stack, images = stamp_stack(selection, image_paths, args.size, executor_from_args(args), args.chunk_stamps)
+    n_empty = int((~np.isfinite(stack).any(axis=(1, 2))).sum()) if len(stack) else 0
+    elapsed = time.time() - start
+    print(f"Done in {elapsed:.1f} s ({len(stack) / max(elapsed, 1e-9) * 60:.0f} stamps/min), "
+          f"{n_empty} stamps entirely off their image")
+    if args.output:
+        write_stamps(args.output, stack, selection, images)
+        print(f"Saved stamp stack to {args.output}")
+    if args.png:
+        save_mosaic_png(args.png, stack, args.ncols)
+        print(f"Saved mosaic to {args.png}")
+
+
+if __name__ == "__main__":
+    main()
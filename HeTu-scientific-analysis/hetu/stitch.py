@@ -0,0 +1,202 @@
+"""
+Stitch extended sources that the fixed detection cutouts split into several fragments.
+
+Detections come from fixed cutouts (one component_id / fits_id per cutout), so a large
+FRI/FRII straddling a cutout edge is found as truncated boxes in each cutout, which the
+greedy overlap removal then drops or keeps as fragments. This stage runs on the WCS
+catalogs (add_wcs_all.py output: pixel bbox, sky bbox and fits_id per row), before the
+overlap removal:
+  * a fragment is a detection whose pixel bbox lies within --margin pixels of an edge of
+    its cutout (cutout sizes from the cutout FITS headers, or --cutout-size),
+  * fragments are bulk-loaded into an R-tree of their sky boxes (RA unwrapped around the
+    field, as in bbox_overlap_removal_all.py, grown by --tolerance arcsec); two fragments
+    of different cutouts are linked when their boxes abut across the shared edge (end to
+    end along one axis within the tolerance, overlapping along the other),
+  * linked fragments are merged as the connected components of that graph (union-find
+    semantics, scipy.sparse.csgraph): one row per component with the sky extent of the
+    union of its boxes, the label and score of its best fragment, n_fragments and the
+    fits_ids of the fragments.
+Rows that are not fragments pass through unchanged (n_fragments = 1). Only edge fragments
+enter the index, and every fragment is queried once, so an SBID costs O(n log n).
+The pixel bbox columns of a stitched row are those of its best fragment (in that
+fragment's cutout frame).
+
+Command line:
+    python -m hetu.stitch wcs_output stitched_output --fits-dir /groups/hetu_ai/home/share/HeTu/cutouts
+    python -m hetu.stitch wcs_output stitched_output --cutout-size 450 --margin 2 --tolerance 10
+"""
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from hetu import skygeom
+from hetu.bbox import bbox_array
+from hetu.catalog import sbid_from_path
+from hetu.executor import add_executor_arguments, executor_from_args
+
+EDGE_MARGIN = 2.0
+TOLERANCE_ARCSEC = 10.0
+SKY_COLUMNS = ['bbox_ra_min', 'bbox_ra_max', 'bbox_dec_min', 'bbox_dec_max']
+
+
+def cutout_sizes(fits_ids, fits_dir):
+    """(NAXIS1, NAXIS2) of every cutout from its FITS header (<fits_dir>/<fits_id>.fits)"""
+    from astropy.io import fits
+
+    sizes = {}
+    for fits_id in fits_ids:
+        path = os.path.join(fits_dir, f"{fits_id}.fits")
+        if os.path.exists(path):
+            header = fits.getheader(path, 0)
+            sizes[fits_id] = (header['NAXIS1'], header['NAXIS2'])
+    return sizes
+
+
+def edge_fragments(df, sizes, margin=EDGE_MARGIN):
+    """Boolean mask of the rows whose pixel bbox touches an edge of its cutout"""
+    xmin, ymin, xmax, ymax = bbox_array(df).astype(np.float64).T
+    nx = np.array([sizes.get(f, (np.nan, np.nan))[0] for f in df['fits_id']], dtype=np.float64)
+    ny = np.array([sizes.get(f, (np.nan, np.nan))[1] for f in df['fits_id']], dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        return ((xmin <= margin) | (ymin <= margin)
+                | (xmax >= nx - 1 - margin) | (ymax >= ny - 1 - margin))
+
+
+def unwrapped_boxes(df):
+    """(N, 4) [ra_left, dec_min, ra_right, dec_max] with RA unwrapped around the field"""
+    ra_start, ra_width = skygeom.interval_from_bounds(df['bbox_ra_min'].to_numpy(np.float64),
+                                                      df['bbox_ra_max'].to_numpy(np.float64))
+    ra_left = skygeom.unwrap_ra(ra_start, skygeom.circular_mean_ra(ra_start))
+    return np.column_stack([ra_left, df['bbox_dec_min'].to_numpy(np.float64), ra_left + ra_width,
+                            df['bbox_dec_max'].to_numpy(np.float64)])
+
+
+def fragment_pairs(boxes, cutouts, tolerance_arcsec=TOLERANCE_ARCSEC):
+    """(i, j) pairs of boxes from different cutouts that abut across a cutout edge
+
+    Two fragments of one source meet along the shared edge: within the tolerance their
+    boxes touch end to end along one axis and overlap along the other.
+    """
+    from rtree import index
+
+    tol = tolerance_arcsec / 3600.0
+    # RA tolerance grows with 1/cos(dec) so it stays an angular distance
+    cos_dec = np.cos(np.radians(np.clip(np.abs(boxes[:, [1, 3]]).max(axis=1), 0.0, 89.0)))
+    tol_ra = tol / cos_dec
+    grown = boxes + np.column_stack([-tol_ra, -tol * np.ones(len(boxes)), tol_ra, tol * np.ones(len(boxes))])
+    idx = index.Index((i, tuple(box), None) for i, box in enumerate(grown.tolist()))
+    pairs = np.array([(i, j) for i, box in enumerate(grown.tolist()) for j in idx.intersection(box) if j > i],
+                     dtype=np.int64).reshape(-1, 2)
+    i, j = pairs[:, 0], pairs[:, 1]
+    a, b = boxes[i], boxes[j]
+    t_ra = np.maximum(tol_ra[i], tol_ra[j])
+    ra_abut = (np.abs(a[:, 2] - b[:, 0]) <= t_ra) | (np.abs(b[:, 2] - a[:, 0]) <= t_ra)
+    dec_abut = (np.abs(a[:, 3] - b[:, 1]) <= tol) | (np.abs(b[:, 3] - a[:, 1]) <= tol)
+    ra_overlap = (a[:, 0] < b[:, 2]) & (b[:, 0] < a[:, 2])
+    dec_overlap = (a[:, 1] < b[:, 3]) & (b[:, 1] < a[:, 3])
+    keep = (cutouts[i] != cutouts[j]) & ((ra_abut & dec_overlap) | (dec_abut & ra_overlap))
+    return pairs[keep]
+
+
+def stitch(df, sizes, margin=EDGE_MARGIN, tolerance_arcsec=TOLERANCE_ARCSEC):
+    """Catalog with the edge fragments of every connected group merged into one row"""
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    df = df.reset_index(drop=True).assign(n_fragments=1, fragment_ids=df['fits_id'].astype(str).to_numpy())
+    fragments = np.flatnonzero(edge_fragments(df, sizes, margin) & df[SKY_COLUMNS].notna().all(axis=1).to_numpy())
+    if len(fragments) < 2:
+        return df, 0
+    boxes = unwrapped_boxes(df.iloc[fragments])
+    pairs = fragment_pairs(boxes, df['fits_id'].to_numpy()[fragments], tolerance_arcsec)
+    if len(pairs) == 0:
+        return df, 0
+    n = len(fragments)
+    graph = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    _, component = connected_components(graph, directed=False)
+    grouped = np.bincount(component)[component] > 1
+    members = pd.DataFrame({'row': fragments[grouped], 'group': component[grouped],
+                            'score': df['score'].to_numpy()[fragments[grouped]]})
+    left, dec_min, right, dec_max = boxes[grouped].T
+    members = members.assign(left=left, dec_min=dec_min, right=right, dec_max=dec_max)
+    extent = members.groupby('group').agg(left=('left', 'min'), right=('right', 'max'),
+                                          dec_min=('dec_min', 'min'), dec_max=('dec_max', 'max'),
+                                          n_fragments=('row', 'size'))
+    best = members.sort_values('score', ascending=False, kind='stable').drop_duplicates('group').set_index('group')['row']
+    ids = members.assign(fits_id=df['fits_id'].astype(str).to_numpy()[members['row']]).groupby('group')['fits_id']
+    extent['fragment_ids'] = ids.agg(lambda s: ';'.join(sorted(set(s))))
+
+    merged = df.iloc[best.loc[extent.index].to_numpy()].copy()
+    width = (extent['right'] - extent['left']).to_numpy()
+    ra_min, ra_max = skygeom.ra_interval_bounds(extent['left'].to_numpy(), width)
+    merged['bbox_ra_min'], merged['bbox_ra_max'] = ra_min, ra_max
+    merged['bbox_dec_min'], merged['bbox_dec_max'] = extent['dec_min'].to_numpy(), extent['dec_max'].to_numpy()
+    if 'bbox_center_ra' in merged:
+        merged['bbox_center_ra'] = skygeom.normalize_ra(extent['left'].to_numpy() + width / 2)
+        merged['bbox_center_dec'] = (extent['dec_min'].to_numpy() + extent['dec_max'].to_numpy()) / 2
+    merged['n_fragments'] = extent['n_fragments'].to_numpy()
+    merged['fragment_ids'] = extent['fragment_ids'].to_numpy()
+    keep = np.ones(len(df), dtype=bool)
+    keep[members['row'].to_numpy()] = False
+    result = pd.concat([df[keep], merged]).sort_index().reset_index(drop=True)
+    return result, len(extent)
+
+
+def process_single_csv(input_file, output_dir, fits_dir=None, cutout_size=None, margin=EDGE_MARGIN,
+                       tolerance_arcsec=TOLERANCE_ARCSEC):
+    """Stitch one WCS catalog; returns (rows in, rows out, stitched groups)"""
+    df = pd.read_csv(input_file)
+    missing = [c for c in SKY_COLUMNS + ['fits_id', 'score'] if c not in df.columns]
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(missing)}")
+    fits_ids = df['fits_id'].astype(str).unique()
+    if fits_dir:
+        sbid = sbid_from_path(input_file)
+        folder = os.path.join(fits_dir, sbid) if sbid and os.path.isdir(os.path.join(fits_dir, sbid)) else fits_dir
+        sizes = cutout_sizes(fits_ids, folder)
+    else:
+        sizes = {f: (cutout_size, cutout_size) for f in fits_ids}
+    df['fits_id'] = df['fits_id'].astype(str)
+    result, n_groups = stitch(df, sizes, margin, tolerance_arcsec)
+    result.to_csv(os.path.join(output_dir, os.path.basename(input_file)), index=False)
+    return len(df), len(result), n_groups
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stitch detections split at cutout edges into single sources')
+    parser.add_argument('input_dir', help='Directory of WCS catalog CSVs (add_wcs_all.py output)')
+    parser.add_argument('output_dir', help='Output directory for the stitched CSVs')
+    parser.add_argument('--fits-dir', default=None,
+                        help='Cutout FITS parent directory (<dir>/<SBID>/<fits_id>.fits) for the cutout sizes')
+    parser.add_argument('--cutout-size', type=int, default=None, help='Cutout size in pixels when all cutouts are square')
+    parser.add_argument('--margin', type=float, default=EDGE_MARGIN, help='Distance to the edge (pixels) of a fragment')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE_ARCSEC,
+                        help='Gap (arcsec) across which fragments of neighbouring cutouts are linked')
+    parser.add_argument('--pattern', default='*.csv', help='Glob pattern of the catalog files')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.fits_dir and not args.cutout_size:
+        parser.error('one of --fits-dir or --cutout-size is required')
+    os.makedirs(args.output_dir, exist_ok=True)
+    csv_files = sorted(glob.glob(os.path.join(args.input_dir, args.pattern)))
+    print(f"Stitching {len(csv_files)} catalogs")
+    n = len(csv_files)
+    totals = np.zeros(3, dtype=np.int64)
+    for path, result, error in executor_from_args(args).run(
+            process_single_csv, csv_files, [args.output_dir] * n, [args.fits_dir] * n, [args.cutout_size] * n,
+            [args.margin] * n, [args.tolerance] * n):
+        if error is not None:
+            print(f"Error processing {os.path.basename(path)}: {error}")
+            continue
+        totals += result
+        n_in, n_out, n_groups = result
+        print(f"  {os.path.basename(path)}: {n_groups} stitched sources, {n_in} -> {n_out} rows")
+    print(f"\nStitched {totals[2]} sources: {totals[0]} -> {totals[1]} rows")
+
+
+if __name__ == "__main__":
+    main()
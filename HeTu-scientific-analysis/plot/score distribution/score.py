@@ -1,10 +1,14 @@
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import glob
 import os
+import sys
 
-def generate_fraction_plot(folder_path, min_score=0.5):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from hetu.batches import Histogram, reduce_batches
+from hetu.catalog import sbid_from_path
+
+def generate_fraction_plot(folder_path, min_score=0.5, budget='256MB'):
     """
     使用 Matplotlib 绘制符合科研标准的 Fraction 分布图
     """
@@ -25,27 +29,17 @@ def generate_fraction_plot(folder_path, min_score=0.5):
         print(f"Error: No CSV files found in '{folder_path}'.")
         return
 
-    # 2. 批量读取数据
-    data_list = []
-    for file_path in all_paths:
-        file_name = os.path.basename(file_path)
-        if file_name in exclude_files:
-            continue
-        try:
-            # 只加载必要的列
-            df = pd.read_csv(file_path, usecols=['label', 'score'])
-            data_list.append(df)
-        except Exception as e:
-            print(f"Skipping {file_name}: {e}")
+    # 2. 分批读取数据：每批固定行数，逐批累加各 label 的直方图，内存不随文件数增长
+    num_bins = 30
+    bins = np.linspace(min_score, 1.0, num_bins + 1)
+    hist = Histogram('score', bins, by='label', budget=budget)
+    exclude_sbids = {sbid_from_path(name) for name in exclude_files}
+    reduce_batches(folder_path, [hist], predicates=[f'score>={min_score}', 'score<=1.0'], exclude_sbids=exclude_sbids)
 
-    if not data_list:
+    if not hist.counts:
         print("Error: No data to plot after filtering.")
         return
 
-    full_df = pd.concat(data_list, ignore_index=True)
-    # 过滤 score 区间
-    filtered_df = full_df[(full_df['score'] >= min_score) & (full_df['score'] <= 1.0)]
-
     # 3. 设置科研绘图风格
     plt.rcParams.update({
         'font.size': 12,
@@ -64,28 +58,24 @@ def generate_fraction_plot(folder_path, min_score=0.5):
     label_map = {0: 'CJ', 1: 'CS', 2: 'FRI', 3: 'FRII'}
     
     # 获取唯一的标签并排序
-    unique_labels = sorted(filtered_df['label'].unique())
+    unique_labels = sorted(hist.counts)
     
     # 使用专业的色彩循环
     colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728']
 
     # 4. 绘图逻辑：阶梯状直方图 (无填充)
-    # 增加 bin 数量到 50，让图像更平滑
-    num_bins = 30
-    bins = np.linspace(min_score, 1.0, num_bins + 1)
-
     for idx, label_id in enumerate(unique_labels):
-        subset = filtered_df[filtered_df['label'] == label_id]['score']
-        if subset.empty:
+        n_label = hist.n[label_id]
+        if n_label == 0:
             continue
         
         # 获取映射后的名称
         display_name = label_map.get(label_id, f'Label {label_id}')
 
         # 绘制阶梯直方图边缘线
-        # density=False, weights=np.ones/len(subset) 用于手动计算 Fraction
-        plt.hist(subset, bins=bins, 
-                 weights=np.ones(len(subset)) / len(subset),
+        # 每个 bin 的计数 / 该 label 总数 = Fraction（与逐行 weights=1/len(subset) 相同）
+        plt.hist(bins[:-1], bins=bins, 
+                 weights=hist.total(label_id) / n_label,
                  histtype='step', 
                  linewidth=2, 
                  label=display_name, 
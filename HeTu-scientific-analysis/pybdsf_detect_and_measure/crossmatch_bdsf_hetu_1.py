@@ -1,42 +1,48 @@
+import os
+import sys
 import pandas as pd
-from astropy.coordinates import SkyCoord
-import astropy.units as u
-
-# 读入数据
-df1 = pd.read_csv("/home/ydai240628/analysis_hetu/file/bbox_overlap_removal/output_internimage_0722/processed_wcs_20376.csv")
-df2 = pd.read_csv("/home/ydai240628/analysis_hetu/file/match_bdsf_hetu/matched_bdsf_racs_srl_20arcsec.csv", comment='#', sep=',')
-df2.columns = df2.columns.str.strip()
-
-# 转换为天球坐标
-coords1 = SkyCoord(ra=df1['bbox_center_ra'].values * u.deg,
-                   dec=df1['bbox_center_dec'].values * u.deg)
-coords2 = SkyCoord(ra=df2['RA'].values * u.deg,
-                   dec=df2['DEC'].values * u.deg)
-
-# 在 40″ 内搜索匹配
-idx1, idx2, d2d, d3d = coords1.search_around_sky(coords2, 20 * u.arcsec)
-
-# 所有匹配结果
-matches = pd.DataFrame({
-    'df1_index': idx2,
-    'df2_index': idx1,
-    'sep_arcsec': d2d.arcsec
-})
-
-# 只保留每个 df1 最近的匹配
-nearest = matches.loc[matches.groupby('df1_index')['sep_arcsec'].idxmin()].reset_index(drop=True)
-
-# 合并匹配结果，只保留匹配到的 df2 数据
-result = df1.loc[nearest['df1_index']].reset_index(drop=True)
-result = result.join(
-    df2.add_prefix('df2_').iloc[nearest['df2_index']].reset_index(drop=True)
-)
-
-# 加上匹配的角距离和 Isl_id 标识
-result['sep_arcsec'] = nearest['sep_arcsec']
-result['matched_id'] = result['df2_Isl_id']
-
-# 保存结果
-out_path = "/home/ydai240628/analysis_hetu/file/match_bdsf_hetu/matched_hetu_bdsf_racs_20arcsec.csv"
-result.to_csv(out_path, index=False)
-print(f"匹配结果已保存为 {out_path}")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hetu.lrmatch import lr_match, sigma_from_columns, summarize
+
+
+def main():
+    """Likelihood-ratio crossmatch of one HeTu catalog against the PyBDSF sources"""
+    # 读入数据
+    df1 = pd.read_csv("/home/ydai240628/analysis_hetu/file/bbox_overlap_removal/output_internimage_0722/processed_wcs_20376.csv")
+    df2 = pd.read_csv("/home/ydai240628/analysis_hetu/file/match_bdsf_hetu/matched_bdsf_racs_srl_20arcsec.csv", comment='#', sep=',')
+    df2.columns = df2.columns.str.strip()
+
+    # 位置误差（角秒）：HeTu bbox 中心取常数，PyBDSF 使用 E_RA/E_DEC（单位：度）
+    sigma_hetu = 5.0
+    sigma_bdsf = sigma_from_columns(df2, 'E_RA,E_DEC', 'deg', 2.0)
+
+    # 在 20″ 内搜索所有候选对，计算似然比 (LR) 和可靠度
+    pairs, q = lr_match(df1['bbox_center_ra'], df1['bbox_center_dec'], df2['RA'], df2['DEC'],
+                        sigma1=sigma_hetu, sigma2=sigma_bdsf, radius_arcsec=20.0)
+    summary = summarize(pairs, q, len(df1))
+    print(f"Q = {q:.3f}, 匹配数 = {summary['n_matched']}, 预计误匹配数 = {summary['expected_false']:.1f}")
+
+    # 只保留每个 df1 LR 最高的匹配
+    nearest = pairs[pairs['is_best']].reset_index(drop=True)
+
+    # 合并匹配结果，只保留匹配到的 df2 数据
+    result = df1.loc[nearest['idx1']].reset_index(drop=True)
+    result = result.join(
+        df2.add_prefix('df2_').iloc[nearest['idx2']].reset_index(drop=True)
+    )
+
+    # 加上匹配的角距离、LR、可靠度和 Isl_id 标识
+    result['sep_arcsec'] = nearest['sep_arcsec']
+    result['lr'] = nearest['lr']
+    result['reliability'] = nearest['reliability']
+    result['matched_id'] = result['df2_Isl_id']
+
+    # 保存结果
+    out_path = "/home/ydai240628/analysis_hetu/file/match_bdsf_hetu/matched_hetu_bdsf_racs_20arcsec.csv"
+    result.to_csv(out_path, index=False)
+    print(f"匹配结果已保存为 {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,14 +13,6 @@ import os
 import sys
 import argparse
 from pathlib import Path
-import numpy as np
-from astropy.io import fits
-
-try:
-    import bdsf
-except Exception as e:
-    print("ERROR: cannot import pybdsf (bdsf). Please install with: pip install pybdsf", file=sys.stderr)
-    raise
 
 
 def parse_args():
@@ -44,6 +36,8 @@ def ensure_outdir(path):
 
 def read_beam_and_cdelt(fitsfile):
     """读取 PSF BMIN 和像素大小 CDELT1"""
+    from astropy.io import fits
+
     with fits.open(fitsfile) as hdul:
         hdr = hdul[0].header
         bmin_deg = hdr.get('BMIN')    # BMIN 通常是度
@@ -79,6 +73,13 @@ def main():
     if args.verb:
         print(f"rms_box (box, step) = ({box_pix}, {step_pix}) pixels")
 
+    # bdsf 只在真正运行时导入 (--help 和参数错误不需要它)
+    try:
+        import bdsf
+    except Exception:
+        print("ERROR: cannot import pybdsf (bdsf). Please install with: pip install pybdsf", file=sys.stderr)
+        raise
+
     print("Running PyBDSF with PSF-scaled rms_box and atrous wavelet...")
 
     img = bdsf.process_image(
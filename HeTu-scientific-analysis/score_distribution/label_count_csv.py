@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import csv
 import logging
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hetu.executor import Executor
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -55,20 +59,20 @@ def main():
     # Initialize the result list
     results = []
 
-    # Iterate through all CSV files in the directory
-    for filename in os.listdir(base_path):
-        if filename.endswith('.csv'):
-            # Extract the XXX number name
-            sbid = os.path.splitext(filename)[0]
-
-            # Count the labels
-            file_path = os.path.join(base_path, filename)
-            label_counts = count_labels_in_csv(file_path)
+    # Count the labels of all CSV files in the directory, one task per file
+    filenames = [f for f in os.listdir(base_path) if f.endswith('.csv')]
+    file_paths = [os.path.join(base_path, f) for f in filenames]
+    for filename, label_counts, error in Executor().run(count_labels_in_csv, file_paths, keys=filenames):
+        if error is not None:
+            logging.error(f"Error occurred while counting {filename}: {error}")
+            continue
+        # Extract the XXX number name
+        sbid = os.path.splitext(filename)[0]
 
-            # Build the result row
-            result_row = {'SBID': sbid}
-            result_row.update(label_counts)
-            results.append(result_row)
+        # Build the result row
+        result_row = {'SBID': sbid}
+        result_row.update(label_counts)
+        results.append(result_row)
 
     # Write the results to a new CSV file
     write_results_to_csv(results, output_path)
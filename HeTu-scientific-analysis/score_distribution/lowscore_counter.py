@@ -1,26 +1,37 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hetu.executor import Executor
 
-def count_low_scores(folder_path):
+
+def count_low_scores_file(folder_path, filename):
+    """低分 (score < 0.1) 检测数及比例；没有 score 列时返回 None"""
+    df = pd.read_csv(os.path.join(folder_path, filename))
+    if 'score' not in df.columns:
+        return None
+    total_count = len(df['score'])
+    low_score_count = (df['score'] < 0.1).sum()
+    low_score_ratio = low_score_count / total_count if total_count > 0 else 0
+    return {
+        'filename': filename,
+        'low_score_count': low_score_count,
+        'low_score_ratio': low_score_ratio
+    }
+
+
+def count_low_scores(folder_path, executor=None):
     results = []
-    for filename in os.listdir(folder_path):
-        if filename.endswith('.csv'):
-            file_path = os.path.join(folder_path, filename)
-            try:
-                df = pd.read_csv(file_path)
-                if 'score' in df.columns:
-                    total_count = len(df['score'])
-                    low_score_count = (df['score'] < 0.1).sum()
-                    low_score_ratio = low_score_count / total_count if total_count > 0 else 0
-                    results.append({
-                        'filename': filename,
-                        'low_score_count': low_score_count,
-                        'low_score_ratio': low_score_ratio
-                    })
-            except Exception as e:
-                print(f"处理文件 {filename} 时出错: {e}")
+    filenames = [f for f in os.listdir(folder_path) if f.endswith('.csv')]
+    executor = executor or Executor()
+    for filename, result, error in executor.run(count_low_scores_file, [folder_path] * len(filenames), filenames,
+                                                keys=filenames):
+        if error is not None:
+            print(f"处理文件 {filename} 时出错: {error}")
+        elif result is not None:
+            results.append(result)
     return results
 
 
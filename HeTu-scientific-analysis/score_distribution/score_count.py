@@ -1,11 +1,14 @@
 import os
-import pandas as pd
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hetu.batches import Histogram, MinMax, reduce_batches
 
-def read_csv_files(path):
-    scores = []
+
+def read_csv_files(path, min_score=0.3, num_bins=50, budget='256MB'):
+    """Score histogram (score >= min_score, 50 bins over the data range) of every CSV under path, read in batches"""
     # 需排除的CSV文件名列表（注意带.csv后缀）
     excluded_files = [
         '20161.csv', '20171.csv', '20172.csv', '20175.csv', '20776.csv',
@@ -16,32 +19,37 @@ def read_csv_files(path):
         '20640.csv', '20306.csv', '20534.csv', '20615.csv',
         '33090.csv'
     ]
-    
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            if file.endswith('.csv') and file not in excluded_files:
-                file_path = os.path.join(root, file)
-                df = pd.read_csv(file_path)
-                scores.extend(df['score'].tolist())
-    return scores
-
+    files = []
+    for root, dirs, names in os.walk(path):
+        for name in sorted(names):
+            if name.endswith('.csv') and name not in excluded_files:
+                files.append(os.path.join(root, name))
 
-def filter_scores(scores):
-    return [score for score in scores if score >= 0.3]
+    # 第一遍只求 score 的范围（与 plt.hist(bins=50) 相同的分箱），第二遍逐批累加直方图和均值
+    predicates = [f'score>={min_score}']
+    extent = MinMax('score', budget=budget)
+    reduce_batches(files, [extent], predicates=predicates)
+    if extent.min > extent.max:
+        return Histogram('score', np.linspace(min_score, 1.0, num_bins + 1), budget=budget)
+    hist = Histogram('score', np.histogram_bin_edges([extent.min, extent.max], bins=num_bins), budget=budget)
+    reduce_batches(files, [hist], predicates=predicates)
+    return hist
 
 
-def plot_histogram_and_midpoints(scores):
+def plot_histogram_and_midpoints(hist):
     plt.figure(figsize=(12, 8))
     
-    # 绘制直方图
-    n, bins, patches = plt.hist(scores, bins=50, density=True, alpha=0.6, color='g', label='Histogram')
+    # 绘制直方图（由分批累加的计数归一化为密度）
+    bins = hist.edges
+    n = hist.total() / (hist.total().sum() * np.diff(bins))
+    plt.hist(bins[:-1], bins=bins, weights=n, alpha=0.6, color='g', label='Histogram')
     
     # 计算直方图中点并连线
     bin_centers = (bins[:-1] + bins[1:]) / 2
     plt.plot(bin_centers, n, 'b-o', linewidth=2, markersize=6, label='Midpoints Connection')
     
     # 计算并标记平均得分
-    mean_score = np.mean(scores)
+    mean_score = hist.mean()
     plt.axvline(x=mean_score, color='k', linestyle='--', linewidth=2, 
                 label=f'Mean Score: {mean_score:.4f}')
     
@@ -63,14 +71,13 @@ def plot_histogram_and_midpoints(scores):
 if __name__ == "__main__":
     # 替换为您提供的路径
     path = '/home/ydai240628/analysis_hetu/code/only_label/output_internimage_0722/'
-    all_scores = read_csv_files(path)
-    filtered_scores = filter_scores(all_scores)
+    hist = read_csv_files(path, min_score=0.3)
     
-    if not filtered_scores:
+    if hist.total().sum() == 0:
         print("No valid scores after filtering.")
     else:
         try:
-            plot_histogram_and_midpoints(filtered_scores)
-            print(f"Average Score: {np.mean(filtered_scores):.4f}")
+            plot_histogram_and_midpoints(hist)
+            print(f"Average Score: {hist.mean():.4f}")
         except Exception as e:
-            print(f"An error occurred: {e}")
\ No newline at end of file
+            print(f"An error occurred: {e}")
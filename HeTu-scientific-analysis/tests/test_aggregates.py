@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from hetu.aggregates import AggregateStore
+from hetu.catalog import Catalog
+from hetu.executor import Executor
+
+
+def write_catalog(path, seed, n=400):
+    rng = np.random.default_rng(seed)
+    pd.DataFrame({'component_id': [f'J{seed}_{k // 3}' for k in range(n)], 'label': rng.integers(0, 4, n),
+                  'score': rng.uniform(0, 1, n), 'ra': rng.uniform(0, 40, n),
+                  'dec': rng.uniform(-40, 0, n)}).to_csv(path, index=False)
+
+
+def rebuild(directory, excluded):
+    store = AggregateStore(order=3)
+    store.set_excluded(excluded)
+    store.update(Catalog(directory).files(), Executor('serial'))
+    return store
+
+
+def test_incremental_updates_match_a_rebuild(tmp_path):
+    directory = str(tmp_path)
+    for seed in (101, 102, 103, 104):
+        write_catalog(tmp_path / f'{seed}.csv', seed)
+    state = str(tmp_path / 'state.npz')
+    store = AggregateStore(order=3)
+    store.update(Catalog(directory).files(), Executor('serial'))
+    store.save(state)
+
+    store = AggregateStore.load(state)
+    store.set_excluded(['102'])
+    write_catalog(tmp_path / '103.csv', 7, n=250)
+    os.utime(tmp_path / '103.csv', ns=(1, 1))
+    os.remove(tmp_path / '104.csv')
+    write_catalog(tmp_path / '105.csv', 105)
+    n_new, n_gone = store.update(Catalog(directory).files(), Executor('serial'))
+    assert (n_new, n_gone) == (2, 1)
+    store.set_excluded(['101'])
+    store.save(state)
+    store = AggregateStore.load(state)
+
+    fresh = rebuild(directory, ['101'])
+    assert store.check() and fresh.check()
+    assert sorted(store.fields) == sorted(fresh.fields) == ['101', '102', '103', '105']
+    assert np.array_equal(store.score_hist, fresh.score_hist)
+    assert np.array_equal(store.map, fresh.map)
+    pd.testing.assert_frame_equal(store.per_sbid_counts(), fresh.per_sbid_counts())
+    assert store.score_hist.sum() == 400 + 250 + 400
+
+    store.score_hist[0, 0] += 1
+    assert not store.check()
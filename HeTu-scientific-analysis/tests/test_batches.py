@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+from hetu.batches import BatchReader, Histogram, ValueCounts, parse_size, reduce_batches
+
+
+def write_catalogs(directory, n_files=5, n_rows=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for k in range(n_files):
+        df = pd.DataFrame({'ra': rng.uniform(0, 360, n_rows), 'dec': rng.uniform(-80, 30, n_rows),
+                           'score': rng.random(n_rows), 'label': rng.integers(0, 4, n_rows)})
+        df.to_csv(directory / f"{20100 + k}.csv", index=False)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_parse_size():
+    assert parse_size('256MB') == 256 * 1024 ** 2
+    assert parse_size('2G') == 2 * 1024 ** 3
+    assert parse_size(1000) == 1000
+
+
+def test_fixed_size_downcast_batches(tmp_path):
+    full = write_catalogs(tmp_path)
+    batches = list(BatchReader(str(tmp_path), ['ra', 'score', 'label'], ['score>=0.5'], batch_rows=1000))
+    assert all(len(b) == 1000 for b in batches[:-1]) and 0 < len(batches[-1]) <= 1000
+    assert sum(map(len, batches)) == (full['score'] >= 0.5).sum()
+    assert batches[0]['score'].dtype == np.float32
+    assert batches[0]['ra'].dtype == np.float64
+    assert batches[0]['label'].dtype == np.int8
+
+
+def test_consumers_match_in_memory_reduction(tmp_path):
+    full = write_catalogs(tmp_path)
+    edges = np.linspace(0.5, 1.0, 31)
+    hist, counts = Histogram('score', edges, by='label'), ValueCounts('label')
+    reduce_batches(str(tmp_path), [hist, counts], predicates=['score>=0.5'], batch_rows=1000)
+    selected = full[full['score'] >= 0.5]
+    for label, group in selected.groupby('label'):
+        assert np.array_equal(hist.total(label), np.histogram(group['score'], edges)[0])
+    assert counts.result().to_dict() == selected['label'].value_counts().to_dict()
+
+
+def test_malformed_file_is_skipped(tmp_path, capsys):
+    full = write_catalogs(tmp_path)
+    (tmp_path / '20999.csv').write_text('ra,dec,score,label\n1,2,0.7,1\n"unterminated,3\n')
+    hist = Histogram('score', np.linspace(0.0, 1.0, 11))
+    reduce_batches(str(tmp_path), [hist], batch_rows=1000)
+    assert hist.n[None] == len(full)
+    assert 'Skipping 20999.csv' in capsys.readouterr().out
+
+
+def test_histogram_keeps_values_on_bin_edges(tmp_path):
+    edges = np.linspace(0.3, 1.0, 51)
+    # Values on the edges, which float32 rounding would move into a neighbouring bin
+    scores = np.repeat(edges[:-1], 3)
+    pd.DataFrame({'score': scores, 'label': 0}).to_csv(tmp_path / '20100.csv', index=False)
+    hist = Histogram('score', edges)
+    reduce_batches(str(tmp_path), [hist], batch_rows=1000)
+    assert np.array_equal(hist.total(), np.histogram(pd.read_csv(tmp_path / '20100.csv')['score'], edges)[0])
+
+
+def test_score_count_matches_the_in_memory_histogram(tmp_path):
+    import importlib.util
+    import os
+
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'score_distribution',
+                        'score_count.py')
+    spec = importlib.util.spec_from_file_location('score_count', path)
+    score_count = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(score_count)
+
+    rng = np.random.default_rng(4)
+    (tmp_path / 'late').mkdir()
+    names = ['20100.csv', '20101.csv', 'late/20102.csv', 'late/20161.csv']  # 20161 is excluded
+    for name in names:
+        pd.DataFrame({'score': rng.random(2000), 'label': rng.integers(0, 4, 2000)}).to_csv(tmp_path / name,
+                                                                                              index=False)
+    hist = score_count.read_csv_files(str(tmp_path), min_score=0.3)
+
+    scores = pd.concat([pd.read_csv(tmp_path / name) for name in names[:3]])['score']
+    scores = scores[scores >= 0.3]
+    counts, edges = np.histogram(scores, bins=50)
+    assert np.array_equal(hist.edges, edges)
+    assert np.array_equal(hist.total(), counts)
+    assert np.isclose(hist.mean(), scores.mean())
@@ -0,0 +1,60 @@
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from hetu.bbox import BBOX_COLUMNS, bbox_array, bbox_usecols, main, parse_bbox_strings, validate_bboxes, with_bbox_columns
+
+
+def catalogs(rng, n=200):
+    x, y = np.sort(rng.uniform(0, 128, (2, n, 2)), axis=2)
+    boxes = np.column_stack([x[:, 0], y[:, 0], x[:, 1], y[:, 1]]).astype(np.float32)
+    typed = pd.DataFrame(boxes, columns=BBOX_COLUMNS).assign(score=rng.uniform(0, 1, n))
+    legacy = pd.DataFrame({'bbox': [str(list(map(float, b))) for b in boxes], 'score': typed['score']})
+    return boxes, typed, legacy
+
+
+def test_legacy_strings_match_typed_columns(tmp_path):
+    boxes, typed, legacy = catalogs(np.random.default_rng(3))
+    typed.to_csv(tmp_path / 'typed.csv', index=False)
+    legacy.to_csv(tmp_path / 'legacy.csv', index=False)
+    typed, legacy = pd.read_csv(tmp_path / 'typed.csv'), pd.read_csv(tmp_path / 'legacy.csv')
+
+    assert bbox_usecols(typed.columns) == BBOX_COLUMNS and bbox_usecols(legacy.columns) == ['bbox']
+    from_typed, from_legacy = bbox_array(typed), bbox_array(legacy)
+    assert from_typed.dtype == from_legacy.dtype == np.float32
+    np.testing.assert_array_equal(from_typed, boxes)
+    np.testing.assert_array_equal(from_legacy, boxes)
+
+    converted = with_bbox_columns(legacy)
+    assert converted.columns.tolist() == BBOX_COLUMNS + ['score']
+    np.testing.assert_array_equal(bbox_array(converted), boxes)
+    with pytest.raises(KeyError):
+        bbox_array(typed[['score']])
+
+
+def test_malformed_legacy_strings_become_nan():
+    values = ['[1, 2, 3, 4]', ' (5.5,6e1, 7 ,8) ', '[1, 2, 3]', '[1, 2, 3, 4, 5]', '[a, 2, 3, 4]', '', np.nan, None]
+    out = parse_bbox_strings(values)
+    np.testing.assert_array_equal(out[:2], [[1, 2, 3, 4], [5.5, 60, 7, 8]])
+    assert np.isnan(out[2:]).all(axis=1).tolist() == [True, True, False, True, True, True]
+    assert np.isnan(out[4, 0]) and out[4, 1:].tolist() == [2, 3, 4]
+    assert np.isnan(parse_bbox_strings(['', 'nan'])).all()
+
+
+def test_validate_bboxes():
+    boxes = np.array([[0, 0, 1, 1], [-1, 0, 1, 1], [0, 0, 0, 1], [2, 0, 1, 1], [0, 0, np.inf, 1], [0, np.nan, 1, 1]],
+                     dtype=np.float32)
+    assert validate_bboxes(boxes).tolist() == [True, False, False, False, False, False]
+
+
+def test_main_rewrites_legacy_csvs(tmp_path, monkeypatch):
+    boxes, _, legacy = catalogs(np.random.default_rng(4), n=20)
+    (tmp_path / 'in').mkdir()
+    legacy.to_csv(tmp_path / 'in' / 'processed_wcs_101.csv', index=False)
+    monkeypatch.setattr(sys, 'argv', ['bbox', str(tmp_path / 'in'), str(tmp_path / 'out')])
+    main()
+    out = pd.read_csv(tmp_path / 'out' / 'processed_wcs_101.csv')
+    assert 'bbox' not in out.columns
+    np.testing.assert_array_equal(bbox_array(out), boxes)
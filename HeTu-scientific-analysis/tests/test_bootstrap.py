@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hetu.bootstrap import bootstrap_labels, bootstrap_ratios, label_statistics, resample_cells
+from hetu.executor import Executor
+from hetu.results import ResultsWriter, make_record, read_results
+
+EXECUTORS = [Executor('serial'), Executor('threads', workers=3), Executor('processes', workers=2),
+             Executor('processes', workers=4)]
+
+
+def score_hist(n_fields=12, n_labels=4, n_bins=20):
+    rng = np.random.default_rng(9)
+    return rng.poisson(rng.uniform(0, 30, (n_labels, n_bins)), (n_fields, n_labels, n_bins))
+
+
+def ratio_results(directory):
+    rng = np.random.default_rng(10)
+    table = str(directory / 'results.csv')
+    with ResultsWriter(table) as writer:
+        for model in ('resnet', 'internimage'):
+            for sbid in range(101, 111):
+                for label in (None, 2, 3):
+                    total = int(rng.integers(20, 200))
+                    writer.append(make_record(str(sbid), model, int(rng.binomial(total, 0.7)), total, label=label))
+    return read_results(table)
+
+
+def test_label_intervals_do_not_depend_on_the_executor():
+    hist = score_hist()
+    reference = bootstrap_labels(hist, min_score=0.5, n_boot=600, seed=3)
+    for executor in EXECUTORS:
+        labels, bins = bootstrap_labels(hist, min_score=0.5, n_boot=600, seed=3, executor=executor)
+        pd.testing.assert_frame_equal(labels, reference[0])
+        pd.testing.assert_frame_equal(bins, reference[1])
+    other = bootstrap_labels(hist, min_score=0.5, n_boot=600, seed=4)[0]
+    assert not np.array_equal(other['count_lo'], reference[0]['count_lo'])
+
+
+def test_ratio_intervals_do_not_depend_on_the_executor(tmp_path):
+    results = ratio_results(tmp_path)
+    reference = bootstrap_ratios(results, n_boot=600, seed=3)
+    assert len(reference) == 6 and reference['n_sbids'].eq(10).all()
+    for executor in EXECUTORS:
+        pd.testing.assert_frame_equal(bootstrap_ratios(results, n_boot=600, seed=3, executor=executor), reference)
+
+
+def test_label_intervals_bracket_the_point_values():
+    hist = score_hist()
+    labels, bins = bootstrap_labels(hist, min_score=0.5, n_boot=400, seed=1)
+    above = hist.sum(axis=0)[:, 10:]
+    assert labels['count'].tolist() == above.sum(axis=1).tolist()
+    np.testing.assert_allclose(labels['fraction'], above.sum(axis=1) / above.sum())
+    assert ((labels['count_lo'] <= labels['count']) & (labels['count'] <= labels['count_hi'])).all()
+    assert ((labels['fraction_lo'] <= labels['fraction']) & (labels['fraction'] <= labels['fraction_hi'])).all()
+    assert len(bins) == 4 * 10 and bins['score_min'].iloc[0] == 0.5
+    np.testing.assert_allclose(bins.groupby('label')['fraction'].sum(), 1.0)
+
+    # Without resampling every replicate is the observed histogram
+    fixed, _ = bootstrap_labels(hist, min_score=0.5, n_boot=50, resample_fields=False, resample_detections=False)
+    assert (fixed['count_lo'] == fixed['count']).all() and (fixed['count_std'] == 0).all()
+
+
+def test_resampled_cells_keep_totals():
+    cells = score_hist().reshape(12, -1)
+    fields_only = resample_cells(cells, 200, 0, resample_detections=False)
+    # Each replicate is a sum of 12 whole fields
+    assert fields_only.shape == (200, cells.shape[1]) and fields_only.sum(axis=1).min() >= cells.sum(axis=1).min() * 12
+    detections_only = resample_cells(cells, 200, 0, resample_fields=False)
+    assert (detections_only.sum(axis=1) == cells.sum()).all()
+    np.testing.assert_allclose(detections_only.mean(axis=0), cells.sum(axis=0), rtol=0.05, atol=5)
+
+    counts, fractions, _ = label_statistics(detections_only.reshape(200, 4, 20), 10)
+    np.testing.assert_allclose(fractions.sum(axis=1), 1.0)
+
+
+def test_ratio_point_values(tmp_path):
+    results = ratio_results(tmp_path)
+    table = bootstrap_ratios(results, n_boot=200, seed=0).set_index(['model', 'label'])
+    expected = results.groupby(['model', results['label'].fillna(-1)])[['matched', 'total']].sum()
+    for (model, label), row in expected.iterrows():
+        got = table.loc[(model, pd.NA if label < 0 else label)]
+        assert (got['matched'], got['total']) == (row['matched'], row['total'])
+        assert got['ratio'] == pytest.approx(row['matched'] / row['total'])
+        assert got['ratio_lo'] <= got['ratio'] <= got['ratio_hi']
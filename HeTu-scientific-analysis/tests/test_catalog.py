@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+from hetu.catalog import Catalog, col
+
+
+def write_catalogs(directory):
+    rng = np.random.default_rng(5)
+    frames = []
+    for sbid in ('101', '102', '103'):
+        n = 500
+        df = pd.DataFrame({'component_id': [f'J{sbid}_{k}' for k in range(n)],
+                           'label': rng.integers(0, 4, n).astype(float), 'score': rng.uniform(0, 1, n),
+                           'ra': rng.uniform(0, 10, n), 'dec': rng.uniform(-5, 5, n)})
+        df.loc[rng.random(n) < 0.1, 'label'] = np.nan
+        df.loc[rng.random(n) < 0.05, 'score'] = np.nan
+        df.to_csv(directory / f'{sbid}.csv', index=False)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_count_matches_collect_with_missing_values(tmp_path):
+    full = write_catalogs(tmp_path)
+    catalog = Catalog(str(tmp_path))
+    cases = [
+        ([col.label != 3], full['label'] != 3),
+        ([col.label != 3, col.score >= 0.5], (full['label'] != 3) & (full['score'] >= 0.5)),
+        ([col.score >= 0.5], full['score'] >= 0.5),
+        ([col.label.isin([0, 1])], full['label'].isin([0, 1])),
+    ]
+    assert catalog.query().count() == len(full)
+    for predicates, expected in cases:
+        query = catalog.where(*predicates)
+        assert query.count() == expected.sum() == len(query.collect())
+
+
+def test_stores_skip_files_without_or_repeating_an_sbid(tmp_path, capsys):
+    from hetu.aggregates import AggregateStore
+    from hetu.anomaly import SketchStore
+    from hetu.ensemble import model_files
+    from hetu.executor import Executor
+
+    full = write_catalogs(tmp_path)
+    full[full['component_id'].str.startswith('J101')].to_csv(tmp_path / 'processed_wcs_101.csv', index=False)
+    full.head(10).to_csv(tmp_path / 'notes.csv', index=False)
+    files = Catalog(str(tmp_path)).files()
+
+    sketches = SketchStore()
+    sketches.update(files, Executor('serial'))
+    sketches.save(str(tmp_path / 'sketches.npz'))
+    aggregates = AggregateStore(order=2)
+    aggregates.update(files, Executor('serial'))
+    assert sorted(sketches.sketches) == sorted(aggregates.fields) == ['101', '102', '103']
+    assert aggregates.check()
+    # Detections with a missing score or label are left out of those counts, not the whole SBID
+    for sbid, rows in full.groupby(full['component_id'].str[1:4]):
+        sketch = sketches.sketches[sbid]
+        assert sketch.score_hist.sum() == rows['score'].notna().sum()
+        assert sketch.label_counts.sum() == rows['label'].notna().sum()
+        assert aggregates.fields[sbid].n_detections == (rows['score'].notna() & rows['label'].notna()).sum()
+    assert sorted(model_files(str(tmp_path))) == ['101', '102', '103']
+    out = capsys.readouterr().out
+    assert 'Skipping notes.csv: no SBID in the file name' in out
+    assert 'Skipping processed_wcs_101.csv: SBID 101 already read from 101.csv' in out
+
+
+def test_crossmatch_pairs_skip_files_without_or_repeating_an_sbid(tmp_path, capsys):
+    from hetu.crossmatch import pair_catalogs
+
+    racs, hetu = tmp_path / 'racs', tmp_path / 'hetu'
+    racs.mkdir()
+    hetu.mkdir()
+    for name in ('RACS_SB101_components.csv', 'RACS_SB102_components.csv', 'readme.csv'):
+        (racs / name).write_text('ra,dec\n')
+    for name in ('101.csv', 'processed_wcs_101.csv', '102.csv', 'notes.csv'):
+        (hetu / name).write_text('ra,dec\n')
+    pairs = pair_catalogs(str(racs), str(hetu))
+    assert list(pairs) == ['101', '102']
+    assert pairs['101'] == (str(racs / 'RACS_SB101_components.csv'), str(hetu / '101.csv'))
+    out = capsys.readouterr().out
+    assert 'Skipping readme.csv' in out and 'Skipping processed_wcs_101.csv' in out
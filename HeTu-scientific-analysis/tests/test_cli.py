@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_script_command_with_worker_processes(tmp_path):
+    input_dir, output_dir = tmp_path / 'wcs_output', tmp_path / 'dedup'
+    input_dir.mkdir()
+    for sbid in ('101', '102', '103'):
+        pd.DataFrame({'bbox_ra_min': [1.0, 1.05, 5.0], 'bbox_ra_max': [1.1, 1.15, 5.1],
+                      'bbox_dec_min': [0.0, 0.0, 0.0], 'bbox_dec_max': [0.1, 0.1, 0.1],
+                      'score': [0.9, 0.8, 0.7]}).to_csv(input_dir / f'{sbid}.csv', index=False)
+    result = subprocess.run([sys.executable, '-m', 'hetu', 'dedup', '--input_dir', str(input_dir),
+                             '--output_dir', str(output_dir), '--backend', 'processes', '--workers', '2'],
+                            cwd=REPO_ROOT, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert 'Successfully processed 3/3' in result.stdout
+    for sbid in ('101', '102', '103'):
+        assert pd.read_csv(output_dir / f'processed_{sbid}.csv')['score'].tolist() == [0.9, 0.7]
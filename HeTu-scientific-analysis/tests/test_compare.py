@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from hetu.compare import compare_pair, compare_sbid, load_detections, match_detections
+
+
+def catalog(rows):
+    return pd.DataFrame(rows, columns=['component_id', 'label', 'score', 'bbox_xmin', 'bbox_ymin',
+                                       'bbox_xmax', 'bbox_ymax'])
+
+
+# Model a and model b on two cutouts; centres are the bbox midpoints
+A = catalog([
+    ['J1', 0, 0.90, 10, 10, 20, 20],    # centre (15, 15)
+    ['J1', 1, 0.80, 40, 40, 60, 60],    # centre (50, 50)
+    ['J1', 2, 0.70, 100, 100, 110, 110],  # no counterpart in b
+    ['J2', 3, 0.95, 10, 10, 20, 20],    # same pixels as a J1 box, other cutout
+])
+B = catalog([
+    ['J1', 0, 0.85, 12, 11, 22, 21],    # (17, 16): 2.2 px from a0
+    ['J1', 3, 0.60, 43, 40, 63, 60],    # (53, 50): 3 px from a1
+    ['J1', 1, 0.50, 44, 44, 66, 66],    # (55, 55): farther from a1 than b1
+    ['J2', np.nan, 0.75, 10, 10, 20, 20],  # missing label
+    ['J3', 2, 0.99, 10, 10, 20, 20],    # cutout not in a
+])
+
+
+def test_matches_are_mutual_nearest_neighbours_within_a_cutout():
+    a = A.assign(x=(A['bbox_xmin'] + A['bbox_xmax']) / 2, y=(A['bbox_ymin'] + A['bbox_ymax']) / 2)
+    b = B.assign(x=(B['bbox_xmin'] + B['bbox_xmax']) / 2, y=(B['bbox_ymin'] + B['bbox_ymax']) / 2)
+    pairs = match_detections(a, b, tolerance=5.0)
+    assert sorted(zip(pairs['ia'], pairs['ib'])) == [(0, 0), (1, 1), (3, 3)]
+    assert np.allclose(sorted(pairs['dist']), [0.0, np.hypot(2, 1), 3.0])
+    assert match_detections(a, b, tolerance=1.0)[['ia', 'ib']].values.tolist() == [[3, 3]]
+
+
+def test_compare_counts_and_confusion(tmp_path):
+    paths = {}
+    for name, df in (('a', A), ('b', B)):
+        paths[name] = str(tmp_path / f'{name}.csv')
+        df.to_csv(paths[name], index=False)
+    b = load_detections(paths['b'])
+    assert b['label'].tolist() == [0, 3, 1, -1, 2]
+
+    counts, pair_rows, hists = compare_sbid('101', paths, tolerance=5.0)
+    assert [counts[f'label_{k}_count_a'] for k in range(4)] == [1, 1, 1, 1]
+    assert [counts[f'label_{k}_count_b'] for k in range(4)] == [1, 1, 1, 1]
+    stats = pair_rows[0]
+    assert (stats['n_a'], stats['n_b'], stats['n_matched']) == (4, 5, 3)
+    assert stats['agreement'] == 3 / 6
+    confusion = np.array([[stats[f'conf_a{i}_b{j}'] for j in range(4)] for i in range(4)])
+    expected = np.zeros((4, 4), dtype=int)
+    expected[0, 0] = expected[1, 3] = 1
+    assert np.array_equal(confusion, expected)
+    assert stats['label_agreement'] == 1 / 3
+    assert np.isclose(stats['score_delta_median'], -0.2)
+    assert hists[('a', 'b')].sum() == 3
+
+    stats, _ = compare_pair(load_detections(paths['a'], min_score=0.85), b, tolerance=5.0)
+    assert (stats['n_a'], stats['n_matched']) == (2, 2)
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+from hetu.crossmatch import (RACS_DEC, RACS_ID, RACS_ISLAND, RACS_RA, SCORE_BINS, UNMATCHED, completeness_table,
+                             confusion_sbid, racs_classes)
+from hetu.skygeom import angular_distance
+
+RADIUS = 40.0
+
+
+def write_catalogs(directory, n_racs=300, n_hetu=2000):
+    """RACS components and HeTu detections of one field straddling RA = 0"""
+    rng = np.random.default_rng(12)
+    islands = np.repeat(np.arange(200), rng.integers(1, 5, 200))[:n_racs]
+    racs = pd.DataFrame({RACS_ID: [f'C{k}' for k in range(n_racs)], RACS_ISLAND: islands,
+                         RACS_RA: np.mod(rng.uniform(-1, 1, n_racs), 360), RACS_DEC: rng.uniform(-31, -29, n_racs)})
+    near = rng.integers(0, n_racs, n_hetu // 2)
+    hetu = pd.DataFrame({
+        'ra': np.concatenate([racs[RACS_RA].to_numpy()[near] + rng.normal(0, 0.005, len(near)),
+                              np.mod(rng.uniform(-1, 1, n_hetu - len(near)), 360)]),
+        'dec': np.concatenate([racs[RACS_DEC].to_numpy()[near] + rng.normal(0, 0.005, len(near)),
+                               rng.uniform(-31, -29, n_hetu - len(near))]),
+        'label': rng.integers(0, 4, n_hetu), 'score': rng.uniform(0, 1, n_hetu)})
+    hetu['ra'] = np.mod(hetu['ra'], 360)
+    racs.to_csv(directory / 'racs_101.csv', index=False)
+    hetu.to_csv(directory / 'hetu_101.csv', index=False)
+    # Compare with the values as parsed back from the CSVs
+    return pd.read_csv(directory / 'racs_101.csv'), pd.read_csv(directory / 'hetu_101.csv')
+
+
+def brute_force(racs, hetu):
+    """Nearest RACS component within the radius of every HeTu detection (-1 when none)"""
+    sep = angular_distance(hetu['ra'].to_numpy()[:, None], hetu['dec'].to_numpy()[:, None],
+                           racs[RACS_RA].to_numpy()[None, :], racs[RACS_DEC].to_numpy()[None, :]) * 3600
+    nearest = sep.argmin(axis=1)
+    return np.where(sep.min(axis=1) <= RADIUS, nearest, -1)
+
+
+def test_racs_classes():
+    racs = pd.DataFrame({RACS_ID: list('abcdefg'), RACS_ISLAND: [1, 2, 2, 3, 3, 3, 3], 'kind': list('xyxyxyx')})
+    assert racs_classes(racs).tolist() == ['1', '2', '2', '3+', '3+', '3+', '3+']
+    assert racs_classes(racs, 'kind').tolist() == list('xyxyxyx')
+    assert racs_classes(racs.drop(columns=[RACS_ISLAND])).tolist() == ['1'] * 7
+
+
+def test_confusion_matches_brute_force(tmp_path):
+    racs, hetu = write_catalogs(tmp_path)
+    nearest = brute_force(racs, hetu)
+    classes = racs_classes(racs)
+    matched = nearest >= 0
+    assert matched.sum() > 500 and (~matched).sum() > 500
+
+    confusion, hists, recall = confusion_sbid(str(tmp_path / 'racs_101.csv'), str(tmp_path / 'hetu_101.csv'), RADIUS)
+    expected = pd.DataFrame({'hetu_label': hetu['label'],
+                             'racs_class': np.where(matched, classes[np.maximum(nearest, 0)], UNMATCHED)})
+    expected = expected.value_counts().rename('count').reset_index()
+    key = ['hetu_label', 'racs_class']
+    pd.testing.assert_frame_equal(confusion.sort_values(key, ignore_index=True),
+                                  expected.sort_values(key, ignore_index=True), check_dtype=False)
+    assert confusion['count'].sum() == len(hetu)
+
+    best = np.full(len(racs), -np.inf)
+    np.maximum.at(best, nearest[matched], hetu['score'].to_numpy()[matched])
+    for cls, (n_total, hist) in hists.items():
+        in_class = classes == cls
+        assert n_total == in_class.sum()
+        assert np.array_equal(hist, np.histogram(best[in_class & np.isfinite(best)], bins=SCORE_BINS)[0])
+
+    for label, (n_reached, n_racs, separations) in recall.items():
+        sel = matched if label is None else matched & (hetu['label'].to_numpy() == label)
+        assert (n_reached, n_racs) == (len(np.unique(nearest[sel])), len(racs))
+        assert len(separations) == sel.sum() and (separations <= RADIUS).all()
+
+    table = completeness_table(hists)
+    first = table.groupby('racs_class').first()
+    assert (first['n_detected'] == [np.isfinite(best[classes == c]).sum() for c in first.index]).all()
+    assert (table.groupby('racs_class')['completeness'].apply(lambda s: s.is_monotonic_decreasing)).all()
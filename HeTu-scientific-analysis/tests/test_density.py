@@ -0,0 +1,33 @@
+import healpy as hp
+import numpy as np
+
+from hetu.aggregates import AggregateStore, FieldAggregate
+from hetu.density import field_density
+from hetu.moc import FootprintSet, Moc, write_footprints
+
+ORDER = 8
+
+
+def disc(ra, dec, radius_deg):
+    vec = hp.ang2vec(ra, dec, lonlat=True)
+    return Moc.from_pixels(hp.query_disc(2 ** ORDER, vec, np.radians(radius_deg), nest=True), ORDER)
+
+
+def test_shared_area_counts_triple_overlaps_once(tmp_path):
+    sbids = ['1', '2', '3', '4']
+    mocs = [disc(10.0, 0.0, 2.0), disc(11.0, 0.0, 2.0), disc(10.5, 0.8, 2.0), disc(40.0, 0.0, 1.0)]
+    path = str(tmp_path / 'fields.hmoc')
+    write_footprints(path, sbids, mocs, ORDER)
+    with FootprintSet(path) as footprints:
+        shared = footprints.shared_area_deg2()
+        for k, sbid in enumerate(sbids):
+            others = footprints.union_of([s for s in sbids if s != sbid])
+            assert np.isclose(shared[k], (footprints.moc(sbid) & others).area_deg2)
+            assert shared[k] <= footprints.area_deg2(sbid)
+        assert shared[3] == 0.0
+
+        store = AggregateStore()
+        for sbid in sbids:
+            store.ingest(sbid, FieldAggregate())
+        table = field_density(store, footprints).set_index('SBID')
+        assert np.allclose(table.loc[sbids, 'shared_area_deg2'], shared)
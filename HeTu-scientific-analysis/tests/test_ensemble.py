@@ -0,0 +1,89 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from hetu.bbox import BBOX_COLUMNS
+from hetu.ensemble import fuse_sbid, model_files
+from hetu.shards import pack_json_files
+
+# (component_id, label, score, box, counts) per model
+MODEL_A = [('c1', 3, 0.9, (10, 10, 30, 30), 'rleA1'),
+           ('c1', 1, 0.8, (50, 50, 60, 60), 'rleA2'),
+           ('c2', 0, 0.5, (0, 0, 10, 10), 'rleA3'),
+           ('c3', 2, 0.7, (0, 0, 10, 10), 'rleA4'),
+           ('c3', 2, 0.5, (0, 0, 10, 11), 'rleA5')]
+MODEL_B = [('c1', 3, 0.6, (12, 12, 32, 32), 'rleB1'),
+           ('c1', 2, 0.4, (50, 50, 60, 60), 'rleB2'),
+           ('c2', 0, 0.5, (8, 8, 18, 18), 'rleB3')]
+
+
+def write_csv(path, rows):
+    df = pd.DataFrame([(c, label, score, *box, counts) for c, label, score, box, counts in rows],
+                      columns=['component_id', 'label', 'score'] + BBOX_COLUMNS + ['counts'])
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+def write_shard(directory, rows):
+    directory.mkdir()
+    paths = []
+    for c in sorted({r[0] for r in rows}):
+        own = [r for r in rows if r[0] == c]
+        path = directory / c
+        path.write_text(json.dumps({'labels': [r[1] for r in own], 'scores': [r[2] for r in own],
+                                    'bboxes': [list(r[3]) for r in own],
+                                    'masks': [{'size': [64, 64], 'counts': r[4]} for r in own]}))
+        paths.append(str(path))
+    pack_json_files(paths, str(directory / '101.hshard'), sbid='101')
+    return str(directory / '101.hshard')
+
+
+def fused_by_box(fused):
+    return {(r['component_id'], r['label'], round(r['bbox_xmin'], 3)): r for r in fused.to_dict('records')}
+
+
+def test_score_and_coordinate_weighting_on_two_models(tmp_path):
+    paths = {'a': write_csv(tmp_path / 'a.csv', MODEL_A), 'b': write_csv(tmp_path / 'b.csv', MODEL_B)}
+    fused = fuse_sbid(paths, iou_threshold=0.55)
+    assert len(fused) == 6 and fused['n_boxes'].sum() == len(MODEL_A) + len(MODEL_B)
+    rows = fused_by_box(fused)
+
+    both = rows[('c1', 3, 10.8)]
+    # Coordinates weighted by score: (0.9 * 10 + 0.6 * 12) / 1.5 and (0.9 * 30 + 0.6 * 32) / 1.5
+    np.testing.assert_allclose([both[c] for c in BBOX_COLUMNS], [10.8, 10.8, 30.8, 30.8], rtol=1e-6)
+    assert both['score'] == pytest.approx((0.9 + 0.6) / 2)
+    assert (both['n_models'], both['n_boxes'], both['models'], both['counts']) == (2, 2, 'a;b', 'rleA1')
+
+    # Boxes found by one model out of two keep half their score
+    assert rows[('c1', 1, 50.0)]['score'] == pytest.approx(0.8 / 2)
+    assert rows[('c1', 2, 50.0)]['score'] == pytest.approx(0.4 / 2)
+    assert rows[('c1', 2, 50.0)]['models'] == 'b'
+    # Low IoU (4 / 196) keeps the boxes apart
+    assert rows[('c2', 0, 0.0)]['score'] == pytest.approx(0.25) and rows[('c2', 0, 8.0)]['score'] == pytest.approx(0.25)
+    # Two boxes of one model: mean score, and both fill the two model slots
+    same = rows[('c3', 2, 0.0)]
+    assert (same['n_models'], same['n_boxes'], same['counts']) == (1, 2, 'rleA4')
+    assert same['score'] == pytest.approx(0.6)
+    assert same['bbox_ymax'] == pytest.approx((0.7 * 10 + 0.5 * 11) / 1.2)
+
+
+def test_fusion_across_labels_and_score_cut(tmp_path):
+    paths = {'a': write_csv(tmp_path / 'a.csv', MODEL_A), 'b': write_csv(tmp_path / 'b.csv', MODEL_B)}
+    rows = fused_by_box(fuse_sbid(paths, by_label=False))
+    merged = rows[('c1', 1, 50.0)]  # label 1 (0.8) outweighs label 2 (0.4)
+    assert (merged['n_models'], merged['score']) == (2, pytest.approx(0.6))
+    assert ('c1', 2, 50.0) not in rows
+
+    cut = fuse_sbid(paths, min_score=0.55)
+    assert sorted(cut['score'].round(6)) == [0.35, 0.4, 0.75]
+
+
+def test_shards_and_csvs_fuse_alike(tmp_path):
+    csv_paths = {'a': write_csv(tmp_path / 'a.csv', MODEL_A), 'b': write_csv(tmp_path / 'b.csv', MODEL_B)}
+    shard_b = write_shard(tmp_path / 'shards_b', MODEL_B)
+    assert model_files(str(tmp_path / 'shards_b')) == {'101': shard_b}
+    from_csv = fuse_sbid(csv_paths)
+    from_shard = fuse_sbid({'a': csv_paths['a'], 'b': shard_b})
+    pd.testing.assert_frame_equal(from_csv, from_shard)
@@ -0,0 +1,50 @@
+import numpy as np
+
+from hetu import skygeom
+from hetu.executor import Executor
+from hetu.fof import fof_groups, source_multiplicity
+
+
+def synthetic_components(n=2000, n_boxes=60, seed=0):
+    rng = np.random.default_rng(seed)
+    ra, dec = rng.uniform(10.0, 12.0, n), rng.uniform(-1.0, 1.0, n)
+    centres = rng.integers(0, n, n_boxes)
+    half = rng.uniform(0.002, 0.01, n_boxes)
+    boxes = np.column_stack([ra[centres] - half, ra[centres] + half, dec[centres] - half, dec[centres] + half])
+    return ra, dec, boxes, rng.random(n_boxes)
+
+
+def same_partition(a, b):
+    """Whether two group labelings define the same groups"""
+    pairs = np.unique(np.column_stack([a, b]), axis=0)
+    return len(pairs) == len(np.unique(a)) == len(np.unique(b))
+
+
+def test_sharded_groups_match_single_shard_with_nan_positions():
+    ra, dec, boxes, scores = synthetic_components()
+    ra[5], dec[17], dec[900] = np.nan, np.nan, np.nan
+    boxes[3, 2] = np.nan
+    serial = Executor('serial')
+    g1, m1, b1 = fof_groups(ra, dec, boxes, scores, link_arcsec=60, n_shards=1, executor=serial)
+    g4, m4, b4 = fof_groups(ra, dec, boxes, scores, link_arcsec=60, n_shards=4, executor=serial)
+    bad = ~(np.isfinite(ra) & np.isfinite(dec))
+    assert (g1[bad] == -1).all() and (b1[bad] == -1).all() and (m1[bad] == 0).all()
+    assert same_partition(g1, g4)
+    assert np.array_equal(m1, m4)
+    assert np.array_equal(b1, b4)
+    assert (b1 >= 0).sum() > 0 and (m1 > 1).sum() > 0
+    assert not (b1 == 3).any()
+    source_multiplicity(g4, m4, b4, len(boxes))
+
+
+def test_box_membership_matches_brute_force():
+    ra, dec, boxes, scores = synthetic_components(seed=1)
+    _, _, box = fof_groups(ra, dec, boxes, scores, n_shards=3, executor=Executor('serial'))
+    inside = skygeom.box_contains_point(*boxes.T[:, :, None], ra, dec)
+    expected = np.where(inside.any(axis=0), np.argmax(np.where(inside, scores[:, None], -np.inf), axis=0), -1)
+    assert np.array_equal(box, expected)
+
+
+def test_no_finite_positions():
+    group, multiplicity, box = fof_groups(np.full(3, np.nan), np.zeros(3), n_shards=2, executor=Executor('serial'))
+    assert (group == -1).all() and (multiplicity == 0).all() and (box == -1).all()
@@ -0,0 +1,49 @@
+import os
+
+import pandas as pd
+
+from hetu.jobarray import SUMMARY_FILE, make_plan, merge_shards, submit, write_script
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGE = ('python cateloge_creation/bbox_overlap_removal_all.py --input_dir {input} --output_dir {output} '
+         '--backend serial')
+
+
+def write_inputs(directory):
+    sizes = {'101': 40, '102': 5, '103': 20, '104': 12, '105': 3}
+    for sbid, n in sizes.items():
+        # n separate boxes plus one duplicate of the first that the stage removes
+        ra = [1.0 + k for k in range(n)] + [1.01]
+        pd.DataFrame({'bbox_ra_min': ra, 'bbox_ra_max': [x + 0.1 for x in ra], 'bbox_dec_min': 0.0,
+                      'bbox_dec_max': 0.1, 'score': [0.9] * n + [0.5]}).to_csv(directory / f'{sbid}.csv', index=False)
+    # Unreadable by the catalog statistics (binary content): kept in the plan with weight 1
+    (directory / '106.csv').write_bytes(b'\x00\xff\xfe"' * 10)
+    return sizes
+
+
+def test_plan_submit_local_and_merge(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    input_dir, work_dir, output_dir = tmp_path / 'input', str(tmp_path / 'work'), str(tmp_path / 'merged')
+    input_dir.mkdir()
+    sizes = write_inputs(input_dir)
+
+    plan = make_plan(str(input_dir), work_dir, STAGE, n_shards=3, balance='rows')
+    assert not os.path.exists(input_dir / '_catalog_stats.csv')
+    shards = plan['shards']
+    assert len(shards) == 3
+    assert sorted(sbid for s in shards for sbid in s['sbids']) == ['101', '102', '103', '104', '105', '106']
+    # Longest-processing-time split of the row counts 41, 21, 13, 6, 4 and 1
+    assert sorted(s['weight'] for s in shards) == [22, 23, 41]
+    write_script(plan, cpus=1)
+
+    codes = submit(work_dir, local=True, max_parallel=2)
+    assert codes == {0: 0, 1: 0, 2: 0}
+
+    summary = merge_shards(work_dir, output_dir)
+    assert summary['returncode'].tolist() == [0, 0, 0]
+    assert summary['n_files'].sum() == 6
+    assert os.path.exists(os.path.join(output_dir, SUMMARY_FILE))
+    for sbid, n in sizes.items():
+        merged = pd.read_csv(os.path.join(output_dir, f'processed_{sbid}.csv'))
+        assert len(merged) == n
+    assert not os.path.exists(os.path.join(output_dir, 'processed_106.csv'))
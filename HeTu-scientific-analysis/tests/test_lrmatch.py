@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from hetu.executor import Executor
+from hetu.lrmatch import lr_match, summarize
+
+
+def synthetic_field(q_true, n1=3000, n_background=40000, sigma=2.0, size_deg=2.0, seed=0):
+    """Catalog 1, catalog 2 and the true counterpart index of every catalog-1 source (-1 for none)"""
+    rng = np.random.default_rng(seed)
+    ra1 = rng.uniform(10.0, 10.0 + size_deg, n1)
+    dec1 = rng.uniform(-size_deg / 2, size_deg / 2, n1)
+    has = np.flatnonzero(rng.random(n1) < q_true)
+    offset = rng.normal(0.0, np.sqrt(2) * sigma / 3600.0, (len(has), 2))
+    ra2 = np.concatenate([ra1[has] + offset[:, 0] / np.cos(np.radians(dec1[has])),
+                          rng.uniform(10.0, 10.0 + size_deg, n_background)])
+    dec2 = np.concatenate([dec1[has] + offset[:, 1], rng.uniform(-size_deg / 2, size_deg / 2, n_background)])
+    truth = np.full(n1, -1)
+    truth[has] = np.arange(len(has))
+    return ra1, dec1, ra2, dec2, truth
+
+
+@pytest.mark.parametrize('q_true', [0.3, 0.6])
+def test_reliability_is_calibrated(q_true):
+    ra1, dec1, ra2, dec2, truth = synthetic_field(q_true)
+    pairs, q = lr_match(ra1, dec1, ra2, dec2, sigma1=2.0, sigma2=2.0, executor=Executor('serial'))
+    assert abs(q - q_true) < 0.05
+
+    best = pairs[pairs['is_best']]
+    correct = truth[best['idx1'].to_numpy()] == best['idx2'].to_numpy()
+    # Mean reliability of the best matches is the expected fraction of correct ones
+    assert abs(best['reliability'].mean() - correct.mean()) < 0.03
+    summary = summarize(pairs, q, len(ra1))
+    assert abs(summary['expected_false'] - (~correct).sum()) < 0.1 * len(best)
+
+
+def test_sharded_search_matches_single_shard():
+    ra1, dec1, ra2, dec2, _ = synthetic_field(0.5, n1=800, n_background=8000)
+    single, q1 = lr_match(ra1, dec1, ra2, dec2, n_shards=1, executor=Executor('serial'))
+    sharded, q4 = lr_match(ra1, dec1, ra2, dec2, n_shards=4, executor=Executor('serial'))
+    assert q1 == q4
+    assert single[['idx1', 'idx2']].equals(sharded[['idx1', 'idx2']])
+    assert np.allclose(single['reliability'], sharded['reliability'])
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from hetu.masks import RleMask, bbox_overlap_pairs, rle_counts, rle_encode, suppress
+
+
+def random_mask(rng, shape, n_blobs):
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    mask = np.zeros(shape, dtype=bool)
+    for _ in range(n_blobs):
+        y, x = rng.uniform(0, shape[0]), rng.uniform(0, shape[1])
+        r = rng.uniform(2, 12)
+        mask |= (yy - y) ** 2 + (xx - x) ** 2 < r ** 2
+    return mask
+
+
+def decode(runs, shape):
+    """Dense column-major decode of run lengths, the brute-force reference"""
+    values = np.repeat(np.arange(len(runs)) % 2 == 1, runs)
+    return values.reshape(shape, order='F')
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_rle_round_trip_and_iou_match_dense_masks(seed):
+    rng = np.random.default_rng(seed)
+    shape = (rng.integers(20, 80), rng.integers(20, 80))
+    a, b = random_mask(rng, shape, 3), random_mask(rng, shape, 3)
+    a[0, 0] = True  # foreground first pixel: the RLE starts with an empty background run
+    ra, rb = rle_encode(a), rle_encode(b)
+
+    assert np.array_equal(decode(rle_counts(ra['counts']), shape), a)
+    assert np.array_equal(decode(rle_counts(rb['counts']), shape), b)
+    assert np.array_equal(rle_counts(list(rle_counts(ra['counts']))), rle_counts(ra['counts']))
+
+    ma, mb = RleMask.from_dict(ra), RleMask.from_dict(rb)
+    assert ma.area == a.sum()
+    assert ma.intersection(mb) == (a & b).sum()
+    assert ma.iou(mb) == pytest.approx((a & b).sum() / (a | b).sum())
+    assert ma.iou(ma) == 1.0
+
+
+def test_bbox_pairs_ignore_the_score_appended_to_json_boxes():
+    boxes = [[0, 0, 10, 10], [5, 5, 15, 15], [20, 20, 30, 30]]
+    with_scores = [box + [0.9] for box in boxes]
+    expected = bbox_overlap_pairs(boxes)
+    got = bbox_overlap_pairs(with_scores)
+    assert [tuple(p) for p in zip(*got)] == [tuple(p) for p in zip(*expected)] == [(0, 1)]
+    assert bbox_overlap_pairs([])[0].size == 0
+
+
+def test_suppress_json_boxes_with_scores():
+    shape = (40, 40)
+    big = np.zeros(shape, dtype=bool)
+    big[5:30, 5:30] = True
+    near = np.zeros(shape, dtype=bool)
+    near[6:30, 5:30] = True
+    small = np.zeros(shape, dtype=bool)
+    small[10:13, 10:13] = True
+    masks = [rle_encode(m) for m in (big, near, small)]
+    bboxes = [[5, 5, 30, 30, 0.9], [5, 6, 30, 30, 0.8], [10, 10, 13, 13, 0.7]]
+    assert suppress([0.9, 0.8, 0.7], bboxes, masks, 0.5) == [0, 2]
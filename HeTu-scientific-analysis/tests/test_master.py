@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hetu.executor import Executor
+from hetu.master import INVALID_KEY, build_master, healpix_keys, read_master
+
+
+def write_catalogs(directory):
+    rng = np.random.default_rng(2)
+    paths, frames = [], []
+    for source, (sbid, n) in enumerate([(101, 300), (102, 170), (103, 260)]):
+        df = pd.DataFrame({'component_id': [f'J{sbid}_{k}' for k in range(n)], 'label': rng.integers(0, 4, n),
+                           'score': rng.uniform(0, 1, n), 'ra': rng.uniform(0, 360, n),
+                           'dec': np.degrees(np.arcsin(rng.uniform(-1, 1, n)))})
+        df.loc[rng.random(n) < 0.03, 'ra'] = np.nan
+        if sbid == 102:
+            df['flux'] = rng.uniform(1, 10, n)
+        path = str(directory / f'processed_wcs_{sbid}.csv')
+        df.to_csv(path, index=False)
+        paths.append(path)
+        # Compare with the values as parsed back from the CSV
+        frames.append(pd.read_csv(path).assign(SBID=str(sbid), source=source, source_row=np.arange(n)))
+    return paths, pd.concat(frames, ignore_index=True)
+
+
+@pytest.mark.parametrize('chunk_rows, fan_in', [(10 ** 6, 64), (40, 3)])
+def test_external_sort_matches_in_memory_sort(tmp_path, chunk_rows, fan_in):
+    paths, full = write_catalogs(tmp_path)
+    full['healpix'] = healpix_keys(full['ra'], full['dec'])
+    expected = full.sort_values(['healpix', 'source', 'source_row'], kind='stable', ignore_index=True)
+
+    out = str(tmp_path / 'master.hidx')
+    assert build_master(paths, out, chunk_rows=chunk_rows, fan_in=fan_in, executor=Executor('serial')) == len(full)
+    master = read_master(out)
+
+    assert len(master) == len(full)
+    assert np.array_equal(master['healpix'].to_numpy(), expected['healpix'].to_numpy())
+    assert np.all(np.diff(master['healpix'].to_numpy().astype(np.float64)) >= 0)
+    assert (master['healpix'] == INVALID_KEY).sum() == full['ra'].isna().sum()
+    # Rows with equal keys (the missing positions) may come out in any order; match them by provenance
+    key = ['SBID', 'source_row']
+    got = master.assign(SBID=master['SBID'].astype(str)).sort_values(key, ignore_index=True)
+    want = expected.sort_values(key, ignore_index=True)
+    assert got['component_id'].tolist() == want['component_id'].tolist()
+    assert np.array_equal(got['label'].astype(np.int64), want['label'])
+    for name in ('score', 'ra', 'dec', 'flux'):
+        np.testing.assert_array_equal(got[name].to_numpy(np.float64), want[name].to_numpy(np.float64))
+    assert got['source_file'].astype(str).tolist() == [paths[s].rsplit('/', 1)[1] for s in want['source']]
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from hetu.moc import FootprintSet, Moc, write_footprints
+
+FINE = 8
+
+
+def random_moc(rng):
+    """Union of random pixels at orders 4 to FINE, plus its order-FINE pixel set"""
+    moc, pixels = Moc(), set()
+    for order in range(4, FINE + 1):
+        cells = rng.choice(12 * 4 ** order, size=rng.integers(1, 40), replace=False)
+        # Keep every cell near the first one so the coverages overlap
+        cells = cells % (12 * 4 ** order // 64)
+        moc = moc | Moc.from_pixels(cells, order)
+        scale = 4 ** (FINE - order)
+        pixels |= {int(c) * scale + k for c in cells for k in range(scale)}
+    return moc, pixels
+
+
+def fine_pixels(moc):
+    pixels, fraction = moc.pixel_coverage(FINE)
+    assert np.all(fraction == 1.0)
+    return set(pixels.tolist())
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_set_operations_match_pixel_sets(seed):
+    rng = np.random.default_rng(seed)
+    (a, pa), (b, pb) = random_moc(rng), random_moc(rng)
+    assert fine_pixels(a) == pa and fine_pixels(b) == pb
+    assert fine_pixels(a | b) == pa | pb
+    assert fine_pixels(a & b) == pa & pb
+    assert fine_pixels(a - b) == pa - pb
+    assert (a - b) | (a & b) == a
+    assert a.contains_moc(a & b) and not (a - b).overlaps(b)
+    assert np.isclose((a | b).area_deg2 + (a & b).area_deg2, a.area_deg2 + b.area_deg2)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_nuniq_round_trip(seed):
+    rng = np.random.default_rng(seed)
+    moc, _ = random_moc(rng)
+    moc = moc | Moc([[12345, 67890]])
+    uniq = moc.uniq()
+    assert Moc.from_uniq(uniq) == moc
+    assert Moc.from_uniq(rng.permutation(uniq)) == moc
+    # The cells are disjoint: their areas add up to the coverage
+    assert np.isclose(sum(Moc.from_uniq([u]).area_deg2 for u in uniq), moc.area_deg2)
+    assert Moc.from_pixels([5], 3).uniq().tolist() == [4 * 4 ** 3 + 5]
+
+
+def test_footprint_set_matches_pairwise_operations(tmp_path):
+    rng = np.random.default_rng(11)
+    sbids = ['1', '2', '3']
+    mocs = [random_moc(rng)[0] for _ in sbids]
+    path = str(tmp_path / 'fields.hmoc')
+    write_footprints(path, sbids, mocs, FINE)
+    with FootprintSet(path) as footprints:
+        assert footprints.union() == mocs[0] | mocs[1] | mocs[2]
+        for k, sbid in enumerate(sbids):
+            assert footprints.moc(sbid) == mocs[k]
+        overlaps = {(r.SBID_a, r.SBID_b): r.overlap_deg2 for r in footprints.overlaps().itertuples()}
+        for i in range(3):
+            for j in range(i + 1, 3):
+                expected = (mocs[i] & mocs[j]).area_deg2
+                assert np.isclose(overlaps.get((sbids[i], sbids[j]), 0.0), expected)
+        ra, dec = rng.uniform(0, 90, 2000), rng.uniform(0, 90, 2000)
+        expected = sum(m.contains(ra, dec).astype(int) for m in mocs)
+        assert np.array_equal(footprints.coverage_count(ra, dec), expected)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hetu.catalog import parse_predicate
+from hetu.executor import Executor
+from hetu.raster import Raster, RasterSpec, project, projection_extent, rasterize
+
+SHAPE = (30, 40)
+
+
+def test_counts_match_histogram2d():
+    rng = np.random.default_rng(6)
+    x, y = rng.normal(0.5, 0.4, 50000), rng.uniform(-0.2, 1.2, 50000)
+    x[::97] = np.nan
+    extent = (0.0, 1.0, 0.0, 1.0)
+    raster = Raster(extent, SHAPE)
+    for start in range(0, len(x), 7000):
+        raster.add(x[start:start + 7000], y[start:start + 7000])
+    expected, _, _ = np.histogram2d(y, x, bins=SHAPE, range=[extent[2:], extent[:2]])
+    assert np.array_equal(raster.counts, expected.astype(np.int64))
+
+    # Points exactly on the edges: the upper edge belongs to the last bin, as in np.histogram2d
+    edges = Raster((0, 10, 0, 5), (5, 10))
+    grid_x, grid_y = np.meshgrid(np.arange(11.0), np.arange(6.0))
+    assert edges.add(grid_x.ravel(), grid_y.ravel()) == 66
+    expected, _, _ = np.histogram2d(grid_y.ravel(), grid_x.ravel(), bins=(5, 10), range=[(0, 5), (0, 10)])
+    assert np.array_equal(edges.counts, expected.astype(np.int64))
+
+
+def test_log_axis_and_mean_values():
+    rng = np.random.default_rng(7)
+    flux, score = 10 ** rng.uniform(-1, 3, 20000), rng.uniform(0, 1, 20000)
+    value = rng.normal(size=20000)
+    value[::50] = np.nan
+    raster = Raster((1.0, 100.0, 0.0, 1.0), SHAPE, log_x=True, with_values=True)
+    raster.add(flux, score, value)
+    x_edges = np.logspace(0, 2, SHAPE[1] + 1)
+    counts, _, _ = np.histogram2d(score, flux, bins=[np.linspace(0, 1, SHAPE[0] + 1), x_edges])
+    assert np.array_equal(raster.counts, counts.astype(np.int64))
+    finite = np.isfinite(value)
+    sums, _, _ = np.histogram2d(score[finite], flux[finite], bins=[np.linspace(0, 1, SHAPE[0] + 1), x_edges],
+                                weights=value[finite])
+    np.testing.assert_allclose(raster.sums, sums, atol=1e-9)
+    image = raster.image()
+    assert np.isnan(image[counts == 0]).all()
+    filled = counts > 0
+    np.testing.assert_allclose(image[filled], sums[filled] / counts[filled])
+
+
+def test_sky_projection():
+    x, y = project([180.0, 170.0, 190.0, 0.0], [0.0, 10.0, -10.0, 0.0])
+    np.testing.assert_allclose(x, [0.0, 10.0, -10.0, 180.0])  # RA grows to the left
+    np.testing.assert_allclose(y, [0.0, 10.0, -10.0, 0.0])
+    hx, hy = project([0.0, 180.0, 180.0], [0.0, 90.0, 0.0], 'hammer')
+    x0, x1, y0, y1 = projection_extent('hammer')
+    np.testing.assert_allclose([abs(hx[0]), hy[1], hx[2], hy[2]], [x1, y1, 0.0, 0.0], atol=1e-12)
+    with pytest.raises(ValueError):
+        project([0.0], [0.0], 'mollweide')
+
+
+@pytest.mark.parametrize('executor', [Executor('serial'), Executor('processes', workers=2)])
+def test_rasterize_files_sums_every_file(tmp_path, executor):
+    rng = np.random.default_rng(8)
+    frames = []
+    for sbid in (101, 102, 103):
+        df = pd.DataFrame({'ra': rng.uniform(0, 360, 3000), 'dec': rng.uniform(-80, 30, 3000),
+                           'score': rng.uniform(0, 1, 3000)})
+        df.to_csv(tmp_path / f'processed_wcs_{sbid}.csv', index=False)
+        frames.append(pd.read_csv(tmp_path / f'processed_wcs_{sbid}.csv'))
+    full = pd.concat(frames, ignore_index=True)
+    full = full[full['score'] >= 0.5]
+
+    spec = RasterSpec('sky', 'ra', 'dec', projection_extent('car'), SHAPE)
+    raster = rasterize(str(tmp_path), spec, [parse_predicate('score>=0.5')], executor=executor, chunk_rows=1000)
+    x, y = project(full['ra'], full['dec'])
+    expected, _, _ = np.histogram2d(y, x, bins=SHAPE, range=[(-90, 90), (-180, 180)])
+    assert np.array_equal(raster.counts, expected.astype(np.int64))
@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+from hetu.bootstrap import bootstrap_ratios
+from hetu.results import ResultsWriter, import_legacy_txt, make_record, read_results
+
+
+def write_legacy(folder):
+    folder.mkdir()
+    (folder / 'match_ratio_SB_20147.txt').write_text(
+        'Subdirectory: 20147\nMatched A sources / Total A sources: 30 / 40\nProportion: 75.00%\n')
+    (folder / 'match_ratio_SB_20148.txt').write_text('Subdirectory: 20148\nProportion: 62.50%\n')
+    (folder / 'match_ratio_SB_20149.txt').write_text('Subdirectory: 20149\nMatched A sources / Total A sources: 0 / 0\n')
+
+
+@pytest.mark.parametrize('suffix', ['csv', 'parquet'])
+def test_legacy_fraction_only_records_keep_unknown_counts(tmp_path, suffix, capsys):
+    if suffix == 'parquet':
+        pytest.importorskip('pyarrow')
+    write_legacy(tmp_path / 'txt')
+    table = str(tmp_path / f'results.{suffix}')
+    with ResultsWriter(table) as writer:
+        for record in import_legacy_txt(str(tmp_path / 'txt'), 'resnet'):
+            writer.append(record)
+        writer.append(make_record('20150', 'resnet', 9, 10))
+
+    df = read_results(table).set_index('SBID')
+    assert df['matched'].dtype == 'Int64' and df['total'].dtype == 'Int64'
+    assert (df.loc['20147', 'matched'], df.loc['20147', 'total']) == (30, 40)
+    assert pd.isna(df.loc['20148', 'matched']) and pd.isna(df.loc['20148', 'total'])
+    assert df.loc['20148', 'fraction'] == 0.625
+    assert (df.loc['20149', 'matched'], df.loc['20149', 'total'], df.loc['20149', 'fraction']) == (0, 0, 0.0)
+
+    ratios = bootstrap_ratios(read_results(table), n_boot=50)
+    assert 'Skipping 1 records without matched/total counts' in capsys.readouterr().out
+    row = ratios.iloc[0]
+    assert (row['n_sbids'], row['matched'], row['total']) == (3, 39, 50)
+    assert row['ratio'] == 39 / 50
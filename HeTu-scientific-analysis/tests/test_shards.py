@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+import pytest
+
+from hetu.shards import ArrayFile, ArrayFileWriter, ShardReader, concat_ranges, pack_json_files, write_shard
+
+
+def write_cutouts(directory):
+    rng = np.random.default_rng(5)
+    cutouts = {}
+    for k, n in enumerate([3, 0, 1, 4]):
+        cutouts[f'J{k:04d}-30.json'] = {
+            'labels': rng.integers(0, 4, n).tolist(),
+            'scores': rng.uniform(0, 1, n).tolist(),
+            # Extra trailing values after x1, y1, x2, y2 are dropped
+            'bboxes': [rng.uniform(0, 128, 5).tolist() for _ in range(n)],
+            'masks': [{'size': [128, 128], 'counts': f'rle{k}_{i}' if i % 2 else [i, 128 * 128 - i]}
+                      for i in range(n)],
+        }
+    paths = []
+    for name, data in cutouts.items():
+        path = directory / name
+        path.write_text(json.dumps(data))
+        paths.append(str(path))
+    broken = directory / 'J9999-30.json'
+    broken.write_text(json.dumps({'labels': [1], 'scores': [], 'bboxes': [[0, 0, 1, 1]]}))
+    return paths + [str(broken)], cutouts
+
+
+def test_pack_and_read_round_trip(tmp_path):
+    paths, cutouts = write_cutouts(tmp_path)
+    out = str(tmp_path / '20147.hshard')
+    assert pack_json_files(paths[::-1], out, sbid='20147') == (4, 8, 1)
+
+    with ShardReader(out) as shard:
+        assert shard.meta == {'sbid': '20147', 'n_cutouts': 4, 'n_detections': 8}
+        assert len(shard) == 8 and shard.n_cutouts == 4
+        assert shard.component_ids() == sorted(cutouts)
+        assert shard.component_rows().tolist() == [0, 0, 0, 2, 3, 3, 3, 3]
+        assert shard.rows_of('J0002-30.json') == (3, 4)
+        for name, detections in shard.iter_cutouts():
+            data = cutouts[name]
+            assert detections['labels'].tolist() == data['labels']
+            assert detections['scores'].tolist() == data['scores']
+            np.testing.assert_array_equal(detections['bboxes'], np.asarray(data['bboxes']).reshape(-1, 5)[:, :4])
+            expected = [m['counts'] if isinstance(m['counts'], str) else json.dumps(m['counts']) for m in data['masks']]
+            assert [m['counts'] for m in detections['masks']] == expected
+            assert all(m['size'] == [128, 128] for m in detections['masks'])
+        assert shard.cutout('J0001-30.json')['labels'].size == 0
+        with pytest.raises(KeyError):
+            shard.rows_of('J9999-30.json')
+
+
+def test_array_file_writer_matches_write_shard(tmp_path):
+    rng = np.random.default_rng(1)
+    arrays = {'a': rng.normal(size=(300, 3)).astype(np.float32), 'b': np.arange(77, dtype=np.int64),
+              'empty': np.zeros(0, dtype=np.uint8)}
+    write_shard(str(tmp_path / 'whole.bin'), arrays, {'kind': 'test'})
+    writer = ArrayFileWriter(str(tmp_path / 'chunks.bin'))
+    for start in range(0, 300, 128):
+        writer.append('a', arrays['a'][start:start + 128])
+    writer.append('b', arrays['b'][:50])
+    writer.append('b', arrays['b'][50:])
+    writer.append('empty', arrays['empty'])
+    writer.close({'kind': 'test'})
+
+    assert not list(tmp_path.glob('*.part'))
+    assert (tmp_path / 'whole.bin').read_bytes() == (tmp_path / 'chunks.bin').read_bytes()
+    with ArrayFile(str(tmp_path / 'chunks.bin')) as f:
+        assert f.meta == {'kind': 'test'}
+        for name, array in arrays.items():
+            assert getattr(f, name).dtype == array.dtype
+            np.testing.assert_array_equal(getattr(f, name), array)
+
+    (tmp_path / 'bad.bin').write_bytes(b'not a shard')
+    with pytest.raises(ValueError):
+        ArrayFile(str(tmp_path / 'bad.bin'))
+
+
+def test_concat_ranges():
+    assert concat_ranges([5, 0, 9], [7, 0, 12]).tolist() == [5, 6, 9, 10, 11]
+    assert concat_ranges([], []).tolist() == []
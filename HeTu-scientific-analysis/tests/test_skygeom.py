@@ -0,0 +1,73 @@
+import numpy as np
+
+from hetu.skygeom import (angular_distance, arcsec_from_chord, box_contains_point, boxes_overlap, chord_from_arcsec,
+                          circular_mean_ra, interval_from_bounds, ra_delta, ra_in_interval, ra_interval,
+                          ra_interval_bounds, ra_interval_contains, ra_intervals_overlap, radec_to_xyz,
+                          tangent_plane_offsets)
+
+# Brute force: an interval is the set of whole-degree RA cells it covers
+GRID = np.arange(360)
+
+
+def cells(start, width):
+    return set(GRID[np.mod(GRID - start, 360) <= width].tolist())
+
+
+def test_ra_intervals_across_zero():
+    assert ra_delta(359.0, 1.0) == -2.0 and ra_delta(1.0, 359.0) == 2.0
+    start, width = ra_interval(358.0, 3.0)
+    assert (start, width) == (358.0, 5.0)
+    assert ra_interval(3.0, 358.0) == (start, width)
+    ra_min, ra_max = ra_interval_bounds(start, width)
+    assert (ra_min, ra_max) == (358.0, 3.0)
+    assert interval_from_bounds(ra_min, ra_max) == (start, width)
+    assert ra_in_interval([359.5, 0.0, 2.9, 3.1, 180.0], start, width).tolist() == [True, True, True, False, False]
+    np.testing.assert_allclose(circular_mean_ra([358.0, 1.0, 4.0]), 1.0, atol=1e-9)
+
+
+def test_interval_overlap_and_containment_match_brute_force():
+    rng = np.random.default_rng(11)
+    starts = rng.integers(0, 360, (2, 2000)).astype(np.float64)
+    widths = rng.integers(0, 40, (2, 2000)).astype(np.float64)
+    widths[:, ::3] = rng.integers(0, 359, (2, len(widths[0, ::3])))  # some wide intervals
+    overlap = ra_intervals_overlap(starts[0], widths[0], starts[1], widths[1])
+    contains = ra_interval_contains(starts[0], widths[0], starts[1], widths[1])
+    for k in range(starts.shape[1]):
+        a, b = cells(starts[0, k], widths[0, k]), cells(starts[1, k], widths[1, k])
+        assert overlap[k] == bool(a & b)
+        assert contains[k] == (b <= a)
+    # The random pairs must include intervals crossing RA = 0 and both outcomes
+    assert (starts + widths >= 360).any() and overlap.any() and (~overlap).any() and contains.any()
+
+
+def test_boxes_across_zero():
+    # Box 1 spans RA 350..10 (crosses 0), box 2 spans 5..20, box 3 spans 20..340
+    ra_min = np.array([350.0, 5.0, 20.0])
+    ra_max = np.array([10.0, 20.0, 340.0])
+    dec_min, dec_max = np.full(3, -31.0), np.full(3, -29.0)
+    pairs = boxes_overlap(ra_min[:, None], ra_max[:, None], dec_min[:, None], dec_max[:, None],
+                          ra_min, ra_max, dec_min, dec_max)
+    assert pairs.tolist() == [[True, True, False], [True, True, True], [False, True, True]]
+    assert not boxes_overlap(350.0, 10.0, -31.0, -29.0, 355.0, 5.0, -28.0, -27.0)
+    inside = box_contains_point(350.0, 10.0, -31.0, -29.0, np.array([355.0, 0.0, 9.9, 11.0, 0.0]),
+                                np.array([-30.0, -30.0, -30.0, -30.0, -28.0]))
+    assert inside.tolist() == [True, True, True, False, False]
+
+
+def test_distances_and_projections():
+    rng = np.random.default_rng(2)
+    ra1, ra2 = rng.uniform(0, 360, (2, 500))
+    dec1, dec2 = np.degrees(np.arcsin(rng.uniform(-1, 1, (2, 500))))
+    xyz1, xyz2 = radec_to_xyz(ra1, dec1), radec_to_xyz(ra2, dec2)
+    expected = np.degrees(np.arccos(np.clip((xyz1 * xyz2).sum(axis=1), -1, 1)))
+    np.testing.assert_allclose(angular_distance(ra1, dec1, ra2, dec2), expected, atol=1e-6)
+    # Across RA = 0 the separation is small, not ~360 degrees
+    np.testing.assert_allclose(angular_distance(359.9995, 0.0, 0.0005, 0.0) * 3600, 3.6, rtol=1e-9)
+
+    chord = np.linalg.norm(xyz1 - xyz2, axis=1)
+    np.testing.assert_allclose(arcsec_from_chord(chord), expected * 3600, rtol=1e-6, atol=1e-3)
+    np.testing.assert_allclose(arcsec_from_chord(chord_from_arcsec([0.5, 30.0, 3600.0])), [0.5, 30.0, 3600.0])
+
+    xi, eta = tangent_plane_offsets([0.01, 359.99, 0.0], [-30.0, -30.0, -29.99], 0.0, -30.0)
+    np.testing.assert_allclose(xi, [0.01 * np.cos(np.radians(30)), -0.01 * np.cos(np.radians(30)), 0.0], rtol=1e-4)
+    np.testing.assert_allclose(eta, [0.0, 0.0, 0.01], atol=1e-6)
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from hetu import skygeom
+from hetu.skyindex import SkyIndex, build_index
+
+
+def test_build_index_skips_non_finite_positions(tmp_path):
+    rng = np.random.default_rng(3)
+    n = 2000
+    df = pd.DataFrame({'ra': rng.uniform(149.0, 151.0, n), 'dec': rng.uniform(-31.0, -29.0, n),
+                       'component_id': np.arange(n), 'label': rng.integers(0, 4, n)})
+    df.loc[::97, 'ra'] = np.nan
+    df.loc[::131, 'dec'] = np.inf
+    ok = np.isfinite(df['ra']) & np.isfinite(df['dec'])
+    path = str(tmp_path / 'catalog.hidx')
+
+    n_rows, _ = build_index(df, path, order=8)
+    assert n_rows == ok.sum()
+
+    with SkyIndex(path) as index:
+        assert len(index) == ok.sum()
+        near = index.cone(150.0, -30.0, radius_arcsec=1800)
+        box = index.box(149.5, 150.5, -30.5, -29.5)
+        good = df[ok]
+        sep = skygeom.angular_distance(150.0, -30.0, good['ra'], good['dec']) * 3600.0
+        assert sorted(near['component_id']) == sorted(good['component_id'][sep <= 1800])
+        inside = skygeom.box_contains_point(149.5, 150.5, -30.5, -29.5, good['ra'], good['dec'])
+        assert sorted(box['component_id']) == sorted(good['component_id'][inside])
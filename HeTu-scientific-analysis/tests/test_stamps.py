@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+
+from hetu import stamps
+from hetu.executor import Executor
+from hetu.stamps import assign_images, stamp_stack
+
+
+def write_image(path, ra=None, dec=None):
+    header = fits.Header()
+    if ra is not None:
+        header['CRVAL1'], header['CRVAL2'] = ra, dec
+    fits.PrimaryHDU(np.zeros((4, 4), dtype=np.float32), header).writeto(path)
+    return str(path)
+
+
+def test_assign_images_without_usable_centres(tmp_path):
+    selection = pd.DataFrame({'ra': [10.0, 50.2, np.nan], 'dec': [-30.0, -30.0, -30.0]})
+    assert assign_images(selection, []).isna().all()
+
+    blank = [write_image(tmp_path / 'blank.fits')]
+    assert assign_images(selection, blank).isna().all()
+
+    images = blank + [write_image(tmp_path / 'a.fits', 10.0, -30.0), write_image(tmp_path / 'b.fits', 50.0, -30.0)]
+    assigned = assign_images(selection, images)
+    assert assigned.tolist()[:2] == [images[1], images[2]]
+    assert pd.isna(assigned.iloc[2])
+
+    stack, images = stamp_stack(selection, [], size=8)
+    assert stack.shape == (3, 8, 8) and np.isnan(stack).all() and images.isna().all()
+
+
+def test_image_cache_closes_evicted_and_remaining_images(tmp_path, monkeypatch):
+    monkeypatch.setattr(stamps, 'IMAGE_CACHE_SIZE', 2)
+    paths = [write_image(tmp_path / f'{k}.fits', 10.0 * k, -30.0) for k in range(3)]
+    handles = [stamps.open_image(p)[0] for p in paths[:2]]
+    assert stamps.open_image(paths[0])[0] is handles[0]  # hit, now most recent
+
+    third = stamps.open_image(paths[2])[0]
+    assert handles[1]._file.closed  # least recently used is evicted and closed
+    assert not handles[0]._file.closed and not third._file.closed
+
+    stamps.close_images()
+    assert handles[0]._file.closed and third._file.closed
+    assert stamps.open_image(paths[0])[0] is not handles[0]
+    stamps.close_images()
+
+
+def test_stamp_stack_closes_images_after_run(tmp_path):
+    header = fits.Header({'CTYPE1': 'RA---SIN', 'CTYPE2': 'DEC--SIN', 'CRVAL1': 10.0, 'CRVAL2': -30.0,
+                          'CRPIX1': 2.5, 'CRPIX2': 2.5, 'CDELT1': -0.01, 'CDELT2': 0.01})
+    path = str(tmp_path / 'a.fits')
+    fits.PrimaryHDU(np.ones((4, 4), dtype=np.float32), header).writeto(path)
+    selection = pd.DataFrame({'ra': [10.0], 'dec': [-30.0]})
+    stack, images = stamp_stack(selection, [path], size=2, executor=Executor('serial'))
+    assert np.isfinite(stack).all() and images.tolist() == [path]
+    assert all(not cache for cache in stamps._caches)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+from hetu.bbox import BBOX_COLUMNS
+from hetu.stitch import SKY_COLUMNS, edge_fragments, process_single_csv, stitch
+
+SIZE = 100
+
+
+def detection(fits_id, pixel, sky, score, label=3):
+    """One WCS catalog row: pixel bbox in its cutout, sky box (ra_min, ra_max, dec_min, dec_max)"""
+    row = {'fits_id': fits_id, 'label': label, 'score': score}
+    row.update(zip(BBOX_COLUMNS, map(float, pixel)))
+    row.update(zip(SKY_COLUMNS, map(float, sky)))
+    return row
+
+
+def catalog():
+    return pd.DataFrame([
+        # One source split at the shared edge of cutouts A (its right edge) and B (its left edge)
+        detection('A', (60, 40, 99, 70), (10.00, 10.05, -30.02, -29.98), 0.6),
+        detection('B', (0, 42, 30, 72), (9.96, 10.00, -30.01, -29.97), 0.9, label=2),
+        # Compact sources away from the edges pass through
+        detection('A', (20, 20, 30, 30), (10.10, 10.11, -30.05, -30.04), 0.8),
+        detection('B', (50, 50, 60, 60), (9.90, 9.91, -29.95, -29.94), 0.7),
+        # Edge fragments of one cutout are never linked to each other
+        detection('C', (0, 0, 10, 99), (20.00, 20.01, -30.00, -29.95), 0.5),
+        detection('C', (10, 0, 20, 99), (20.01, 20.02, -30.00, -29.95), 0.5),
+        # A source split across RA = 0 (cutout D top edge meets cutout E bottom edge in Dec)
+        detection('D', (40, 70, 60, 99), (359.99, 0.01, -30.00, -29.96), 0.4),
+        detection('E', (40, 0, 60, 30), (359.98, 0.02, -29.96, -29.93), 0.3),
+        # An edge fragment far from any other
+        detection('E', (90, 50, 99, 60), (40.00, 40.01, -31.0, -30.99), 0.2),
+    ])
+
+
+def test_two_fragments_across_a_cutout_edge_are_stitched():
+    df = catalog()
+    sizes = {f: (SIZE, SIZE) for f in 'ABCDE'}
+    assert edge_fragments(df, sizes).tolist() == [True, True, False, False, True, True, True, True, True]
+
+    result, n_groups = stitch(df, sizes)
+    assert n_groups == 2 and len(result) == len(df) - 2
+    merged = result[result['n_fragments'] > 1].set_index('fragment_ids')
+    assert merged.index.tolist() == ['A;B', 'D;E']
+
+    ab = merged.loc['A;B']
+    # Label and score of the best fragment, sky extent of the union
+    assert (ab['fits_id'], ab['label'], ab['score']) == ('B', 2, 0.9)
+    np.testing.assert_allclose(ab[SKY_COLUMNS].to_numpy(np.float64), [9.96, 10.05, -30.02, -29.97], atol=1e-9)
+    np.testing.assert_allclose(ab[BBOX_COLUMNS].to_numpy(np.float64), [0, 42, 30, 72])
+
+    de = merged.loc['D;E']
+    np.testing.assert_allclose(de[SKY_COLUMNS].to_numpy(np.float64), [359.98, 0.02, -30.00, -29.93], atol=1e-9)
+
+    single = result[result['n_fragments'] == 1]
+    assert sorted(single['score']) == [0.2, 0.5, 0.5, 0.7, 0.8]
+    assert (single['fragment_ids'] == single['fits_id']).all()
+
+
+def test_fragments_outside_the_tolerance_stay_apart():
+    df = catalog().iloc[:2].copy()
+    df.loc[1, ['bbox_ra_min', 'bbox_ra_max']] = [9.95, 9.99]  # a 36 arcsec gap at the edge
+    sizes = {f: (SIZE, SIZE) for f in 'AB'}
+    assert stitch(df, sizes, tolerance_arcsec=10.0)[1] == 0
+    assert stitch(df, sizes, tolerance_arcsec=40.0)[1] == 1
+    # Without a known cutout size nothing is an edge fragment
+    assert stitch(df, {})[1] == 0
+
+
+def test_process_single_csv(tmp_path):
+    df = catalog()
+    path = tmp_path / 'processed_wcs_101.csv'
+    df.to_csv(path, index=False)
+    (tmp_path / 'out').mkdir()
+    assert process_single_csv(str(path), str(tmp_path / 'out'), cutout_size=SIZE) == (9, 7, 2)
+    out = pd.read_csv(tmp_path / 'out' / path.name)
+    assert out['n_fragments'].sum() == len(df)